@@ -0,0 +1,1220 @@
+import contextlib
+import filecmp
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+
+import numpy as np
+import pandas as pd
+
+from clima import (
+    AGREGADOS_VENTANA,
+    ALMACEN_FILE,
+    CLIMA_FILE,
+    DURACION_VENTANAS,
+    cargar_almacen,
+    clima_diario_carreras,
+    clima_ventanas_carreras,
+    dias_ventanas,
+    inicio_ventanas,
+    ubicar_carreras,
+)
+from busqueda import REJILLA, buscar_parametros
+from datos import (
+    ESQUEMA_DATASET,
+    YEAR_REFERENCIA,
+    actualizar_cache,
+    guardar_dataset,
+    leer_csv_dataset,
+    leer_dataset,
+    leer_tabla,
+    tipar_dataset,
+)
+from entry import construir_filas_carreras
+from etapas import CacheEtapas
+from modelo import (
+    DATASET_FILE,
+    OBJETIVO,
+    VERSION_ARTEFACTO,
+    cargar_modelo,
+    columnas_modelo,
+    crear_pipeline,
+    entrenar_modelo,
+    predecir_carrera,
+)
+from features import (
+    ESTADISTICOS_PREVIOS,
+    VENTANA_HISTORIAL,
+    VENTANA_TEMPORADA,
+    actualizar_estado,
+    agregados_previos,
+    anadir_columnas,
+    calcular_features_desde_estado,
+    calcular_victorias_previas,
+    calcular_posicion_companero,
+    cargar_estado,
+    indexar,
+    parsear_tiempos_clasificacion,
+)
+from forma import COLUMNAS_FORMA, calcular_features_forma, historial_resultados
+from paradas import (
+    COLUMNAS_PARADAS,
+    DEFECTO_PARADAS,
+    agregados_paradas,
+    calcular_features_paradas,
+    leer_paradas,
+)
+from perfil import RegistroEtapas, rss_actual_mb
+from rendimiento import preparar_datos
+from prueba_carga import comparar_lotes, pedir, servicio_local
+from script_carga import TABLAS_BLOQUE, generar_dataset_f1_completo, info_carreras, victorias_carreras
+from simulacion import PUNTOS, predecir_carreras, residuos_modelo, simular_temporada
+from weather import (
+    MAX_DIAS_PETICION,
+    VARIABLES_HORARIAS,
+    LimiteUsoError,
+    actualizar_almacen,
+    agrupar_peticiones,
+    get_weather_data,
+    obtener_clima_carreras,
+)
+
+PROCESS_FROM_YEAR = 2001
+
+
+def medir(funcion, *args, repeticiones=1):
+    """Ejecuta una función varias veces y devuelve (mejor tiempo en segundos, resultado)."""
+    mejor = float('inf')
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def cargar_filas_carrera(process_from_year=PROCESS_FROM_YEAR):
+    """Construye las filas (RACEID, DRIVERID, CONSTRUCTORID, DRIVER LAST POSITION) desde process_from_year."""
+    races_df = pd.read_csv('f1_data/races.csv')[['raceId', 'year']]
+    recent_race_ids = races_df[races_df['year'] >= process_from_year]['raceId']
+
+    filas = pd.read_csv('f1_data/results.csv')[['raceId', 'driverId', 'constructorId', 'position']]
+    filas = filas[filas['raceId'].isin(recent_race_ids)]
+    filas = filas.rename(columns={'raceId': 'RACEID', 'driverId': 'DRIVERID', 'constructorId': 'CONSTRUCTORID'})
+    filas['position'] = pd.to_numeric(filas['position'], errors='coerce')
+
+    filas = filas.sort_values(['DRIVERID', 'RACEID']).reset_index(drop=True)
+    filas['DRIVER LAST POSITION'] = filas.groupby('DRIVERID')['position'].shift(1).fillna(21).astype(int)
+    return filas.sort_values(['RACEID', 'DRIVERID']).reset_index(drop=True)
+
+
+def posicion_companero_iterrows(merged_df):
+    """Implementación original (bucle por filas) de MATE LAST POSITION, como referencia."""
+    mate_positions = []
+    for idx, row in merged_df.iterrows():
+        mate = merged_df[
+            (merged_df['RACEID'] == row['RACEID']) &
+            (merged_df['CONSTRUCTORID'] == row['CONSTRUCTORID']) &
+            (merged_df['DRIVERID'] != row['DRIVERID'])
+        ]
+        if mate.empty:
+            mate_positions.append(21)
+        else:
+            mate_last_pos = mate['DRIVER LAST POSITION'].iloc[0]
+            mate_positions.append(int(mate_last_pos) if pd.notna(mate_last_pos) else 21)
+    return pd.Series(mate_positions, index=merged_df.index)
+
+
+def benchmark_mate_last_position():
+    """Compara el bucle iterrows con la auto-unión agrupada sobre el dataset 2001+."""
+    filas = cargar_filas_carrera()
+    print(f"MATE LAST POSITION sobre {len(filas)} filas (carreras desde {PROCESS_FROM_YEAR})")
+
+    tiempo_antiguo, antiguo = medir(posicion_companero_iterrows, filas)
+    tiempo_nuevo, nuevo = medir(
+        calcular_posicion_companero, filas, filas, ['RACEID', 'CONSTRUCTORID'], 'DRIVER LAST POSITION',
+        repeticiones=5
+    )
+
+    assert antiguo.equals(nuevo), "Las dos implementaciones no coinciden"
+    print(f"  iterrows:           {tiempo_antiguo:8.3f} s")
+    print(f"  auto-unión agrupada:{tiempo_nuevo:8.3f} s  (x{tiempo_antiguo / tiempo_nuevo:.0f})")
+
+
+def victorias_apply(filas_df, wins_by_race, clave):
+    """Implementación original (apply por filas de calc_wins) de las victorias previas, como referencia."""
+    def calc_wins(key, current_race_order, current_year):
+        # WINS CAREER: todas las victorias antes de esta carrera
+        wins_career = wins_by_race[(wins_by_race[clave] == key) & (wins_by_race['RACE_ORDER'] < current_race_order)].shape[0]
+        # WINS SEASON: victorias en la temporada antes de esta carrera
+        wins_season = wins_by_race[(wins_by_race[clave] == key) & (wins_by_race['RACE_ORDER'] < current_race_order) & (wins_by_race['YEAR'] == current_year)].shape[0]
+        return wins_career, wins_season
+
+    wins_data = filas_df.apply(lambda row: calc_wins(row[clave], row['RACE_ORDER'], row['YEAR']), axis=1, result_type='expand')
+    return wins_data[0].fillna(0).astype(int), wins_data[1].fillna(0).astype(int)
+
+
+def benchmark_victorias(process_from_year=1950, paso=25):
+    """
+    Compara WINS CAREER, WINS SEASON y CONSTRUCTOR WINS SEASON del motor
+    acumulativo con el apply original de calc_wins sobre una de cada `paso`
+    filas, y mide el motor sobre todas las carreras desde process_from_year.
+    """
+    race_info = info_carreras(pd.read_csv('f1_data/races.csv'))
+    results = pd.read_csv('f1_data/results.csv')[['raceId', 'driverId', 'constructorId', 'position']]
+    results['position'] = pd.to_numeric(results['position'], errors='coerce')
+
+    filas = cargar_filas_carrera(process_from_year)
+    filas = anadir_columnas(filas, [(indexar(race_info.rename(columns={'year': 'YEAR'}), ['raceId']), ['RACEID'])])
+    muestra = filas.iloc[::paso]
+    print(f"Victorias previas sobre {len(filas)} filas (carreras desde {process_from_year}); referencia sobre {len(muestra)}")
+
+    for columna, clave in (('driverId', 'DRIVERID'), ('constructorId', 'CONSTRUCTORID')):
+        victorias = victorias_carreras(results, race_info, columna, clave)
+        tiempo_antiguo, antiguo = medir(victorias_apply, muestra, victorias, clave)
+        tiempo_nuevo, (career, season) = medir(calcular_victorias_previas, filas, victorias, clave, repeticiones=3)
+
+        assert np.array_equal(career.loc[muestra.index].to_numpy(), antiguo[0].to_numpy()), f"WINS CAREER ({clave}) no coincide"
+        assert np.array_equal(season.loc[muestra.index].to_numpy(), antiguo[1].to_numpy()), f"WINS SEASON ({clave}) no coincide"
+        estimado = tiempo_antiguo * len(filas) / len(muestra)
+        print(f"  {clave}:")
+        print(f"    apply de calc_wins:   {estimado:8.3f} s  (estimado desde {tiempo_antiguo:.3f} s en la muestra)")
+        print(f"    motor acumulativo:    {tiempo_nuevo:8.3f} s  (x{estimado / tiempo_nuevo:.0f})")
+
+
+def time_to_milliseconds(time_str):
+    """Conversor original por valor de Q1/Q2/Q3, como referencia."""
+    if pd.isna(time_str):
+        return None
+    try:
+        parts = str(time_str).split(':')
+        minutes = int(parts[0])
+        seconds = float(parts[1])
+        return int(minutes * 60 * 1000 + seconds * 1000)
+    except:
+        return None
+
+
+def tiempos_clasificacion_apply(qualifying_df):
+    """Conversión original: un Series.apply por columna y relleno con 300000."""
+    return np.column_stack([
+        qualifying_df[col].apply(time_to_milliseconds).fillna(300000).to_numpy()
+        for col in ['q1', 'q2', 'q3']
+    ])
+
+
+def tiempos_clasificacion_vectorizado(qualifying_df):
+    """Conversión vectorizada de las tres columnas a la vez."""
+    q_ms, q_validos = parsear_tiempos_clasificacion(qualifying_df[['q1', 'q2', 'q3']])
+    return np.where(q_validos, q_ms, 300000)
+
+
+def benchmark_tiempos_clasificacion():
+    """Compara el parser por valor con el vectorizado sobre qualifying.csv completo."""
+    qualifying_df = pd.read_csv('f1_data/qualifying.csv')
+    print(f"Q1/Q2/Q3 sobre {len(qualifying_df)} filas de qualifying.csv")
+
+    tiempo_antiguo, antiguo = medir(tiempos_clasificacion_apply, qualifying_df, repeticiones=5)
+    tiempo_nuevo, nuevo = medir(tiempos_clasificacion_vectorizado, qualifying_df, repeticiones=5)
+
+    assert (antiguo == nuevo).all(), "Las dos implementaciones no coinciden"
+    print(f"  Series.apply:       {tiempo_antiguo:8.3f} s")
+    print(f"  vectorizado:        {tiempo_nuevo:8.3f} s  (x{tiempo_antiguo / tiempo_nuevo:.1f})")
+
+
+TABLAS_POR_CARRERA = ['results.csv', 'sprint_results.csv', 'qualifying.csv', 'driver_standings.csv', 'constructor_standings.csv']
+
+
+def copiar_datos_hasta(destino, ultima_carrera=None):
+    """Copia f1_data y los datos meteorológicos a destino, recortando las tablas por carrera a raceId <= ultima_carrera."""
+    os.makedirs(os.path.join(destino, 'f1_data'), exist_ok=True)
+    shutil.copy(CLIMA_FILE, destino)
+    if os.path.exists(ALMACEN_FILE):
+        shutil.copy(ALMACEN_FILE, destino)
+    for archivo in os.listdir('f1_data'):
+        origen = os.path.join('f1_data', archivo)
+        if ultima_carrera is not None and archivo in TABLAS_POR_CARRERA:
+            tabla = pd.read_csv(origen, dtype=str, keep_default_na=False)
+            tabla[tabla['raceId'].astype(int) <= ultima_carrera].to_csv(os.path.join(destino, 'f1_data', archivo), index=False)
+        else:
+            shutil.copy(origen, os.path.join(destino, 'f1_data'))
+
+
+def generar_en(directorio, **kwargs):
+    """Ejecuta generar_dataset_f1_completo con directorio como carpeta de trabajo, sin su salida por pantalla."""
+    actual = os.getcwd()
+    os.chdir(directorio)
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            inicio = time.perf_counter()
+            generar_dataset_f1_completo(**kwargs)
+            return time.perf_counter() - inicio
+    finally:
+        os.chdir(actual)
+
+
+def calentar_tablas(directorio):
+    """Convierte a la caché columnar de leer_tabla las tablas de f1_data de directorio, fuera del tiempo medido."""
+    actual = os.getcwd()
+    os.chdir(directorio)
+    try:
+        for tabla in TABLAS_BLOQUE:
+            actualizar_cache(tabla)
+    finally:
+        os.chdir(actual)
+
+
+def benchmark_dataset_incremental(cortes=(1130, 1150)):
+    """
+    Comprueba que construir el dataset hasta cortes[0] y añadir después las
+    carreras nuevas de forma incremental da el mismo archivo que una
+    reconstrucción completa, y compara los tiempos de ambos modos, los dos con
+    la caché de tablas ya convertida (cada paso cambia los CSV de f1_data).
+    """
+    salida = 'f1_training_data_2014_onwards.csv'
+    with tempfile.TemporaryDirectory() as completo, tempfile.TemporaryDirectory() as incremental:
+        copiar_datos_hasta(completo)
+        calentar_tablas(completo)
+        tiempo_completo = generar_en(completo)
+
+        copiar_datos_hasta(incremental, cortes[0])
+        generar_en(incremental)
+        tiempos_incrementales = []
+        for corte in list(cortes[1:]) + [None]:
+            shutil.rmtree(os.path.join(incremental, 'f1_data'))
+            copiar_datos_hasta(incremental, corte)
+            calentar_tablas(incremental)
+            tiempos_incrementales.append(generar_en(incremental, incremental=True))
+
+        print(f"Dataset incremental desde raceId {cortes[0]} en {len(tiempos_incrementales)} pasos")
+        assert filecmp.cmp(os.path.join(completo, salida), os.path.join(incremental, salida), shallow=False), \
+            "El dataset incremental no coincide con la reconstrucción completa"
+        print(f"  reconstrucción:     {tiempo_completo:8.3f} s")
+        print(f"  incremental (paso): {max(tiempos_incrementales):8.3f} s  (idéntico a la reconstrucción)")
+
+
+def benchmark_features_carrera(carreras=(1100, 1145, 1167)):
+    """
+    Comprueba que las features históricas calculadas desde el estado (entry.py)
+    coinciden con las del dataset de entrenamiento para la carrera siguiente al
+    estado, y mide el tiempo de la consulta.
+
+    Se excluyen LAPS RACE (en predicción no se conoce y se toma la última carrera
+    en el circuito) y CONSTRUCTOR POINTS BEFORE GP del segundo piloto de cada
+    equipo, que en el dataset toma los puntos de la propia carrera de su compañero.
+    """
+    columnas = ['DRIVER LAST POSITION', 'POINTS BEFORE GP', 'YEARS OF EXPERIENCE', 'WINS CAREER', 'WINS SEASON',
+                'MATE LAST POSITION', 'CONSTRUCTOR WINS SEASON']
+    dataset = pd.read_csv('f1_training_data_2014_onwards.csv')
+    dataset['YEAR'] += 2025
+    print(f"Features desde el estado para las carreras {list(carreras)}")
+
+    tiempos = []
+    for carrera in carreras:
+        with tempfile.TemporaryDirectory() as directorio:
+            copiar_datos_hasta(directorio, carrera - 1)
+            generar_en(directorio)
+            actual = os.getcwd()
+            os.chdir(directorio)
+            try:
+                estado = cargar_estado()
+            finally:
+                os.chdir(actual)
+
+        filas = dataset[dataset['RACEID'] == carrera]
+        tiempo, features = medir(calcular_features_desde_estado, filas, *estado, repeticiones=5)
+        tiempos.append(tiempo)
+
+        assert features[columnas].equals(filas[columnas]), f"Las features de la carrera {carrera} no coinciden"
+        primeros = ~filas['CONSTRUCTORID'].duplicated()
+        assert (features['CONSTRUCTOR POINTS BEFORE GP'][primeros] == filas['CONSTRUCTOR POINTS BEFORE GP'][primeros]).all(), \
+            f"CONSTRUCTOR POINTS BEFORE GP de la carrera {carrera} no coincide"
+    print(f"  desde el estado:    {max(tiempos):8.3f} s por carrera (idéntico al dataset)")
+
+
+def benchmark_cache_datos():
+    """
+    Compara la carga de todas las tablas de f1_data desde CSV y desde la caché
+    columnar, y el dataset completo en frío (caché vacía) y en caliente.
+    """
+    tablas = [archivo[:-4] for archivo in sorted(os.listdir('f1_data')) if archivo.endswith('.csv')]
+    with tempfile.TemporaryDirectory() as directorio:
+        copiar_datos_hasta(directorio)
+        actual = os.getcwd()
+        os.chdir(directorio)
+        try:
+            tiempo_csv, _ = medir(lambda: [pd.read_csv(f'f1_data/{tabla}.csv') for tabla in tablas], repeticiones=5)
+            tiempo_conversion, _ = medir(lambda: [leer_tabla(tabla) for tabla in tablas])
+            tiempo_cache, _ = medir(lambda: [leer_tabla(tabla) for tabla in tablas], repeticiones=5)
+        finally:
+            os.chdir(actual)
+        shutil.rmtree(os.path.join(directorio, 'f1_data_cache'))
+
+        tiempo_frio = generar_en(directorio)
+        tiempo_caliente = min(generar_en(directorio) for _ in range(3))
+
+    print(f"Caché columnar de {len(tablas)} tablas de f1_data")
+    print(f"  lectura CSV:        {tiempo_csv:8.3f} s")
+    print(f"  conversión inicial: {tiempo_conversion:8.3f} s")
+    print(f"  lectura caché:      {tiempo_cache:8.3f} s  (x{tiempo_csv / tiempo_cache:.1f})")
+    print(f"  dataset en frío:    {tiempo_frio:8.3f} s")
+    print(f"  dataset en caliente:{tiempo_caliente:8.3f} s")
+
+
+class ClimaSimulado:
+    """
+    Sustituto local de Open-Meteo para weather.py: devuelve datos horarios
+    deterministas tras una latencia fija y responde con un límite de uso
+    (429) en una de cada `limite_cada` peticiones. Cuenta las peticiones y los
+    días pedidos en total y en la más larga.
+    """
+
+    def __init__(self, latencia=0.05, limite_cada=0):
+        self.latencia = latencia
+        self.limite_cada = limite_cada
+        self.peticiones = 0
+        self.dias = 0
+        self.max_dias = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, latitude, longitude, start_date, end_date):
+        dias = int((np.datetime64(end_date, 'D') - np.datetime64(start_date, 'D')).astype(int)) + 1
+        with self.lock:
+            self.peticiones += 1
+            self.dias += dias
+            self.max_dias = max(self.max_dias, dias)
+            limitada = self.limite_cada and self.peticiones % self.limite_cada == 0
+        time.sleep(self.latencia)
+        if limitada:
+            raise LimiteUsoError("Minutely API request limit exceeded")
+
+        horas = np.arange(np.datetime64(start_date, 'h'), np.datetime64(end_date, 'h') + 24).astype('datetime64[s]')
+        t = horas.astype(np.int64) / 3600
+        hourly = {
+            variable: (np.sin(t / 24 + latitude * (k + 1)) * 10 + longitude + 20 * k).astype(np.float32)
+            for k, variable in enumerate(VARIABLES_HORARIAS)
+        }
+        return horas, hourly
+
+
+def benchmark_clima_concurrente(latencia=0.05):
+    """
+    Compara, contra un Open-Meteo simulado con latencia, el bucle original (una
+    petición por carrera) con las peticiones agrupadas por circuito en paralelo.
+    """
+    races = pd.read_csv('f1_data/races.csv')
+    races = races[(races['raceId'] >= 900) & (races['raceId'] <= 1167)][['raceId', 'circuitId', 'date']]
+    carreras = races.merge(pd.read_csv('f1_data/circuits.csv')[['circuitId', 'lat', 'lng']], on='circuitId')
+
+    serie = ClimaSimulado(latencia)
+    inicio = time.perf_counter()
+    antiguo = {
+        int(row['raceId']): get_weather_data(row['lat'], row['lng'], row['date'], pedir=serie)
+        for _, row in carreras.iterrows()
+    }
+    tiempo_serie = time.perf_counter() - inicio
+
+    paralelo = ClimaSimulado(latencia, limite_cada=7)
+    inicio = time.perf_counter()
+    nuevo = obtener_clima_carreras(carreras, pedir=paralelo, espera_base=latencia)
+    tiempo_paralelo = time.perf_counter() - inicio
+
+    assert antiguo == nuevo, "Las dos descargas no coinciden"
+    assert paralelo.max_dias <= MAX_DIAS_PETICION, "Alguna petición supera MAX_DIAS_PETICION días"
+    # Sin 429 simulados: días realmente necesarios para las peticiones agrupadas
+    agrupado = ClimaSimulado(0)
+    obtener_clima_carreras(carreras, pedir=agrupado)
+    assert agrupado.dias <= len(carreras) * MAX_DIAS_PETICION, "Las peticiones agrupadas piden demasiados días"
+    sin_limite = sum(
+        (pd.Timestamp(fin) - pd.Timestamp(inicio)).days + 1
+        for _, _, inicio, fin, _ in agrupar_peticiones(carreras, max_dias=None)
+    )
+    print(f"Clima de {len(carreras)} carreras contra Open-Meteo simulado ({latencia * 1000:.0f} ms por petición)")
+    print(f"  bucle en serie:     {tiempo_serie:8.3f} s  {serie.peticiones:4d} peticiones  {serie.dias:6d} días  {len(carreras) / tiempo_serie:7.1f} carreras/s")
+    print(f"  agrupado/paralelo:  {tiempo_paralelo:8.3f} s  {paralelo.peticiones:4d} peticiones  {paralelo.dias:6d} días  {len(carreras) / tiempo_paralelo:7.1f} carreras/s"
+          f"  (con 429 simulados)")
+    print(f"  días pedidos sin 429: {agrupado.dias} en bloques de hasta {MAX_DIAS_PETICION} días "
+          f"(un rango por circuito pediría {sin_limite})")
+
+
+def benchmark_almacen_clima(latencia=0.05):
+    """
+    Llena el almacén horario contra Open-Meteo simulado, comprueba que una
+    segunda pasada no hace peticiones y que los agregados calculados desde el
+    almacén coinciden con los de la descarga directa.
+    """
+    carreras = ubicar_carreras()
+    carreras = carreras[(carreras['raceId'] >= 900) & (carreras['raceId'] <= 1167)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, ALMACEN_FILE)
+        simulado = ClimaSimulado(latencia)
+        inicio = time.perf_counter()
+        actualizar_almacen(carreras, ruta=ruta, pedir=simulado)
+        tiempo_llenado = time.perf_counter() - inicio
+        peticiones_llenado = simulado.peticiones
+
+        actualizar_almacen(carreras, ruta=ruta, pedir=simulado)
+        assert simulado.peticiones == peticiones_llenado, "La segunda pasada no debería pedir nada"
+
+        tiempo_almacen, clima = medir(clima_diario_carreras, carreras['raceId'], ruta,
+                                      os.path.join(tmp, 'sin_csv.csv'), repeticiones=3)
+        tamano = os.path.getsize(ruta)
+        dias = len(cargar_almacen(ruta)['dia'])
+
+    inicio = time.perf_counter()
+    directo = obtener_clima_carreras(carreras, pedir=ClimaSimulado(latencia))
+    tiempo_directo = time.perf_counter() - inicio
+
+    desde_almacen = clima.set_index('raceId').drop(columns=['circuitId', 'latitude', 'longitude'])
+    assert desde_almacen.to_dict('index') == directo, "Los agregados del almacén no coinciden con la descarga"
+    print(f"Almacén horario: {dias} días, {tamano / 1024:.0f} KiB; llenado en {tiempo_llenado:.3f} s ({peticiones_llenado} peticiones)")
+    print(f"  agregados desde el almacén: {tiempo_almacen:8.3f} s  (0 peticiones)")
+    print(f"  descarga directa:           {tiempo_directo:8.3f} s")
+
+
+def clima_ventanas_bucle(carreras, pedir):
+    """
+    Referencia: una petición por carrera y ventana, y agregados con un bucle en
+    Python (medias con la hora de inicio, sumas sin ella: la muestra de la hora
+    h acumula (h - 1, h]).
+    """
+    filas = []
+    inicios = inicio_ventanas(carreras)
+    for k, (_, row) in enumerate(carreras.iterrows()):
+        fila = {'raceId': row['raceId']}
+        for ventana, inicio in inicios.items():
+            desde = inicio[k].astype('datetime64[h]')
+            hasta = np.ceil((inicio[k] + np.timedelta64(DURACION_VENTANAS[ventana], 'h') - desde) / np.timedelta64(1, 'h'))
+            horas, hourly = pedir(row['lat'], row['lng'], str(desde.astype('datetime64[D]')),
+                                  str((desde + np.timedelta64(int(hasta), 'h')).astype('datetime64[D]')))
+            fin = desde + np.timedelta64(int(hasta), 'h')
+            for nombre, (variable, estadistico) in AGREGADOS_VENTANA.items():
+                en_ventana = ((horas >= desde) if estadistico == 'mean' else (horas > desde)) & (horas <= fin)
+                valores = hourly[variable][en_ventana].astype(np.float64)
+                fila[f'{ventana} {nombre}'] = round(valores.mean() if estadistico == 'mean' else valores.sum(), 2)
+        filas.append(fila)
+    return pd.DataFrame(filas)
+
+
+def benchmark_clima_ventanas():
+    """
+    Clima de las ventanas de carrera y clasificación: cálculo vectorizado desde
+    el almacén horario frente a un bucle por carrera con una petición por ventana.
+    """
+    carreras = ubicar_carreras()
+    carreras = carreras[(carreras['raceId'] >= 900) & (carreras['raceId'] <= 1167)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, ALMACEN_FILE)
+        simulado = ClimaSimulado(latencia=0)
+        actualizar_almacen(pd.concat([carreras[['lat', 'lng', 'date']], dias_ventanas(carreras)]), ruta=ruta, pedir=simulado)
+        tiempo_vectorizado, vectorizado = medir(clima_ventanas_carreras, carreras['raceId'], ruta, repeticiones=3)
+
+    referencia = ClimaSimulado(latencia=0)
+    tiempo_bucle, bucle = medir(clima_ventanas_bucle, carreras, referencia)
+
+    pd.testing.assert_frame_equal(vectorizado.reset_index(drop=True), bucle, check_dtype=False, atol=0.011)
+    print(f"Clima por ventana de sesión de {len(carreras)} carreras ({vectorizado.isna().sum().sum()} valores sin datos)")
+    print(f"  bucle por carrera:   {tiempo_bucle:8.3f} s  {referencia.peticiones:4d} peticiones")
+    print(f"  vectorizado/almacén: {tiempo_vectorizado:8.3f} s     0 peticiones")
+
+
+def benchmark_modelo(race_file='f1_race_1168_data.csv'):
+    """
+    Entrena y guarda el modelo una vez y mide lo que cuesta después cargarlo y
+    predecir una carrera; comprueba que se rechazan artefactos con otro esquema.
+    """
+    import joblib
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, 'modelo.joblib')
+        tiempo_entrenamiento, _ = medir(entrenar_modelo, 'f1_training_data_2014_onwards.csv', ruta)
+        tiempo_carga, artefacto = medir(cargar_modelo, ruta, repeticiones=5)
+        tiempo_prediccion, prediccion = medir(predecir_carrera, race_file, artefacto, repeticiones=5)
+
+        for cambio in ({'columnas': artefacto['columnas'][:-1]}, {'version': VERSION_ARTEFACTO + 1}):
+            joblib.dump({**artefacto, **cambio}, ruta)
+            try:
+                cargar_modelo(ruta)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"Se cargó un modelo incompatible ({list(cambio)})")
+
+    assert prediccion['PREDICTED POSITION'].tolist() == list(range(1, len(prediccion) + 1))
+    print(f"Modelo persistido ({len(artefacto['columnas'])} features)")
+    print(f"  entrenamiento y guardado: {tiempo_entrenamiento:8.3f} s")
+    print(f"  carga del artefacto:      {tiempo_carga:8.3f} s")
+    print(f"  predicción ({len(prediccion)} pilotos):  {tiempo_prediccion:8.3f} s")
+
+
+def grid_search_notebook(df, rejilla=REJILLA):
+    """GridSearchCV de entrenamiento_modelo.ipynb: KFold barajado sobre los años anteriores al holdout."""
+    from sklearn.model_selection import GridSearchCV, KFold
+
+    train = df[df['YEAR'] < df['YEAR'].max() - 1]
+    columnas = columnas_modelo()
+    grid_search = GridSearchCV(
+        crear_pipeline(columnas), {f'model__{clave}': valores for clave, valores in rejilla.items()},
+        cv=KFold(n_splits=5, shuffle=True, random_state=42), scoring='neg_mean_squared_error', n_jobs=-1,
+    )
+    grid_search.fit(train[columnas], np.log1p(train['MS RACE']))
+    return grid_search.best_params_
+
+
+def benchmark_busqueda(rejilla=REJILLA):
+    """
+    Compara el GridSearchCV de los notebooks con la búsqueda por temporadas
+    (staged_predict, en paralelo) y comprueba que, con la caché, añadir una
+    carrera no vuelve a calcular ninguna división.
+    """
+    df = pd.read_csv('f1_training_data_2014_onwards.csv')
+    tiempo_grid, mejores_grid = medir(grid_search_notebook, df, rejilla)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Dataset sin la última carrera y, después, completo (una carrera nueva)
+        anterior = os.path.join(tmp, 'anterior.csv')
+        df[df['RACEID'] < df['RACEID'].max()].to_csv(anterior, index=False)
+        cache = os.path.join(tmp, 'cache')
+        tiempo_busqueda, (tabla, ajustes) = medir(buscar_parametros, anterior, rejilla, 3, 1, -1, cache)
+        inicio = time.perf_counter()
+        tabla_nueva, ajustes_nuevos = buscar_parametros('f1_training_data_2014_onwards.csv', rejilla, cache_dir=cache)
+        tiempo_nueva = time.perf_counter() - inicio
+
+    assert ajustes_nuevos == 0, "Añadir una carrera no debería recalcular divisiones"
+    pd.testing.assert_frame_equal(tabla, tabla_nueva)
+    print(f"Búsqueda de hiperparámetros ({len(tabla)} combinaciones)")
+    print(f"  GridSearchCV (KFold 5):             {tiempo_grid:8.1f} s  {mejores_grid}")
+    mejor = tabla.iloc[0]
+    print(f"  por temporadas (staged_predict):    {tiempo_busqueda:8.1f} s  {ajustes} ajustes, mejor "
+          f"n_estimators={mejor['n_estimators']:.0f} learning_rate={mejor['learning_rate']} max_depth={mejor['max_depth']:.0f}")
+    print(f"  tras añadir una carrera (caché):    {tiempo_nueva:8.1f} s  {ajustes_nuevos} ajustes")
+
+
+def benchmark_motores(race_file='f1_race_1168_data.csv'):
+    """
+    Compara los motores de boosting con los parámetros por defecto: tiempo de
+    ajuste, latencia de predicción de una carrera y RMSE/MAPE (en ms) sobre el
+    holdout de los notebooks (2024 en adelante).
+    """
+    df = pd.read_csv('f1_training_data_2014_onwards.csv')
+    ultimo_anio = df['YEAR'].max() - 1
+    train, test = df[df['YEAR'] < ultimo_anio], df[df['YEAR'] >= ultimo_anio]
+    carrera = pd.read_csv(race_file)
+    columnas = columnas_modelo()
+
+    print(f"Motores de boosting ({len(train)} filas de entrenamiento, {len(test)} de holdout)")
+    for motor, nulos_nativos in (('gbr', False), ('hist', False), ('hist', True)):
+        pipeline = crear_pipeline(columnas, motor=motor, nulos_nativos=nulos_nativos)
+        tiempo_ajuste, _ = medir(pipeline.fit, train[columnas], np.log1p(train['MS RACE']))
+        tiempo_prediccion, _ = medir(pipeline.predict, carrera[columnas], repeticiones=20)
+        y_pred = np.expm1(pipeline.predict(test[columnas]))
+        rmse = np.sqrt(np.mean((test['MS RACE'] - y_pred) ** 2))
+        mape = np.mean(np.abs((test['MS RACE'] - y_pred) / test['MS RACE']))
+        nombre = motor + (' (centinelas como nulos)' if nulos_nativos else '')
+        print(f"  {nombre:30s} ajuste {tiempo_ajuste:7.3f} s  predicción {tiempo_prediccion * 1000:6.2f} ms  "
+              f"RMSE {rmse:12,.0f} ms  MAPE {mape:7.2%}")
+
+
+
+def simular_temporada_bucle(race_ids, artefacto, min_year=2014):
+    """
+    Una simulación determinista carrera a carrera con DataFrames: construye las
+    filas de cada carrera desde el estado y lo actualiza con actualizar_estado,
+    como haría script_carga.py si los resultados predichos fueran reales.
+
+    Devuelve:
+        Series: POINTS STANDINGS final por DRIVERID de los pilotos simulados.
+    """
+    estado_pilotos, estado_constructores, estado_circuitos = cargar_estado(min_year)
+    anios = leer_tabla('races', ['raceId', 'year'], race_ids=race_ids).set_index('raceId')['year']
+    pilotos = set()
+    for race_id in race_ids:
+        filas = construir_filas_carreras([race_id], estado_pilotos, estado_constructores, estado_circuitos,
+                                         descargar_clima=False)
+        filas['YEAR'] = anios[race_id]
+        filas['LAST POSITION'] = pd.Series(artefacto['pipeline'].predict(filas[artefacto['columnas']]),
+                                           index=filas.index).rank(method='first').astype(int)
+        filas['PUNTOS'] = [PUNTOS[pos - 1] if pos <= len(PUNTOS) else 0 for pos in filas['LAST POSITION']]
+        ganador = filas[filas['LAST POSITION'] == 1]
+        pilotos.update(filas['DRIVERID'])
+
+        misma = filas['YEAR'] == filas['DRIVERID'].map(estado_pilotos['YEAR'])
+        filas['POINTS STANDINGS'] = filas['DRIVERID'].map(estado_pilotos['POINTS STANDINGS']).where(misma, 0).fillna(0) + filas['PUNTOS']
+        debut = estado_pilotos['DEBUT_YEAR']
+        estado_pilotos = actualizar_estado(
+            estado_pilotos, filas[['DRIVERID', 'RACEID', 'YEAR', 'LAST POSITION', 'POINTS STANDINGS']],
+            ganador[['DRIVERID', 'YEAR']], 'DRIVERID'
+        )
+        estado_pilotos['DEBUT_YEAR'] = debut
+
+        equipos = filas.groupby('CONSTRUCTORID').agg(RACEID=('RACEID', 'first'), YEAR=('YEAR', 'first'),
+                                                     PUNTOS=('PUNTOS', 'sum')).reset_index()
+        misma = equipos['YEAR'] == equipos['CONSTRUCTORID'].map(estado_constructores['YEAR'])
+        equipos['CONSTRUCTOR POINTS'] = equipos['CONSTRUCTORID'].map(estado_constructores['CONSTRUCTOR POINTS']).where(misma, 0).fillna(0) + equipos['PUNTOS']
+        estado_constructores = actualizar_estado(
+            estado_constructores, equipos[['CONSTRUCTORID', 'RACEID', 'YEAR', 'CONSTRUCTOR POINTS']],
+            ganador[['CONSTRUCTORID', 'YEAR']], 'CONSTRUCTORID'
+        )
+    return estado_pilotos.loc[sorted(pilotos), 'POINTS STANDINGS']
+
+
+def benchmark_simulacion(corte=1160, n_simulaciones=1000):
+    """
+    Simula las carreras posteriores a corte desde el estado del dataset hasta
+    corte. Comprueba que la simulación vectorizada sin ruido coincide con la
+    predicción por lotes en la primera carrera y con el bucle de DataFrames
+    (actualizar_estado) en la clasificación final, y mide temporadas por minuto.
+    """
+    carreras = leer_tabla('races', ['raceId', 'year'])
+    anio = carreras.loc[carreras['raceId'] == corte + 1, 'year'].iloc[0]
+    calendario = carreras.loc[(carreras['raceId'] > corte) & (carreras['year'] == anio), 'raceId']
+    race_ids = sorted(set(calendario) & set(leer_tabla('qualifying', ['raceId'])['raceId']))
+
+    actual = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        copiar_datos_hasta(tmp, corte)
+        generar_en(tmp)
+        for archivo in ('races.csv', 'qualifying.csv'):
+            shutil.copy(os.path.join('f1_data', archivo), os.path.join(tmp, 'f1_data'))
+        os.chdir(tmp)
+        try:
+            artefacto = entrenar_modelo()
+            prediccion = predecir_carreras(race_ids, artefacto, descargar_clima=False)
+            determinista = simular_temporada(race_ids[:1], artefacto, n_simulaciones=1, residuos=np.zeros(1),
+                                             descargar_clima=False)
+            tiempo_bucle, clasificacion_bucle = medir(simular_temporada_bucle, race_ids, artefacto)
+            clasificacion = simular_temporada(race_ids, artefacto, n_simulaciones=1, residuos=np.zeros(1),
+                                              descargar_clima=False).set_index('DRIVERID')['POINTS STANDINGS']
+            residuos = residuos_modelo(artefacto)
+            df = leer_dataset(DATASET_FILE)
+            en_muestra = np.log1p(df[OBJETIVO].to_numpy()) - artefacto['pipeline'].predict(df[artefacto['columnas']])
+            tiempo_simulacion, resumen = medir(lambda: simular_temporada(race_ids, artefacto, n_simulaciones,
+                                                                         residuos=residuos, descargar_clima=False))
+        finally:
+            os.chdir(actual)
+
+    primera = prediccion[prediccion['RACEID'] == race_ids[0]]
+    ganador = primera.loc[primera['PREDICTED POSITION'] == 1, 'DRIVERID'].iloc[0]
+    assert determinista.set_index('DRIVERID').loc[ganador, 'WINS'] == 1
+    assert determinista['POINTS'].sum() == PUNTOS.sum()
+    pd.testing.assert_series_equal(clasificacion.loc[clasificacion_bucle.index], clasificacion_bucle,
+                                   check_names=False, check_index_type=False, check_dtype=False)
+    assert np.isclose(resumen['P CHAMPION'].sum(), 1)
+
+    print(f"Simulación de temporada ({len(race_ids)} carreras tras raceId {corte})")
+    print(f"  bucle con DataFrames (1 temporada):     {tiempo_bucle:8.3f} s  "
+          f"({60 / tiempo_bucle:10,.0f} temporadas/min)")
+    print(f"  vectorizada ({n_simulaciones} temporadas):        {tiempo_simulacion:8.3f} s  "
+          f"({60 * n_simulaciones / tiempo_simulacion:10,.0f} temporadas/min)")
+    print(f"  desviación de los residuos: {residuos.std():.4f} por temporada, {en_muestra.std():.4f} en la muestra de entrenamiento")
+    print(resumen.head(5).to_string(index=False))
+
+
+def benchmark_dataset_tipado(factor=10):
+    """
+    Compara el dataset de entrenamiento leído con pd.read_csv (int64/float64)
+    con leer_dataset (ESQUEMA_DATASET): memoria, tiempo de carga desde CSV y
+    desde la caché Parquet, con el dataset real y repetido factor veces.
+    Comprueba que los valores no cambian (float32 redondeado a los decimales
+    del CSV) y que el modelo entrenado con ambos da el mismo error.
+    """
+    original = pd.read_csv('f1_training_data_2014_onwards.csv')
+    tipado = leer_dataset('f1_training_data_2014_onwards.csv')
+    assert list(tipado.columns) == list(original.columns)
+    assert all(str(tipado[col].dtype) == ESQUEMA_DATASET[col] for col in tipado.columns)
+    assert (tipado.astype(float).round(3) == original.round(3)).all(axis=None)
+
+    # El modelo se entrena igual con los tipos compactos (el Pipeline los convierte a float64)
+    columnas = columnas_modelo()
+    test = original['YEAR'] >= original['YEAR'].max() - 1
+    errores = []
+    for df in (original, tipado):
+        pipeline = crear_pipeline(columnas).fit(df.loc[~test, columnas], np.log1p(df.loc[~test, 'MS RACE']))
+        y_pred = np.expm1(pipeline.predict(df.loc[test, columnas]))
+        errores.append(np.sqrt(np.mean((df.loc[test, 'MS RACE'] - y_pred) ** 2)))
+    assert abs(errores[1] - errores[0]) / errores[0] < 0.01
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for repeticiones in (1, factor):
+            ruta = os.path.join(tmp, f'dataset_x{repeticiones}.csv')
+            guardar_dataset(pd.concat([tipado] * repeticiones, ignore_index=True), ruta)
+            tiempo_csv, df_csv = medir(pd.read_csv, ruta, repeticiones=3)
+            tiempo_esquema, _ = medir(leer_csv_dataset, ruta, repeticiones=3)
+            tiempo_cache, df_tipado = medir(leer_dataset, ruta, repeticiones=3)
+            memoria_csv = df_csv.memory_usage(deep=True).sum() / 2 ** 20
+            memoria_tipado = df_tipado.memory_usage(deep=True).sum() / 2 ** 20
+            print(f"Dataset tipado ({len(df_csv)} filas)")
+            print(f"  memoria int64/float64:       {memoria_csv:8.2f} MB")
+            print(f"  memoria ESQUEMA_DATASET:     {memoria_tipado:8.2f} MB  ({memoria_csv / memoria_tipado:.1f}x menos)")
+            print(f"  pd.read_csv:                 {tiempo_csv:8.3f} s")
+            print(f"  CSV con esquema:             {tiempo_esquema:8.3f} s")
+            print(f"  leer_dataset (Parquet):      {tiempo_cache:8.3f} s  ({tiempo_csv / tiempo_cache:.1f}x)")
+    print(f"  RMSE holdout (ms): int64/float64 {errores[0]:,.0f}  ESQUEMA_DATASET {errores[1]:,.0f}")
+
+
+def benchmark_perfil_etapas(corte=1150):
+    """
+    Perfil por etapas de generar_dataset_f1_completo (reconstrucción completa e
+    incremental tras corte): comprueba que se registran todas las etapas, que
+    cubren casi todo el tiempo y que medirlas no cambia el dataset.
+    """
+    etapas = ['carga', 'fusiones', 'clasificacion', 'tiempo_carrera', 'historico_pilotos', 'victorias_pilotos',
+              'constructores', 'companero', 'clima', 'filtrado', 'escritura', 'estado']
+    salida = 'f1_training_data_2014_onwards.csv'
+    with tempfile.TemporaryDirectory() as tmp:
+        copiar_datos_hasta(tmp, corte)
+        completo = RegistroEtapas()
+        tiempo_completo = generar_en(tmp, perfil=completo)
+        shutil.rmtree(os.path.join(tmp, 'f1_data'))
+        copiar_datos_hasta(tmp)
+        incremental = RegistroEtapas()
+        generar_en(tmp, incremental=True, perfil=incremental)
+        assert filecmp.cmp(os.path.join(tmp, salida), salida, shallow=False)
+
+    for nombre, perfil, total in (('completo', completo, tiempo_completo), ('incremental', incremental, None)):
+        resumen = perfil.resumen()
+        assert [registro['nombre'] for registro in resumen['etapas']] == etapas
+        medido = sum(registro['segundos'] for registro in resumen['etapas'])
+        if total is not None:
+            assert medido <= total and medido > 0.9 * total
+        print(f"Perfil por etapas ({nombre}, {medido:.3f} s en etapas)")
+        print('  ' + perfil.tabla().replace('\n', '\n  '))
+def replicar_carreras(df, factor):
+    """Repite cada carrera de df factor veces (raceId r -> r * factor + j), en memoria."""
+    return pd.concat([df.assign(raceId=df['raceId'] * factor + j) for j in range(factor)], ignore_index=True)
+
+
+def benchmark_fusiones(factor=50):
+    """
+    Compara la cadena de pd.merge (left join) de resultados, calificación,
+    carreras, circuitos, pilotos y standings con las búsquedas indexadas de
+    anadir_columnas: mismo DataFrame (columnas, tipos y orden de filas),
+    tiempo y pico de memoria, con las tablas reales desde 2001 repetidas factor veces.
+    """
+    claves = ['raceId', 'driverId', 'constructorId']
+    races = leer_tabla('races', ['raceId', 'circuitId', 'year', 'date'], desde_year=2001)
+    race_ids = set(races['raceId'])
+    tablas = {
+        'results': leer_tabla('results', claves + ['grid', 'milliseconds', 'statusId', 'position'], race_ids=race_ids),
+        'qualifying': leer_tabla('qualifying', claves + ['q1', 'q2', 'q3'], race_ids=race_ids),
+        'races': races,
+        'standings': leer_tabla('driver_standings', ['raceId', 'driverId', 'points', 'position'],
+                                race_ids=race_ids).rename(columns={'points': 'POINTS', 'position': 'POSITION'}),
+    }
+    tablas = {nombre: replicar_carreras(tabla, factor) for nombre, tabla in tablas.items()}
+    circuits = leer_tabla('circuits', ['circuitId', 'lap_distance_km', 'urban'])
+    drivers = leer_tabla('drivers', ['driverId', 'dob'])
+    filas = tablas['results'][claves].sort_values(claves).reset_index(drop=True)
+
+    def cadena_merge():
+        df = filas.merge(tablas['results'], on=claves, how='left')
+        df = df.merge(tablas['qualifying'], on=claves, how='left')
+        df = df.merge(tablas['races'], on='raceId', how='left')
+        df = df.merge(circuits, on='circuitId', how='left')
+        df = df.merge(drivers, on='driverId', how='left')
+        return df.merge(tablas['standings'], on=['raceId', 'driverId'], how='left')
+
+    def busquedas():
+        return anadir_columnas(filas, [
+            (indexar(tablas['results'], claves), claves),
+            (indexar(tablas['qualifying'], claves), claves),
+            (indexar(tablas['races'], ['raceId']), ['raceId']),
+            (indexar(circuits, ['circuitId']), ['circuitId']),
+            (indexar(drivers, ['driverId']), ['driverId']),
+            (indexar(tablas['standings'], ['raceId', 'driverId']), ['raceId', 'driverId']),
+        ])
+
+    perfil = RegistroEtapas()
+    print(f"Fusiones de {len(filas)} filas ({factor}x las carreras desde 2001)")
+    resultados = {}
+    for nombre, funcion in (('pd.merge', cadena_merge), ('búsquedas', busquedas)):
+        inicio = rss_actual_mb()
+        with perfil.etapa(nombre):
+            resultados[nombre] = funcion()
+        registro = perfil.etapas[-1]
+        print(f"  {nombre:12s} {registro['segundos']:8.3f} s  pico +{registro['rss_pico_mb'] - inicio:6.1f} MB")
+    pd.testing.assert_frame_equal(resultados['búsquedas'], resultados['pd.merge'])
+    print("  (mismo DataFrame)")
+
+
+def benchmark_temporadas_paralelo(process_from_year=1950, n_jobs=(2, -1)):
+    """
+    Reconstruye el dataset desde process_from_year en un solo proceso y por
+    temporadas en procesos (n_jobs): los cuatro archivos (dataset y estados)
+    deben ser idénticos. Compara los tiempos; n_jobs se limita a los núcleos,
+    así que con un solo núcleo todos los casos van sin pool y tardan lo mismo.
+    """
+    archivos = ['f1_training_data_2014_onwards.csv'] + [
+        f'f1_training_data_2014_onwards_estado_{nombre}.csv' for nombre in ('pilotos', 'constructores', 'circuitos')]
+    with tempfile.TemporaryDirectory() as secuencial:
+        copiar_datos_hasta(secuencial)
+        tiempos = {1: generar_en(secuencial, process_from_year=process_from_year)}
+        for n in n_jobs:
+            with tempfile.TemporaryDirectory() as paralelo:
+                copiar_datos_hasta(paralelo)
+                tiempos[n] = generar_en(paralelo, process_from_year=process_from_year, n_jobs=n)
+                for archivo in archivos:
+                    assert filecmp.cmp(os.path.join(secuencial, archivo), os.path.join(paralelo, archivo), shallow=False), \
+                        f"{archivo} con n_jobs={n} no coincide con el de un solo proceso"
+
+    print(f"Dataset por temporadas desde {process_from_year} ({os.cpu_count()} núcleos)")
+    for n, segundos in tiempos.items():
+        print(f"  n_jobs={n:<3d} {segundos:8.3f} s")
+    print("  (mismos archivos)")
+
+
+def benchmark_escritura_dataset(factor=20):
+    """
+    Escritura del dataset (repetido factor veces) como antes, to_csv de todo el
+    DataFrame y caché Parquet releyendo el CSV, frente a guardar_dataset por
+    bloques en CSV, CSV comprimido y Parquet: tiempo, pico de memoria y tamaño.
+    Comprueba que el CSV es idéntico y que leer_dataset devuelve el mismo
+    DataFrame en los tres formatos, también con columnas y años seleccionados.
+    """
+    dataset = leer_dataset('f1_training_data_2014_onwards.csv')
+    grande = pd.concat([dataset.assign(RACEID=dataset['RACEID'] * factor + j) for j in range(factor)], ignore_index=True)
+    grande = grande.sort_values('RACEID', kind='stable', ignore_index=True)
+    columnas = ['RACEID', 'DRIVERID', 'GRID', 'BEST Q', 'MS RACE']
+    seleccion = grande.loc[grande['YEAR'] >= 2022 - YEAR_REFERENCIA, columnas].reset_index(drop=True)
+
+    def como_antes(ruta):
+        tipar_dataset(grande).to_csv(ruta, index=False)
+        leer_dataset(ruta)
+
+    perfil = RegistroEtapas()
+    print(f"Escritura del dataset ({len(grande)} filas, {factor}x)")
+    with tempfile.TemporaryDirectory() as tmp:
+        # El RSS no baja al liberar memoria: la escritura de antes va la última para que
+        # su pico no oculte el de las demás
+        casos = [(f'guardar_dataset {extension}', f'dataset.{extension}', lambda ruta: guardar_dataset(grande, ruta))
+                 for extension in ('csv', 'csv.gz', 'parquet')] + [('to_csv + caché', 'antes.csv', como_antes)]
+        for nombre, archivo, escribir in casos:
+            ruta = os.path.join(tmp, archivo)
+            inicio = rss_actual_mb()
+            with perfil.etapa(nombre):
+                escribir(ruta)
+            registro = perfil.etapas[-1]
+            print(f"  {nombre:26s} {registro['segundos']:8.3f} s  pico +{registro['rss_pico_mb'] - inicio:6.1f} MB  "
+                  f"{os.path.getsize(ruta) / 2 ** 20:6.1f} MB en disco")
+        assert filecmp.cmp(os.path.join(tmp, 'antes.csv'), os.path.join(tmp, 'dataset.csv'), shallow=False)
+        assert not [archivo for archivo in os.listdir(tmp) if archivo.endswith('.tmp')]
+
+        for archivo in ('dataset.csv', 'dataset.csv.gz', 'dataset.parquet'):
+            ruta = os.path.join(tmp, archivo)
+            pd.testing.assert_frame_equal(leer_dataset(ruta), grande)
+            completo, _ = medir(leer_dataset, ruta)
+            parcial, leido = medir(lambda: leer_dataset(ruta, columnas=columnas, desde_year=2022))
+            pd.testing.assert_frame_equal(leido, seleccion)
+            print(f"  leer_dataset {archivo:16s} todo {completo:7.3f} s  {len(columnas)} columnas desde 2022 {parcial:7.3f} s")
+    print("  (mismo CSV y mismos datos en los tres formatos)")
+
+
+def features_paradas_bucle(filas_df, paradas_df, ventana=5):
+    """COLUMNAS_PARADAS fila a fila, filtrando los agregados de las carreras anteriores (referencia lenta)."""
+    pilotos, constructores, carreras = agregados_paradas(paradas_df)
+    valores = []
+    for fila in filas_df.itertuples(index=False):
+        del_circuito = carreras[(carreras['CIRCUITID'] == fila.CIRCUITID) & (carreras['RACEID'] < fila.RACEID)]
+        previas = [
+            constructores[(constructores['CONSTRUCTORID'] == fila.CONSTRUCTORID) & (constructores['RACEID'] < fila.RACEID)]
+            .sort_values('RACEID')['DIFERENCIA'].tail(ventana),
+            pilotos[(pilotos['DRIVERID'] == fila.DRIVERID) & (pilotos['RACEID'] < fila.RACEID)]
+            .sort_values('RACEID')['PARADAS'].tail(ventana),
+            del_circuito.sort_values('RACEID')['MEDIANA'].tail(1),
+            del_circuito.sort_values('RACEID')['PARADAS'].tail(1),
+        ]
+        valores.append([serie.mean() if len(serie) else DEFECTO_PARADAS[col]
+                        for serie, col in zip(previas, COLUMNAS_PARADAS)])
+    return pd.DataFrame(valores, columns=COLUMNAS_PARADAS, index=filas_df.index)
+
+
+def benchmark_paradas(desde_race_id=1100):
+    """
+    Features de paradas en boxes: compara calcular_features_paradas con una
+    referencia fila a fila (carreras desde desde_race_id), comprueba que las de
+    una carrera no cambian si cambian sus propias paradas (sin fuga) y mide la
+    etapa dentro de una reconstrucción del dataset.
+    """
+    dataset = leer_dataset('f1_training_data_2014_onwards.csv')
+    paradas_df = leer_paradas()
+    tiempo_vectorizado, features = medir(calcular_features_paradas, dataset, paradas_df, repeticiones=3)
+    filas = dataset[dataset['RACEID'] >= desde_race_id]
+    tiempo_bucle, referencia = medir(features_paradas_bucle, filas, paradas_df)
+    pd.testing.assert_frame_equal(features.loc[filas.index], referencia)
+
+    # Duplicar los tiempos y las paradas de una carrera no cambia sus propias features
+    for race_id in (1100, 1150):
+        alterado = pd.concat([paradas_df, paradas_df[paradas_df['raceId'] == race_id]], ignore_index=True)
+        alterado.loc[alterado['raceId'] == race_id, 'milliseconds'] *= 2
+        nuevas = calcular_features_paradas(dataset, alterado)
+        misma = dataset['RACEID'] <= race_id
+        pd.testing.assert_frame_equal(nuevas[misma], features[misma])
+        assert not nuevas[~misma].equals(features[~misma])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        copiar_datos_hasta(tmp)
+        generar_en(tmp, paradas=True)  # la primera crea la caché de pit_stops.csv
+        perfil = RegistroEtapas()
+        total = generar_en(tmp, paradas=True, perfil=perfil)
+    etapa = next(registro for registro in perfil.etapas if registro['nombre'] == 'paradas')
+
+    print(f"Features de paradas en boxes ({len(paradas_df)} paradas)")
+    print(f"  vectorizado ({len(dataset)} filas): {tiempo_vectorizado * 1000:8.1f} ms")
+    print(f"  fila a fila ({len(filas)} filas):  {tiempo_bucle * 1000:8.1f} ms  (mismos valores)")
+    print(f"  etapa 'paradas' en la reconstrucción: {etapa['segundos'] * 1000:.1f} ms de {total:.3f} s  (sin fuga de la propia carrera)")
+
+
+def agregados_previos_bucle(historico_df, filas_df, definiciones):
+    """agregados_previos fila a fila, filtrando las carreras anteriores de cada clave (referencia lenta)."""
+    historico_df = historico_df.sort_values('RACEID', kind='stable')
+    valores = []
+    for fila in filas_df.itertuples(index=False):
+        fila = fila._asdict()
+        anteriores = historico_df[historico_df['RACEID'] < fila['RACEID']]
+        tramos = {}
+        valores_fila = []
+        for claves, valor, ventana, estadistico in definiciones.values():
+            claves = tuple(claves) + (('YEAR',) if ventana == VENTANA_TEMPORADA else ())
+            if claves not in tramos:
+                mascara = np.logical_and.reduce([anteriores[clave].to_numpy() == fila[clave] for clave in claves])
+                tramos[claves] = anteriores[mascara]
+            serie = tramos[claves][valor]
+            if isinstance(ventana, int):
+                serie = serie.tail(ventana)
+            if estadistico == 'last':
+                valores_fila.append(serie.iloc[-1] if len(serie) else np.nan)
+            elif estadistico == 'count':
+                valores_fila.append(float(serie.count()))
+            elif estadistico == 'sum':
+                valores_fila.append(serie.sum(min_count=1))
+            else:
+                valores_fila.append(getattr(serie, estadistico)())
+        valores.append(valores_fila)
+    return pd.DataFrame(valores, columns=list(definiciones), index=filas_df.index)
+
+
+def benchmark_agregados_previos(desde_race_id=1140, corte=1150):
+    """
+    Motor de agregados previos: compara agregados_previos con una referencia fila
+    a fila para cada estadístico y tipo de ventana (últimas k carreras,
+    temporada e historial, con claves simples y compuestas y valores nulos),
+    mide las features de forma y comprueba que --forma da lo mismo de forma
+    incremental y en entry.py que en una reconstrucción completa.
+    """
+    historial = historial_resultados()
+    # Valor con nulos (uno de cada siete resultados) para probar que no cuentan
+    historial['VALOR'] = historial['POSICION'].astype(float).where(historial.index % 7 != 0)
+    definiciones = {
+        f'{"-".join(claves)} {valor} {ventana} {estadistico}': (claves, valor, ventana, estadistico)
+        for claves in (['DRIVERID'], ['DRIVERID', 'CIRCUITID'])
+        for valor in ('POSICION', 'VALOR')
+        for ventana in (3, VENTANA_TEMPORADA, VENTANA_HISTORIAL)
+        for estadistico in ESTADISTICOS_PREVIOS
+    }
+    dataset = leer_dataset('f1_training_data_2014_onwards.csv')
+    # Las ventanas de temporada usan el año, sin la transformación del dataset
+    dataset['YEAR'] = dataset['YEAR'].astype(int) + YEAR_REFERENCIA
+    tiempo_motor, agregados = medir(agregados_previos, historial, dataset, definiciones, repeticiones=3)
+    filas = dataset[dataset['RACEID'] >= desde_race_id]
+    tiempo_bucle, referencia = medir(agregados_previos_bucle, historial, filas, definiciones)
+    pd.testing.assert_frame_equal(agregados.loc[filas.index], referencia, check_dtype=False)
+    tiempo_forma, _ = medir(calcular_features_forma, dataset, historial, repeticiones=3)
+
+    salida = 'f1_training_data_2014_onwards.csv'
+    with tempfile.TemporaryDirectory() as completo, tempfile.TemporaryDirectory() as incremental:
+        copiar_datos_hasta(completo)
+        generar_en(completo, forma=True)
+        completo_df = leer_dataset(os.path.join(completo, salida))
+        copiar_datos_hasta(incremental, corte)
+        generar_en(incremental, forma=True)
+        actual = os.getcwd()
+        os.chdir(incremental)
+        try:
+            estado = cargar_estado()
+        finally:
+            os.chdir(actual)
+        shutil.rmtree(os.path.join(incremental, 'f1_data'))
+        copiar_datos_hasta(incremental)
+        generar_en(incremental, forma=True, incremental=True)
+        assert filecmp.cmp(os.path.join(completo, salida), os.path.join(incremental, salida), shallow=False), \
+            "El dataset incremental con --forma no coincide con la reconstrucción completa"
+
+    # entry.py con el estado hasta corte: las filas de la carrera siguiente, como en el dataset
+    filas_entry = construir_filas_carreras([corte + 1], *estado, descargar_clima=False, forma=True)
+    esperado = completo_df[completo_df['RACEID'] == corte + 1].set_index('DRIVERID')[COLUMNAS_FORMA]
+    pd.testing.assert_frame_equal(filas_entry.set_index('DRIVERID').loc[esperado.index, COLUMNAS_FORMA], esperado)
+
+    print(f"Agregados previos ({len(definiciones)} definiciones, {len(historial)} resultados)")
+    print(f"  motor ({len(dataset)} filas):       {tiempo_motor * 1000:8.1f} ms")
+    print(f"  fila a fila ({len(filas)} filas):  {tiempo_bucle * 1000:8.1f} ms  (mismos valores)")
+    print(f"  features de forma ({len(COLUMNAS_FORMA)}):     {tiempo_forma * 1000:8.1f} ms  "
+          "(incremental y entry.py iguales a la reconstrucción)")
+
+
+def benchmark_servicio(race_id=1168, clientes=16, peticiones=30):
+    """
+    Servicio de predicción: comprueba que predecir por raceId y por filas de
+    features da lo mismo que simulacion.predecir_carreras, que una petición con
+    nulos no hace fallar a las de su mismo lote, y compara, con
+    clientes concurrentes de una fila por petición, el servicio con micro-lotes
+    y con un predict por petición.
+    """
+    url, servicio, servidor = servicio_local()
+    try:
+        esperado = predecir_carreras([race_id], servicio.artefacto, descargar_clima=False)
+        filas = json.loads(servicio.filas_carrera(race_id).to_json(orient='records'))
+        for cuerpo in ({'race_id': race_id}, {'filas': filas}):
+            obtenido = pd.DataFrame(pedir(url, '/predecir', cuerpo)['prediccion'])
+            pd.testing.assert_frame_equal(obtenido, esperado, check_dtype=False)
+
+        # Una matriz con nulos en el mismo lote que otra válida: solo falla la suya
+        artefacto = servicio.artefacto
+        matriz, _ = servicio.matriz_carrera(race_id)
+        con_nulos = matriz.copy()
+        con_nulos[0, 0] = np.nan
+        valida, invalida = (servicio.lotes.enviar(X, artefacto) for X in (matriz, con_nulos))
+        np.testing.assert_array_equal(valida.result(), servicio.predecir_matriz(artefacto, matriz))
+        if artefacto['motor'] != 'hist':
+            assert invalida.exception() is not None
+            filas[0][artefacto['columnas'][0]] = None
+            try:
+                pedir(url, '/predecir', {'filas': filas})
+                raise AssertionError("Las filas con nulos deberían rechazarse con el motor 'gbr'")
+            except urllib.error.HTTPError as error:
+                assert error.code == 400
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+        servicio.cerrar()
+
+    resultados = comparar_lotes(race_id, clientes, peticiones)
+    print(f"Servicio de predicción ({clientes} clientes x {peticiones} peticiones de una fila, mismas predicciones)")
+    for nombre, resultado in resultados.items():
+        latencia = resultado['latencia_ms']
+        print(f"  {nombre:<10} {resultado['peticiones_por_segundo']:8.1f} pet/s  p50 {latencia['p50']:7.2f} ms  "
+              f"p99 {latencia['p99']:7.2f} ms  ({resultado['servicio']['lotes']['peticiones_media']:.1f} peticiones por predict)")
+
+
+def benchmark_cache_etapas():
+    """
+    Memoización de las etapas de calcular_bloque (etapas.CacheEtapas): con la
+    caché llena no se calcula ninguna etapa, al cambiar f1_weather_data.csv
+    solo se recalculan clima y filtrado y al cambiar max_vueltas_perdidas solo
+    las etapas desde tiempo_carrera (salvo clima). Comprueba que el dataset
+    coincide siempre con el de una ejecución sin caché y mide el tiempo ahorrado.
+    """
+    salida = 'f1_training_data_2014_onwards.csv'
+
+    def calculadas(cache):
+        return {fila['etapa'] for fila in cache.registro if fila['resultado'] == 'calculada'}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        copiar_datos_hasta(tmp)
+        cache = CacheEtapas(os.path.join(tmp, 'f1_etapas_cache'))
+        generar_en(tmp)  # cachés columnares de f1_data (ver datos.actualizar_cache)
+        tiempo_sin_cache = generar_en(tmp)
+        tiempo_vacia = generar_en(tmp, cache_etapas=cache)
+        assert filecmp.cmp(os.path.join(tmp, salida), salida, shallow=False)
+
+        cache.registro = []
+        tiempo_llena = generar_en(tmp, cache_etapas=cache)
+        assert filecmp.cmp(os.path.join(tmp, salida), salida, shallow=False)
+        assert not calculadas(cache)
+        print(f"Caché de etapas ({tiempo_sin_cache:.3f} s sin caché, {tiempo_vacia:.3f} s con la caché vacía, "
+              f"{tiempo_llena:.3f} s con la caché llena)")
+        print('  ' + cache.tabla().replace('\n', '\n  '))
+
+        # Cambiar el clima de la última carrera: solo clima y filtrado
+        clima = pd.read_csv(os.path.join(tmp, CLIMA_FILE))
+        clima.loc[clima['raceId'] == clima['raceId'].max(), 'avg_temperature_2m'] += 1
+        clima.to_csv(os.path.join(tmp, CLIMA_FILE), index=False)
+        for opciones, esperadas in (({}, {'clima', 'filtrado'}),
+                                    ({'max_vueltas_perdidas': 3}, {'tiempo_carrera', 'historico_pilotos',
+                                                                   'victorias_pilotos', 'constructores', 'companero',
+                                                                   'filtrado'})):
+            generar_en(tmp, **opciones)
+            referencia = pd.read_csv(os.path.join(tmp, salida))
+            cache.registro = []
+            tiempo = generar_en(tmp, cache_etapas=cache, **opciones)
+            assert calculadas(cache) == esperadas, calculadas(cache)
+            pd.testing.assert_frame_equal(pd.read_csv(os.path.join(tmp, salida)), referencia)
+            print(f"  {opciones or 'clima cambiado'}: {', '.join(sorted(esperadas))} recalculadas en {tiempo:.3f} s")
+
+
+def benchmark_motor_sql(factores=(1, 50)):
+    """
+    Compara el motor SQL (motor_sql.py, SQLite) con el de pandas en una
+    reconstrucción completa, con f1_data real y replicado factor veces
+    (rendimiento.preparar_datos): el dataset y los archivos de estado deben
+    coincidir byte a byte. La carga de los CSV en la base se mide aparte
+    (etapa 'ingesta', solo la primera vez). La paridad se comprueba también
+    con todo el histórico (min_year y process_from_year 1950).
+    """
+    def archivos_dataset(min_year):
+        return [f'f1_training_data_{min_year}_onwards.csv'] + [
+            f'f1_training_data_{min_year}_onwards_estado_{nombre}.csv' for nombre in ('pilotos', 'constructores', 'circuitos')]
+
+    archivos = archivos_dataset(2014)
+    with tempfile.TemporaryDirectory() as tmp:
+        preparar_datos(tmp)
+        desde_1950 = {'min_year': 1950, 'process_from_year': 1950}
+        generar_en(tmp, **desde_1950)
+        os.makedirs(os.path.join(tmp, 'pandas'))
+        for archivo in archivos_dataset(1950):
+            shutil.move(os.path.join(tmp, archivo), os.path.join(tmp, 'pandas', archivo))
+        generar_en(tmp, motor='sql', **desde_1950)
+        for archivo in archivos_dataset(1950):
+            assert filecmp.cmp(os.path.join(tmp, archivo), os.path.join(tmp, 'pandas', archivo), shallow=False), archivo
+
+    for factor in factores:
+        with tempfile.TemporaryDirectory() as tmp:
+            filas = preparar_datos(tmp, factor)
+            generar_en(tmp)  # cachés columnares de f1_data (ver datos.actualizar_cache)
+            tiempo_pandas = generar_en(tmp)
+            os.makedirs(os.path.join(tmp, 'pandas'))
+            for archivo in archivos:
+                shutil.move(os.path.join(tmp, archivo), os.path.join(tmp, 'pandas', archivo))
+
+            con_ingesta = RegistroEtapas()
+            generar_en(tmp, motor='sql', perfil=con_ingesta)
+            ingesta = next(registro['segundos'] for registro in con_ingesta.resumen()['etapas']
+                           if registro['nombre'] == 'ingesta')
+            tiempo_sql = generar_en(tmp, motor='sql')
+            for archivo in archivos:
+                assert filecmp.cmp(os.path.join(tmp, archivo), os.path.join(tmp, 'pandas', archivo), shallow=False), archivo
+        print(f"Motor SQL ({factor}x, {filas} filas en results.csv)")
+        print(f"  pandas:                  {tiempo_pandas:8.3f} s")
+        print(f"  SQLite:                  {tiempo_sql:8.3f} s  ({tiempo_pandas / tiempo_sql:.2f}x)")
+        print(f"  ingesta en SQLite:       {ingesta:8.3f} s  (solo la primera vez)")
+
+
+if __name__ == "__main__":
+    benchmark_mate_last_position()
+    benchmark_victorias()
+    benchmark_tiempos_clasificacion()
+    benchmark_dataset_incremental()
+    benchmark_features_carrera()
+    benchmark_cache_datos()
+    benchmark_clima_concurrente()
+    benchmark_almacen_clima()
+    benchmark_clima_ventanas()
+    benchmark_modelo()
+    benchmark_busqueda()
+    benchmark_motores()
+    benchmark_simulacion()
+    benchmark_dataset_tipado()
+    benchmark_perfil_etapas()
+    benchmark_fusiones()
+    benchmark_temporadas_paralelo()
+    benchmark_escritura_dataset()
+    benchmark_paradas()
+    benchmark_agregados_previos()
+    benchmark_servicio()
+    benchmark_cache_etapas()
+    benchmark_motor_sql()
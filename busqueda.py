@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from datos import leer_dataset
+from modelo import DATASET_FILE, MODEL_FILE, MOTORES, OBJETIVO, columnas_modelo, crear_pipeline, entrenar_modelo
+
+CACHE_DIR = 'f1_busqueda_cache'
+
+# Rejilla del GridSearchCV de entrenamiento_modelo.ipynb
+REJILLA = {
+    'n_estimators': [100, 200, 300],
+    'learning_rate': [0.01, 0.05, 0.1],
+    'max_depth': [3, 4, 5],
+}
+
+
+def divisiones_temporada(df, n_temporadas=3, holdout=1):
+    """
+    Divisiones de ventana creciente por temporada: se entrena con los años
+    anteriores a Y y se valida con Y, para las n_temporadas anteriores al
+    holdout (las `holdout` últimas temporadas, que quedan fuera de la búsqueda).
+
+    Devuelve:
+        list: Tuplas (año de validación, máscara de entrenamiento, máscara de validación).
+    """
+    anios = np.sort(df['YEAR'].unique())
+    validacion = anios[len(anios) - holdout - n_temporadas:len(anios) - holdout]
+    return [(int(anio), (df['YEAR'] < anio).to_numpy(), (df['YEAR'] == anio).to_numpy()) for anio in validacion]
+
+
+def huella_division(df, entrenamiento, validacion, columnas):
+    """SHA-256 de las filas y columnas que usa una división: no cambia si se añaden carreras posteriores."""
+    filas = df.loc[entrenamiento | validacion, columnas + [OBJETIVO, 'YEAR']]
+    sha = hashlib.sha256(json.dumps(columnas).encode('utf-8'))
+    sha.update(pd.util.hash_pandas_object(filas, index=False).to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+def evaluar_division(df, entrenamiento, validacion, columnas, n_estimators, motor='gbr', nulos_nativos=False,
+                     **parametros):
+    """
+    Ajusta una vez con max(n_estimators) árboles y evalúa cada tamaño con
+    staged_predict en lugar de reajustar un modelo por tamaño.
+
+    Devuelve:
+        dict: {n_estimators: RMSE de log1p(MS RACE) en la temporada de validación}.
+    """
+    pipeline = crear_pipeline(columnas, motor=motor, nulos_nativos=nulos_nativos, n_estimators=max(n_estimators),
+                              **parametros)
+    pipeline.fit(df.loc[entrenamiento, columnas], np.log1p(df.loc[entrenamiento, OBJETIVO]))
+
+    X_val = pipeline[:-1].transform(df.loc[validacion, columnas])
+    y_val = np.log1p(df.loc[validacion, OBJETIVO]).to_numpy()
+    rmse = {}
+    for arboles, y_pred in enumerate(pipeline.named_steps['model'].staged_predict(X_val), start=1):
+        if arboles in n_estimators:
+            rmse[arboles] = float(np.sqrt(np.mean((y_val - y_pred) ** 2)))
+    return rmse
+
+
+def buscar_parametros(dataset_file=DATASET_FILE, rejilla=REJILLA, n_temporadas=3, holdout=1, n_jobs=-1,
+                      cache_dir=CACHE_DIR, clima_ventanas=False, motor='gbr', nulos_nativos=False, paradas=False,
+                      forma=False):
+    """
+    Búsqueda de hiperparámetros del regresor de boosting con validación
+    por temporadas, en paralelo y con caché en disco de cada división.
+
+    Cada resultado se guarda con la huella de los datos de su división y sus
+    parámetros, así que al añadir carreras solo se recalculan las divisiones
+    cuyos datos cambian.
+
+    Parámetros:
+        dataset_file (str): CSV generado por script_carga.py.
+        rejilla (dict): Valores de n_estimators, learning_rate y max_depth.
+        n_temporadas (int): Temporadas de validación (ver divisiones_temporada).
+        holdout (int): Últimas temporadas excluidas de la búsqueda.
+        n_jobs (int): Ajustes simultáneos (-1: todos los núcleos).
+        cache_dir (str): Carpeta de la caché; None para no usarla.
+        clima_ventanas (bool): Si el dataset incluye COLUMNAS_VENTANAS.
+        paradas (bool): Si el dataset incluye COLUMNAS_PARADAS.
+        forma (bool): Si el dataset incluye COLUMNAS_FORMA.
+        motor (str), nulos_nativos (bool): Ver modelo.crear_pipeline.
+
+    Devuelve:
+        tuple: (resultados, calculadas), con resultados un DataFrame por combinación
+            (RMSE medio y desviación entre temporadas) ordenado de mejor a peor y
+            calculadas el número de ajustes que no estaban en caché.
+    """
+    columnas = columnas_modelo(clima_ventanas, paradas, forma)
+    df = leer_dataset(dataset_file)
+    divisiones = divisiones_temporada(df, n_temporadas=n_temporadas, holdout=holdout)
+    n_estimators = sorted(rejilla['n_estimators'])
+
+    # Un ajuste por (learning_rate, max_depth, temporada); los tamaños salen de staged_predict
+    tareas = []
+    for learning_rate, max_depth in itertools.product(rejilla['learning_rate'], rejilla['max_depth']):
+        for anio, entrenamiento, validacion in divisiones:
+            parametros = {'learning_rate': learning_rate, 'max_depth': max_depth}
+            clave = hashlib.sha256(json.dumps(
+                [huella_division(df, entrenamiento, validacion, columnas), parametros, n_estimators, motor, nulos_nativos]
+            ).encode('utf-8')).hexdigest()
+            tareas.append((anio, parametros, entrenamiento, validacion, clave))
+
+    resultados = {}
+    pendientes = []
+    for anio, parametros, entrenamiento, validacion, clave in tareas:
+        ruta = os.path.join(cache_dir, f'{clave}.json') if cache_dir else None
+        if ruta and os.path.exists(ruta):
+            with open(ruta) as archivo:
+                resultados[clave] = {int(k): v for k, v in json.load(archivo).items()}
+        else:
+            pendientes.append((anio, parametros, entrenamiento, validacion, clave))
+
+    calculados = Parallel(n_jobs=n_jobs)(
+        delayed(evaluar_division)(df, entrenamiento, validacion, columnas, n_estimators, motor=motor,
+                                  nulos_nativos=nulos_nativos, **parametros)
+        for _, parametros, entrenamiento, validacion, _ in pendientes
+    )
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    for (_, _, _, _, clave), rmse in zip(pendientes, calculados):
+        resultados[clave] = rmse
+        if cache_dir:
+            with open(os.path.join(cache_dir, f'{clave}.json'), 'w') as archivo:
+                json.dump(rmse, archivo)
+
+    filas = []
+    for anio, parametros, _, _, clave in tareas:
+        for arboles, rmse in resultados[clave].items():
+            filas.append({'n_estimators': arboles, **parametros, 'YEAR': anio, 'RMSE': rmse})
+    por_temporada = pd.DataFrame(filas)
+    tabla = por_temporada.groupby(['n_estimators', 'learning_rate', 'max_depth'])['RMSE'].agg(['mean', 'std'])
+    tabla = tabla.rename(columns={'mean': 'RMSE', 'std': 'RMSE STD'}).sort_values('RMSE').reset_index()
+    return tabla, len(pendientes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Búsqueda de hiperparámetros con validación por temporadas.")
+    parser.add_argument('--dataset', default=DATASET_FILE, help="CSV de entrenamiento de script_carga.py.")
+    parser.add_argument('--temporadas', type=int, default=3, help="Temporadas de validación.")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="Ajustes simultáneos (-1: todos los núcleos).")
+    parser.add_argument('--sin-cache', action='store_true', help="No leer ni guardar resultados en caché.")
+    parser.add_argument('--clima-ventanas', action='store_true',
+                        help="El dataset incluye el clima de las ventanas de sesión.")
+    parser.add_argument('--paradas', action='store_true', help="El dataset incluye las features de paradas en boxes.")
+    parser.add_argument('--forma', action='store_true', help="El dataset incluye las features de forma reciente.")
+    parser.add_argument('--motor', choices=MOTORES, default='gbr', help="Motor de boosting.")
+    parser.add_argument('--nulos-nativos', action='store_true',
+                        help="Con --motor hist, tratar los tiempos de clasificación centinela como nulos.")
+    parser.add_argument('--entrenar', action='store_true',
+                        help="Entrenar y guardar el modelo final con los mejores parámetros (modelo.py).")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    tabla, calculados = buscar_parametros(args.dataset, n_temporadas=args.temporadas, n_jobs=args.n_jobs,
+                                          cache_dir=None if args.sin_cache else CACHE_DIR,
+                                          clima_ventanas=args.clima_ventanas, motor=args.motor,
+                                          nulos_nativos=args.nulos_nativos, paradas=args.paradas, forma=args.forma)
+    duracion = time.perf_counter() - inicio
+    print(tabla.head(10).to_string(index=False))
+    mejores = tabla.iloc[0][['n_estimators', 'learning_rate', 'max_depth']].to_dict()
+    mejores = {'n_estimators': int(mejores['n_estimators']), 'learning_rate': float(mejores['learning_rate']),
+               'max_depth': int(mejores['max_depth'])}
+    print(f"\nMejores parámetros: {mejores} ({calculados} ajustes nuevos, {duracion:.1f} s)")
+
+    if args.entrenar:
+        entrenar_modelo(args.dataset, MODEL_FILE, clima_ventanas=args.clima_ventanas, motor=args.motor,
+                        nulos_nativos=args.nulos_nativos, paradas=args.paradas, forma=args.forma, **mejores)
+        print(f"✓ Modelo guardado en {MODEL_FILE}")
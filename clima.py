@@ -0,0 +1,266 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from datos import leer_tabla
+
+# Agregados diarios por carrera (formato histórico), almacén de datos horarios y agregados por ventana de sesión
+CLIMA_FILE = 'f1_weather_data.csv'
+ALMACEN_FILE = 'f1_weather_hourly.npz'
+VENTANAS_FILE = 'f1_weather_windows.csv'
+
+VARIABLES_HORARIAS = ["wind_speed_100m", "temperature_2m", "relative_humidity_2m",
+                      "precipitation", "pressure_msl", "surface_pressure"]
+HORAS_DIA = 24
+
+# Agregados diarios y su nombre en el dataset de entrenamiento
+COLUMNAS_CLIMA = {
+    'avg_wind_speed_100m': 'AVG WIND SPEED',
+    'max_wind_speed_100m': 'MAX WIND SPEED',
+    'avg_temperature_2m': 'AVG TEMPERATURE',
+    'min_temperature_2m': 'MIN TEMPERATURE',
+    'max_temperature_2m': 'MAX TEMPERATURE',
+    'avg_humidity': 'AVG HUMIDITY',
+    'total_precipitation': 'PRECIPITATION',
+    'avg_pressure_msl': 'AVG PRESSURE MSL',
+    'avg_surface_pressure': 'AVG SURFACE PRESSURE',
+}
+
+# Ventanas de sesión: duración en horas y agregados por ventana {nombre: (variable, estadístico)}
+DURACION_VENTANAS = {'RACE': 2, 'QUALI': 1}
+AGREGADOS_VENTANA = {
+    'TEMPERATURE': ('temperature_2m', 'mean'),
+    'HUMIDITY': ('relative_humidity_2m', 'mean'),
+    'WIND SPEED': ('wind_speed_100m', 'mean'),
+    'PRECIPITATION': ('precipitation', 'sum'),
+}
+COLUMNAS_VENTANAS = [f'{ventana} {nombre}' for ventana in DURACION_VENTANAS for nombre in AGREGADOS_VENTANA]
+
+
+def almacen_vacio():
+    """Almacén sin días: claves (lat, lng, dia) y una matriz (días, 24) float32 por variable."""
+    almacen = {
+        'lat': np.empty(0, dtype=np.float64),
+        'lng': np.empty(0, dtype=np.float64),
+        'dia': np.empty(0, dtype='datetime64[D]'),
+    }
+    for variable in VARIABLES_HORARIAS:
+        almacen[variable] = np.empty((0, HORAS_DIA), dtype=np.float32)
+    return almacen
+
+
+def cargar_almacen(ruta=ALMACEN_FILE):
+    """Carga el almacén de datos horarios (vacío si aún no existe)."""
+    if not os.path.exists(ruta):
+        return almacen_vacio()
+    with np.load(ruta) as datos:
+        return {clave: datos[clave] for clave in datos.files}
+
+
+def guardar_almacen(almacen, ruta=ALMACEN_FILE):
+    """Guarda el almacén comprimido, escribiendo a un temporal y renombrando."""
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as archivo:
+        np.savez_compressed(archivo, **almacen)
+    os.replace(temporal, ruta)
+
+
+def buscar_dias(almacen, lat, lng, dias):
+    """
+    Posición en el almacén de cada (lat, lng, dia).
+
+    Devuelve:
+        ndarray: Índices de fila, -1 para los días que no están en el almacén.
+    """
+    claves = pd.MultiIndex.from_arrays([almacen['lat'], almacen['lng'], almacen['dia']])
+    buscadas = pd.MultiIndex.from_arrays([np.asarray(lat, dtype=np.float64), np.asarray(lng, dtype=np.float64),
+                                          np.asarray(dias, dtype='datetime64[D]')])
+    return claves.get_indexer(buscadas)
+
+
+def incorporar_dias(almacen, lat, lng, dias, horarios):
+    """
+    Añade (o sustituye) días al almacén.
+
+    Parámetros:
+        lat, lng, dias (array): Claves de los días a añadir.
+        horarios (list): Por día, {variable: array de hasta 24 valores horarios UTC}.
+            Las horas que falten se guardan como NaN.
+
+    Devuelve:
+        dict: El almacén actualizado.
+    """
+    nuevos = {'lat': np.asarray(lat, dtype=np.float64), 'lng': np.asarray(lng, dtype=np.float64),
+              'dia': np.asarray(dias, dtype='datetime64[D]')}
+    for variable in VARIABLES_HORARIAS:
+        matriz = np.full((len(horarios), HORAS_DIA), np.nan, dtype=np.float32)
+        for fila, horario in enumerate(horarios):
+            valores = horario[variable][:HORAS_DIA]
+            matriz[fila, :len(valores)] = valores
+        nuevos[variable] = matriz
+
+    conservar = buscar_dias(nuevos, almacen['lat'], almacen['lng'], almacen['dia']) < 0
+    return {clave: np.concatenate([almacen[clave][conservar], nuevos[clave]]) for clave in almacen}
+
+
+def resumir_dias(almacen, indices):
+    """
+    Agregados diarios (mismas definiciones que weather.resumir_clima) de las
+    filas indicadas del almacén, calculados para todas a la vez.
+
+    Devuelve:
+        DataFrame: Una fila por índice con las columnas de COLUMNAS_CLIMA.
+    """
+    wind_speed, temperature, humidity, precipitation, pressure_msl, surface_pressure = (
+        almacen[variable][indices] for variable in VARIABLES_HORARIAS
+    )
+    return pd.DataFrame({
+        'avg_wind_speed_100m': wind_speed.mean(axis=1),
+        'max_wind_speed_100m': wind_speed.max(axis=1),
+        'avg_temperature_2m': temperature.mean(axis=1),
+        'min_temperature_2m': temperature.min(axis=1),
+        'max_temperature_2m': temperature.max(axis=1),
+        'avg_humidity': humidity.mean(axis=1),
+        'total_precipitation': precipitation.sum(axis=1),
+        'avg_pressure_msl': pressure_msl.mean(axis=1),
+        'avg_surface_pressure': surface_pressure.mean(axis=1),
+    }).astype(np.float64)
+
+
+def ubicar_carreras(race_ids=None):
+    """Circuito, coordenadas y fecha de las carreras (todas si race_ids es None)."""
+    races = leer_tabla('races', ['raceId', 'circuitId', 'name', 'date', 'year', 'time', 'quali_date', 'quali_time'],
+                       race_ids=race_ids)
+    circuits = leer_tabla('circuits', ['circuitId', 'lat', 'lng'])
+    carreras = races.merge(circuits, on='circuitId', how='left')
+    carreras['DIA'] = pd.to_datetime(carreras['date']).to_numpy().astype('datetime64[D]')
+    return carreras
+
+
+def clima_diario_carreras(race_ids=None, almacen_file=ALMACEN_FILE, clima_file=CLIMA_FILE):
+    """
+    Agregados diarios por carrera, calculados desde el almacén horario sin
+    llamadas a la red. Las carreras que aún no están en el almacén toman los
+    valores ya guardados en f1_weather_data.csv.
+
+    Devuelve:
+        DataFrame: Columnas ['raceId', 'circuitId', 'latitude', 'longitude'] y las
+            de COLUMNAS_CLIMA, una fila por carrera con datos.
+    """
+    carreras = ubicar_carreras(race_ids)
+    almacen = cargar_almacen(almacen_file)
+    indices = buscar_dias(almacen, carreras['lat'], carreras['lng'], carreras['DIA'])
+    en_almacen = indices >= 0
+
+    clima = carreras.loc[en_almacen, ['raceId', 'circuitId', 'lat', 'lng']].reset_index(drop=True)
+    clima = clima.rename(columns={'lat': 'latitude', 'lng': 'longitude'})
+    clima = pd.concat([clima, resumir_dias(almacen, indices[en_almacen])], axis=1)
+
+    if os.path.exists(clima_file):
+        guardado = pd.read_csv(clima_file)
+        guardado = guardado[guardado['raceId'].isin(carreras.loc[~en_almacen, 'raceId'])]
+        clima = pd.concat([guardado, clima], ignore_index=True) if len(clima) else guardado
+    return clima.sort_values('raceId').reset_index(drop=True)
+
+
+def leer_clima_carreras(race_ids=None, almacen_file=ALMACEN_FILE, clima_file=CLIMA_FILE):
+    """
+    Features meteorológicas de las carreras para el dataset: agregados
+    diarios redondeados a 2 decimales, con los nombres de COLUMNAS_CLIMA.
+
+    Devuelve:
+        DataFrame: Columnas ['raceId'] + nombres del dataset (AVG WIND SPEED...).
+    """
+    clima = clima_diario_carreras(race_ids, almacen_file=almacen_file, clima_file=clima_file)
+    clima = clima[['raceId'] + list(COLUMNAS_CLIMA)].copy()
+    clima[list(COLUMNAS_CLIMA)] = clima[list(COLUMNAS_CLIMA)].round(2)
+    return clima.rename(columns=COLUMNAS_CLIMA)
+
+
+def horas_dias(almacen, variable, indices):
+    """Matriz (len(indices), 24) de una variable, con NaN en los índices -1 (días sin datos)."""
+    matriz = np.full((len(indices), HORAS_DIA), np.nan, dtype=np.float32)
+    encontrados = indices >= 0
+    matriz[encontrados] = almacen[variable][indices[encontrados]]
+    return matriz
+
+
+def inicio_ventanas(carreras):
+    """
+    Hora de inicio (UTC) de cada ventana de sesión de las carreras.
+
+    En races.csv la hora de la carrera ('time') y la de la clasificación
+    ('quali_time') ya están en UTC, como el almacén. Sin fecha de clasificación
+    (antes de 2021) se toma el día anterior a la carrera a la misma hora.
+
+    Devuelve:
+        dict: {ventana: array datetime64[s]} con NaT si no hay hora.
+    """
+    formato = '%Y-%m-%d %H:%M:%S'
+    carrera = pd.to_datetime(carreras['date'] + ' ' + carreras['time'].astype(str), format=formato, errors='coerce')
+    clasificacion = pd.to_datetime(carreras['quali_date'].astype(str) + ' ' + carreras['quali_time'].astype(str),
+                                   format=formato, errors='coerce')
+    clasificacion = clasificacion.fillna(carrera - pd.Timedelta(days=1))
+    return {
+        'RACE': carrera.to_numpy().astype('datetime64[s]'),
+        'QUALI': clasificacion.to_numpy().astype('datetime64[s]'),
+    }
+
+
+def dias_ventanas(carreras):
+    """
+    Días del almacén que necesitan las ventanas de las carreras: el de inicio
+    de cada sesión y el siguiente si la sesión pasa de la medianoche UTC.
+
+    Devuelve:
+        DataFrame: Columnas ['lat', 'lng', 'date'], sin duplicados.
+    """
+    partes = []
+    for ventana, inicio in inicio_ventanas(carreras).items():
+        fin = inicio + np.timedelta64(DURACION_VENTANAS[ventana], 'h')
+        for dias in (inicio.astype('datetime64[D]'), fin.astype('datetime64[D]')):
+            partes.append(pd.DataFrame({'lat': carreras['lat'].to_numpy(), 'lng': carreras['lng'].to_numpy(), 'date': dias}))
+    dias = pd.concat(partes, ignore_index=True).dropna()
+    dias['date'] = dias['date'].dt.strftime('%Y-%m-%d')
+    return dias.drop_duplicates(ignore_index=True)
+
+
+def clima_ventanas_carreras(race_ids=None, almacen_file=ALMACEN_FILE):
+    """
+    Features meteorológicas de las ventanas de carrera y clasificación,
+    calculadas para todas las carreras a la vez desde el almacén horario, sin red.
+
+    Las medias usan las muestras desde la hora de inicio hasta la de fin, ambas
+    incluidas. La precipitación horaria de Open-Meteo es la acumulada en la hora
+    anterior a cada muestra, así que las sumas excluyen la de inicio: una
+    carrera de 2 h que empieza en punto suma 2 horas, no 3.
+
+    Devuelve:
+        DataFrame: Columnas ['raceId'] + COLUMNAS_VENTANAS, redondeadas a 2
+            decimales; NaN si faltan en el almacén horas de la ventana.
+    """
+    carreras = ubicar_carreras(race_ids)
+    almacen = cargar_almacen(almacen_file)
+    horas = np.arange(2 * HORAS_DIA)
+
+    resultado = pd.DataFrame({'raceId': carreras['raceId'].to_numpy()})
+    for ventana, inicio in inicio_ventanas(carreras).items():
+        dia = inicio.astype('datetime64[D]')
+        # Horas del día de inicio y del siguiente, como una matriz (carreras, 48)
+        indices = [buscar_dias(almacen, carreras['lat'], carreras['lng'], dia + np.timedelta64(k, 'D')) for k in (0, 1)]
+        desde = (inicio - dia).astype('timedelta64[h]').astype(float)
+        hasta = np.ceil((inicio + np.timedelta64(DURACION_VENTANAS[ventana], 'h') - dia) / np.timedelta64(1, 'h'))
+        mascara = (horas >= desde[:, None]) & (horas <= hasta[:, None])
+        # Acumulados: la muestra de la hora h cubre (h - 1, h], así que la de inicio queda fuera
+        acumulada = (horas > desde[:, None]) & (horas <= hasta[:, None])
+        n_horas = mascara.sum(axis=1)
+
+        for nombre, (variable, estadistico) in AGREGADOS_VENTANA.items():
+            valores = np.concatenate([horas_dias(almacen, variable, i) for i in indices], axis=1)
+            total = np.where(mascara if estadistico == 'mean' else acumulada, valores, 0).sum(axis=1, dtype=np.float64)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                resultado[f'{ventana} {nombre}'] = total / n_horas if estadistico == 'mean' else total
+        resultado.loc[n_horas == 0, [f'{ventana} {nombre}' for nombre in AGREGADOS_VENTANA]] = np.nan
+    resultado[COLUMNAS_VENTANAS] = resultado[COLUMNAS_VENTANAS].round(2)
+    return resultado
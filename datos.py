@@ -0,0 +1,369 @@
+import contextlib
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Sin pyarrow se lee siempre el CSV (mismos tipos, sin caché)
+    pyarrow = None
+
+DATA_DIR = 'f1_data'
+CACHE_DIR = 'f1_data_cache'
+
+# Columnas de texto que nunca se convierten a categóricas (se procesan como texto)
+COLUMNAS_TEXTO = {'q1', 'q2', 'q3', 'dob', 'date', 'status'}
+
+# Filas por bloque al escribir un dataset (y por row group en Parquet)
+FILAS_BLOQUE = 16384
+
+# Año que pasa a ser 0 en la columna YEAR de los datasets (YEAR = año - YEAR_REFERENCIA)
+YEAR_REFERENCIA = 2025
+
+# Tipos de las columnas de los datasets de script_carga.py y entry.py. Las columnas
+# que no aparecen (p. ej. COLUMNAS_VENTANAS de clima.py) son float32
+ESQUEMA_DATASET = {
+    'RACEID': 'int32',
+    **dict.fromkeys(['DRIVERID', 'CONSTRUCTORID', 'CIRCUITID', 'LAPS RACE', 'WINS CAREER', 'WINS SEASON',
+                     'CONSTRUCTOR WINS SEASON'], 'int16'),
+    **dict.fromkeys(['ROUND', 'YEAR', 'URBAN', 'DRIVER LAST POSITION', 'YEARS OF EXPERIENCE', 'AGE',
+                     'MATE LAST POSITION', 'GRID',
+                     'Q1 VALID', 'Q2 VALID', 'Q3 VALID', 'RACE VALID', 'SPRINT Y/N'], 'int8'),
+    **dict.fromkeys(['LAP DISTANCE KM', 'AVG WIND SPEED', 'MAX WIND SPEED', 'AVG TEMPERATURE', 'MIN TEMPERATURE',
+                     'MAX TEMPERATURE', 'AVG HUMIDITY', 'PRECIPITATION', 'AVG PRESSURE MSL', 'AVG SURFACE PRESSURE',
+                     'POINTS BEFORE GP', 'CONSTRUCTOR POINTS BEFORE GP'], 'float32'),
+    # Tiempos en milisegundos (incluidos los centinelas 300000 y 10000000)
+    **dict.fromkeys(['Q1', 'Q2', 'Q3', 'BEST Q', 'MS RACE'], 'int32'),
+}
+
+
+def tipar_tabla(df):
+    """
+    Convierte una tabla de f1_data a tipos compactos sin cambiar sus valores:
+    enteros sin nulos a int32 y textos repetidos a categóricas.
+
+    Parámetros:
+        df (DataFrame): Tabla leída con '\\N' ya convertido en nulo.
+
+    Devuelve:
+        DataFrame: La misma tabla con los tipos reducidos.
+    """
+    for col in df.columns:
+        serie = df[col]
+        if pd.api.types.is_integer_dtype(serie):
+            if serie.empty or (serie.min() >= np.iinfo(np.int32).min and serie.max() <= np.iinfo(np.int32).max):
+                df[col] = serie.astype(np.int32)
+        elif not pd.api.types.is_numeric_dtype(serie) and col not in COLUMNAS_TEXTO:
+            if serie.nunique() < len(serie) / 2:
+                df[col] = serie.astype('category')
+    return df
+
+
+def leer_csv(ruta):
+    """Lee un CSV de f1_data con '\\N' como nulo y tipos compactos."""
+    # low_memory=False: el tipo de cada columna se decide con el archivo entero, no por bloques
+    # (en tablas grandes una columna como positionText mezclaría números y textos)
+    return tipar_tabla(pd.read_csv(ruta, na_values=['\\N'], low_memory=False))
+
+
+def tipar_dataset(df):
+    """
+    Convierte un dataset de features a los tipos de ESQUEMA_DATASET.
+
+    Los enteros se redondean antes de convertirlos; si un valor no cabe en
+    su tipo (o es nulo) se lanza un error en lugar de truncarlo.
+
+    Parámetros:
+        df (DataFrame): Dataset de script_carga.py o entry.py.
+
+    Devuelve:
+        DataFrame: Una copia con los tipos del esquema, mismas columnas y orden.
+    """
+    tipos = {}
+    for col in df.columns:
+        tipo = np.dtype(ESQUEMA_DATASET.get(col, 'float32'))
+        if tipo.kind == 'i':
+            serie = df[col]
+            rango = np.iinfo(tipo)
+            if serie.isna().any() or serie.min() < rango.min or serie.max() > rango.max:
+                raise ValueError(f"La columna {col} tiene nulos o valores fuera de {tipo} "
+                                 f"(mín. {serie.min()}, máx. {serie.max()})")
+        tipos[col] = tipo
+    enteras = [col for col, tipo in tipos.items() if tipo.kind == 'i' and df[col].dtype.kind == 'f']
+    return df.assign(**{col: df[col].round() for col in enteras}).astype(tipos)
+
+
+def leer_csv_dataset(ruta):
+    """Lee un CSV de script_carga.py o entry.py con los tipos de ESQUEMA_DATASET."""
+    return tipar_dataset(pd.read_csv(ruta))
+
+
+def huella_archivo(ruta):
+    """Devuelve el SHA-256 del contenido de un archivo."""
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(1 << 20), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+@contextlib.contextmanager
+def escritura_atomica(ruta):
+    """
+    Escritura de un archivo mediante un temporal junto a él que se renombra a
+    ruta al terminar el bloque: quien lea ruta ve el archivo anterior o el
+    nuevo completo, nunca uno a medias. Si el bloque falla se borra el temporal.
+
+    Devuelve (en el with):
+        str: Ruta del temporal en el que escribir.
+    """
+    temporal = ruta + '.tmp'
+    try:
+        yield temporal
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+
+def registrar_cache(origen, destino, formato=None, sha256=None):
+    """Anota que la caché destino corresponde al contenido actual de origen (su JSON de metadatos)."""
+    info = os.stat(origen)
+    meta = {'mtime_ns': info.st_mtime_ns, 'size': info.st_size, 'formato': formato,
+            'sha256': sha256 or huella_archivo(origen)}
+    with open(os.path.splitext(destino)[0] + '.json', 'w') as archivo:
+        json.dump(meta, archivo)
+
+
+def actualizar_cache(nombre, data_dir=DATA_DIR, cache_dir=CACHE_DIR, convertir=leer_csv, formato=None, extension='.csv'):
+    """
+    Garantiza que la caché Parquet de una tabla está al día y devuelve su ruta.
+
+    La caché es válida si el CSV conserva su fecha de modificación y tamaño;
+    si la fecha cambió pero el contenido (hash) es el mismo, solo se actualizan
+    los metadatos. En otro caso (o si cambia el formato) se vuelve a convertir el CSV.
+
+    Parámetros:
+        nombre (str): Nombre de la tabla (p. ej. 'results' para f1_data/results.csv).
+        convertir (callable): Lectura del CSV con sus tipos (leer_csv o leer_csv_dataset).
+        formato (str): Opcional, huella de los tipos de la conversión (p. ej. de ESQUEMA_DATASET).
+        extension (str): Extensión del archivo de origen (el CSV es data_dir/<nombre><extension>).
+
+    Devuelve:
+        str: Ruta del archivo Parquet.
+    """
+    origen = os.path.join(data_dir, nombre + extension)
+    destino = os.path.join(cache_dir, f'{nombre}.parquet')
+    meta_file = os.path.join(cache_dir, f'{nombre}.json')
+
+    info = os.stat(origen)
+    meta_actual = {'mtime_ns': info.st_mtime_ns, 'size': info.st_size, 'formato': formato}
+
+    meta = None
+    if os.path.exists(destino) and os.path.exists(meta_file):
+        with open(meta_file) as archivo:
+            meta = json.load(archivo)
+        if all(meta.get(clave) == valor for clave, valor in meta_actual.items()):
+            return destino
+
+    sha256 = huella_archivo(origen)
+    if meta is None or meta.get('sha256') != sha256 or meta.get('formato') != formato:
+        os.makedirs(cache_dir, exist_ok=True)
+        with escritura_atomica(destino) as temporal:
+            convertir(origen).to_parquet(temporal, index=False, row_group_size=4096)
+
+    registrar_cache(origen, destino, formato, sha256)
+    return destino
+
+
+def huella_tabla(nombre, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """SHA-256 del CSV de una tabla de f1_data; con caché, el de sus metadatos (no se vuelve a leer si no cambió)."""
+    if pyarrow is None:
+        return huella_archivo(os.path.join(data_dir, f'{nombre}.csv'))
+    actualizar_cache(nombre, data_dir=data_dir, cache_dir=cache_dir)
+    with open(os.path.join(cache_dir, f'{nombre}.json')) as archivo:
+        return json.load(archivo)['sha256']
+
+
+def leer_tabla(nombre, columnas=None, race_ids=None, desde_year=None, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """
+    Lee una tabla de f1_data desde la caché columnar, convirtiéndola la primera vez.
+
+    '\\N' llega ya como nulo, los enteros como int32 y los textos repetidos como
+    categóricas. Las filas conservan el orden del CSV.
+
+    Parámetros:
+        nombre (str): Nombre de la tabla (p. ej. 'results').
+        columnas (list): Opcional, columnas a leer (el resto no se carga).
+        race_ids (iterable): Opcional, solo las filas de estas carreras.
+        desde_year (int): Opcional, solo las filas de carreras de este año o posteriores.
+            En tablas sin columna 'year' se resuelve con races.csv.
+
+    Devuelve:
+        DataFrame: La tabla filtrada.
+    """
+    filtros = []
+    if race_ids is not None:
+        filtros.append(('raceId', 'in', [int(race_id) for race_id in race_ids]))
+    if desde_year is not None:
+        if nombre in ('races', 'seasons'):
+            filtros.append(('year', '>=', desde_year))
+        else:
+            carreras = leer_tabla('races', ['raceId'], desde_year=desde_year, data_dir=data_dir, cache_dir=cache_dir)
+            filtros.append(('raceId', 'in', carreras['raceId'].tolist()))
+
+    if pyarrow is None:
+        df = leer_csv(os.path.join(data_dir, f'{nombre}.csv'))
+        for col, operador, valor in filtros:
+            df = df[df[col].isin(valor)] if operador == 'in' else df[df[col] >= valor]
+        return (df if columnas is None else df[columnas]).reset_index(drop=True)
+
+    ruta = actualizar_cache(nombre, data_dir=data_dir, cache_dir=cache_dir)
+    return pd.read_parquet(ruta, columns=columnas, filters=filtros or None)
+
+
+def huella_esquema_dataset():
+    """Huella de ESQUEMA_DATASET, para invalidar las cachés de los datasets si cambian los tipos."""
+    return hashlib.sha256(json.dumps(ESQUEMA_DATASET, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cache_dataset(ruta):
+    """
+    Ruta de la caché Parquet de un dataset en CSV (CACHE_DIR junto al CSV) y
+    argumentos de actualizar_cache para ella. 'x.csv' usa x.parquet y 'x.csv.gz', x.csv.parquet.
+
+    Devuelve:
+        tuple: (ruta de la caché, dict de argumentos de actualizar_cache).
+    """
+    directorio, archivo = os.path.split(ruta)
+    nombre, extension = os.path.splitext(archivo)
+    argumentos = {'nombre': nombre, 'data_dir': directorio or '.', 'cache_dir': os.path.join(directorio, CACHE_DIR),
+                  'convertir': leer_csv_dataset, 'formato': huella_esquema_dataset(), 'extension': extension}
+    return os.path.join(argumentos['cache_dir'], f'{nombre}.parquet'), argumentos
+
+
+def leer_dataset(ruta, columnas=None, desde_year=None, hasta_year=None):
+    """
+    Lee un dataset de script_carga.py o entry.py con los tipos de ESQUEMA_DATASET.
+
+    Un '.parquet' de guardar_dataset se lee directamente. De un CSV ('.csv' o
+    '.csv.gz'), igual que con leer_tabla, la primera lectura guarda una copia
+    Parquet (que conserva los tipos) en CACHE_DIR junto al CSV, y las siguientes
+    la leen directamente mientras no cambien el CSV ni ESQUEMA_DATASET. Sin pyarrow se lee el CSV.
+
+    Con pyarrow solo se cargan las columnas pedidas, y los row groups se
+    descartan por sus estadísticas de YEAR: las filas están en orden de carrera,
+    así que leer unas pocas temporadas no descomprime el resto.
+
+    Parámetros:
+        ruta (str): Dataset (p. ej. f1_training_data_2014_onwards.csv).
+        columnas (list): Opcional, columnas a leer (en este orden).
+        desde_year, hasta_year (int): Opcional, solo filas de estos años (naturales, p. ej. 2020;
+            la columna YEAR guarda año - YEAR_REFERENCIA).
+
+    Devuelve:
+        DataFrame: El dataset tipado, con las filas en el orden del archivo.
+    """
+    filtros = []
+    if desde_year is not None:
+        filtros.append(('YEAR', '>=', desde_year - YEAR_REFERENCIA))
+    if hasta_year is not None:
+        filtros.append(('YEAR', '<=', hasta_year - YEAR_REFERENCIA))
+
+    if pyarrow is None:
+        if ruta.endswith('.parquet'):
+            raise ValueError(f"Para leer {ruta} hace falta pyarrow.")
+        df = leer_csv_dataset(ruta)
+        for col, operador, valor in filtros:
+            df = df[df[col] >= valor] if operador == '>=' else df[df[col] <= valor]
+        return (df if columnas is None else df[columnas]).reset_index(drop=True)
+
+    if not ruta.endswith('.parquet'):
+        ruta = actualizar_cache(**cache_dataset(ruta)[1])
+    return pd.read_parquet(ruta, columns=columnas, filters=filtros or None)
+
+
+def bloques_dataset(df, filas_bloque=FILAS_BLOQUE):
+    """Divide un DataFrame en DataFrames consecutivos de filas_bloque filas (al menos uno, aunque esté vacío)."""
+    return (df.iloc[inicio:inicio + filas_bloque] for inicio in range(0, max(len(df), 1), filas_bloque))
+
+
+def escribir_parquet(ruta, bloques, filas_bloque=FILAS_BLOQUE):
+    """
+    Escribe bloques sucesivos (DataFrames o lotes de pyarrow con las mismas
+    columnas) en un Parquet de forma atómica, sin juntarlos en memoria: cada
+    bloque es uno o más row groups. El esquema es el del primer bloque.
+    """
+    escritor = None
+    with escritura_atomica(ruta) as temporal:
+        try:
+            for bloque in bloques:
+                if isinstance(bloque, pd.DataFrame):
+                    tabla = pyarrow.Table.from_pandas(bloque, preserve_index=False)
+                else:
+                    tabla = pyarrow.Table.from_batches([bloque])
+                if escritor is None:
+                    escritor = pyarrow.parquet.ParquetWriter(temporal, tabla.schema)
+                escritor.write_table(tabla, row_group_size=filas_bloque)
+        finally:
+            if escritor is not None:
+                escritor.close()
+
+
+def lotes_parquet(ruta, filas_bloque=FILAS_BLOQUE):
+    """Lotes de pyarrow de un Parquet, de filas_bloque filas, en orden (sin cargarlo entero)."""
+    return pyarrow.parquet.ParquetFile(ruta).iter_batches(batch_size=filas_bloque)
+
+
+def guardar_dataset(df, ruta, anadir=False, filas_bloque=FILAS_BLOQUE):
+    """
+    Escribe un dataset de features con los tipos de ESQUEMA_DATASET (los tiempos
+    como enteros), por bloques de filas_bloque filas y con renombrado atómico:
+    quien lea ruta ve el archivo anterior o el nuevo completo, nunca uno a medias.
+
+    El formato sale de la extensión de ruta: '.csv', '.csv.gz' (CSV comprimido
+    con gzip) o '.parquet' (columnar, un row group por bloque; requiere pyarrow).
+    De un CSV se escribe también la caché Parquet de leer_dataset, directamente
+    desde las columnas tipadas en lugar de volver a leer el texto.
+
+    Parámetros:
+        df (DataFrame): Dataset a guardar.
+        ruta (str): Archivo de salida.
+        anadir (bool): Añadir las filas al final de un dataset existente (en CSV, sin cabecera).
+        filas_bloque (int): Filas por bloque (y por row group).
+    """
+    tipado = tipar_dataset(df)
+    parquet = ruta.endswith('.parquet')
+    if parquet and pyarrow is None:
+        raise ValueError(f"Para escribir {ruta} hace falta pyarrow.")
+
+    # Filas previas para la copia Parquet (el propio archivo o su caché, al día antes de sobrescribir el CSV)
+    previas = []
+    if anadir and pyarrow is not None:
+        previas = lotes_parquet(ruta if parquet else actualizar_cache(**cache_dataset(ruta)[1]), filas_bloque)
+
+    if parquet:
+        escribir_parquet(ruta, itertools.chain(previas, bloques_dataset(tipado, filas_bloque)), filas_bloque)
+        return
+
+    with escritura_atomica(ruta) as temporal:
+        if anadir:
+            # Un .gz admite miembros añadidos al final: basta con copiar el archivo y seguir escribiendo
+            shutil.copyfile(ruta, temporal)
+        abrir = gzip.open if ruta.endswith('.gz') else open
+        with abrir(temporal, 'at' if anadir else 'wt', newline='') as archivo:
+            for numero, bloque in enumerate(bloques_dataset(tipado, filas_bloque)):
+                bloque.to_csv(archivo, header=not anadir and numero == 0, index=False)
+
+    if pyarrow is not None:
+        cache, argumentos = cache_dataset(ruta)
+        os.makedirs(argumentos['cache_dir'], exist_ok=True)
+        escribir_parquet(cache, itertools.chain(previas, bloques_dataset(tipado, filas_bloque)), filas_bloque)
+        registrar_cache(ruta, cache, argumentos['formato'])
@@ -1,405 +1,216 @@
+import argparse
+
+import numpy as np
 import pandas as pd
-import openmeteo_requests
-import requests_cache
-from retry_requests import retry
-
-# Setup the Open-Meteo API client with cache and retry on error
-cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
-retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-openmeteo = openmeteo_requests.Client(session=retry_session)
-
-def get_weather_data(latitude, longitude, date):
-    """Obtiene datos meteorológicos de Open-Meteo para una fecha y ubicación específica"""
-    try:
-        url = "https://archive-api.open-meteo.com/v1/archive"
-        params = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "start_date": date,
-            "end_date": date,
-            "hourly": ["wind_speed_100m", "temperature_2m", "relative_humidity_2m", 
-                      "precipitation", "pressure_msl", "surface_pressure"],
-        }
-        
-        responses = openmeteo.weather_api(url, params=params)
-        response = responses[0]
-        
-        # Process hourly data
-        hourly = response.Hourly()
-        hourly_wind_speed_100m = hourly.Variables(0).ValuesAsNumpy()
-        hourly_temperature_2m = hourly.Variables(1).ValuesAsNumpy()
-        hourly_relative_humidity_2m = hourly.Variables(2).ValuesAsNumpy()
-        hourly_precipitation = hourly.Variables(3).ValuesAsNumpy()
-        hourly_pressure_msl = hourly.Variables(4).ValuesAsNumpy()
-        hourly_surface_pressure = hourly.Variables(5).ValuesAsNumpy()
-        
-        # Calcular promedios diarios
-        weather_summary = {
-            'AVG WIND SPEED': round(float(hourly_wind_speed_100m.mean()), 2) if len(hourly_wind_speed_100m) > 0 else None,
-            'MAX WIND SPEED': round(float(hourly_wind_speed_100m.max()), 2) if len(hourly_wind_speed_100m) > 0 else None,
-            'AVG TEMPERATURE': round(float(hourly_temperature_2m.mean()), 2) if len(hourly_temperature_2m) > 0 else None,
-            'MAX TEMPERATURE': round(float(hourly_temperature_2m.max()), 2) if len(hourly_temperature_2m) > 0 else None,
-            'MIN TEMPERATURE': round(float(hourly_temperature_2m.min()), 2) if len(hourly_temperature_2m) > 0 else None,
-            'AVG HUMIDITY': round(float(hourly_relative_humidity_2m.mean()), 2) if len(hourly_relative_humidity_2m) > 0 else None,
-            'PRECIPITATION': round(float(hourly_precipitation.sum()), 2) if len(hourly_precipitation) > 0 else None,
-            'AVG PRESSURE MSL': round(float(hourly_pressure_msl.mean()), 2) if len(hourly_pressure_msl) > 0 else None,
-            'AVG SURFACE PRESSURE': round(float(hourly_surface_pressure.mean()), 2) if len(hourly_surface_pressure) > 0 else None,
-        }
-        
-        return weather_summary
-    
-    except Exception as e:
-        print(f"Error obteniendo datos meteorológicos: {e}")
-        return None
 
-def generar_dataset_carrera_1168():
+from clima import COLUMNAS_CLIMA, COLUMNAS_VENTANAS, clima_ventanas_carreras, dias_ventanas, leer_clima_carreras
+from datos import YEAR_REFERENCIA, guardar_dataset, leer_tabla, tipar_dataset
+from features import (
+    COLUMNAS_FEATURES,
+    calcular_features_desde_estado,
+    cargar_estado,
+    parsear_tiempos_clasificacion,
+    ultima_carrera_estado,
+)
+from forma import COLUMNAS_FORMA, calcular_features_forma, historial_resultados
+from paradas import COLUMNAS_PARADAS, calcular_features_paradas, leer_paradas
+from weather import actualizar_almacen
+
+def construir_filas_carreras(race_ids, estado_pilotos, estado_constructores, estado_circuitos, clima_ventanas=False,
+                             descargar_clima=True, paradas=False, forma=False):
     """
-    Genera el dataset para la carrera 1168 (última carrera de la temporada) con datos meteorológicos.
+    Construye en una sola pasada las filas de entrada del modelo de varias
+    carreras sin resultados (un piloto por fila, desde qualifying).
+
+    Las features históricas de todas las carreras se calculan desde el mismo
+    estado, es decir, como si cada una fuera la siguiente a la última carrera
+    procesada (simulacion.py las actualiza carrera a carrera).
+
+    Parámetros:
+        race_ids (list): Carreras a construir, todas posteriores a la última del estado.
+        estado_pilotos, estado_constructores, estado_circuitos (DataFrame): Ver features.cargar_estado.
+        clima_ventanas (bool): Añadir COLUMNAS_VENTANAS.
+        descargar_clima (bool): Descargar los días que falten en el almacén horario.
+        paradas (bool): Añadir COLUMNAS_PARADAS, con las paradas anteriores a la primera carrera.
+        forma (bool): Añadir COLUMNAS_FORMA, con los resultados anteriores a la primera carrera.
+
+    Devuelve:
+        DataFrame: Columnas COLUMNAS_FEATURES (+ COLUMNAS_VENTANAS, COLUMNAS_PARADAS y COLUMNAS_FORMA),
+            en el orden de qualifying.
     """
-    
-    # --- 1. Definición de Archivos y Delimitadores ---
-    RESULTS_FILE = 'f1_data/results.csv'
-    SPRINT_RESULTS_FILE = 'f1_data/sprint_results.csv'
-    QUALIFYING_FILE = 'f1_data/qualifying.csv'
-    RACES_FILE = 'f1_data/races.csv'
-    CIRCUITS_FILE = 'f1_data/circuits.csv'
-    DRIVERS_FILE = 'f1_data/drivers.csv'
-    DRIVER_STANDINGS_FILE = 'f1_data/driver_standings.csv'
-    CONSTRUCTOR_STANDINGS_FILE = 'f1_data/constructor_standings.csv'
-    STATUS_FILE = 'f1_data/status.csv'
-
-    COMMON_DELIMITER = ','
-    RACE_ID = 1168
-    PROCESS_FROM_YEAR = 2001
-    
-    OUTPUT_FILE = f'f1_race_{RACE_ID}_data.csv'
-
-    # Columnas finales requeridas
-    COLUMNAS_FINALES = [
-        'RACEID', 'DRIVERID', 'CONSTRUCTORID', 'CIRCUITID', 'ROUND', 'YEAR', 'LAP DISTANCE KM', 'LAPS RACE', 'URBAN',
-        'AVG WIND SPEED', 'MAX WIND SPEED', 'AVG TEMPERATURE', 'MIN TEMPERATURE', 'MAX TEMPERATURE',
-        'AVG HUMIDITY', 'PRECIPITATION', 'AVG PRESSURE MSL', 'AVG SURFACE PRESSURE',
-        'DRIVER LAST POSITION', 'WINS SEASON', 'WINS CAREER', 'POINTS BEFORE GP', 'YEARS OF EXPERIENCE', 'AGE', 
-        'MATE LAST POSITION',
-        'CONSTRUCTOR POINTS BEFORE GP', 'CONSTRUCTOR WINS SEASON',
-        'Q1', 'Q2', 'Q3', 'BEST Q', 'GRID',
-        'Q1 VALID', 'Q2 VALID', 'Q3 VALID', 'RACE VALID',
-        'SPRINT Y/N'
-    ]
-
-    print(f"=== Iniciando generación de datos para carrera {RACE_ID} ===\n")
-
-    # --- 2. Cargar información de la carrera 1168 ---
-    races_df = pd.read_csv(RACES_FILE, sep=COMMON_DELIMITER)
-    
-    race_1168 = races_df[races_df['raceId'] == RACE_ID].iloc[0]
-    
-    circuit_id = race_1168['circuitId']
-    race_date = race_1168['date']
-    race_year = race_1168['year']
-    race_round = race_1168['round']
-    
-    print(f"Carrera {RACE_ID}: {race_1168['name']}")
-    print(f"Circuito ID: {circuit_id}, Fecha: {race_date}, Año: {race_year}, Ronda: {race_round}\n")
-    
-    # --- 3. Obtener datos meteorológicos ---
-    circuits_df = pd.read_csv(CIRCUITS_FILE, sep=COMMON_DELIMITER)
-    circuit_info = circuits_df[circuits_df['circuitId'] == circuit_id].iloc[0]
-    
-    lat = circuit_info['lat']
-    lng = circuit_info['lng']
-    lap_distance = circuit_info['lap_distance_km']
-    urban = circuit_info['urban']
-    
-    print(f"Obteniendo datos meteorológicos para {circuit_info['name']}...")
-    print(f"Coordenadas: {lat}, {lng}")
-    
-    weather_data = get_weather_data(lat, lng, race_date)
-    
-    if weather_data:
-        print("✓ Datos meteorológicos obtenidos exitosamente\n")
-    else:
-        print("⚠ No se pudieron obtener datos meteorológicos\n")
-        weather_data = {}
-    
-    # --- 4. Cargar y Preparar DataFrames ---
-    print("Cargando datos de F1...")
-    
-    # a) results.csv (Carrera Principal)
-    results_df = pd.read_csv(RESULTS_FILE, sep=COMMON_DELIMITER)
-    results_df = results_df[['raceId', 'driverId', 'constructorId', 'grid', 'milliseconds', 'statusId', 'position', 'laps']].copy()
-    results_df.rename(columns={
-        'grid': 'GRID',
-        'milliseconds': 'MS RACE',
-        'statusId': 'STATUS RACE'
-    }, inplace=True)
-
-    # b) sprint_results.csv (Carrera Sprint)
-    sprint_df = pd.read_csv(SPRINT_RESULTS_FILE, sep=COMMON_DELIMITER)
-    sprint_df = sprint_df[['raceId', 'driverId', 'constructorId', 'milliseconds', 'statusId']].copy()
-    sprint_df.rename(columns={
-        'milliseconds': 'MS SPRINT',
-        'statusId': 'STATUS SPRINT'
-    }, inplace=True)
-
-    # c) qualifying.csv (Calificación)
-    qualifying_df = pd.read_csv(QUALIFYING_FILE, sep=COMMON_DELIMITER)
-    qualifying_df = qualifying_df[['raceId', 'driverId', 'constructorId', 'q1', 'q2', 'q3']].copy()
-
-    # d) races.csv (Información de carreras)
-    races_df['DATE'] = pd.to_datetime(races_df['date'])
-    races_df = races_df[races_df['year'] >= PROCESS_FROM_YEAR].copy()
-    recent_race_ids = set(races_df['raceId'].unique())
-
-    # e) drivers.csv (Información de pilotos)
-    drivers_df = pd.read_csv(DRIVERS_FILE, sep=COMMON_DELIMITER)
-    drivers_df = drivers_df[['driverId', 'dob']].copy()
+    race_ids = [int(race_id) for race_id in race_ids]
+    ultima_carrera = ultima_carrera_estado(estado_pilotos, estado_constructores)
+    incluidas = sorted(race_id for race_id in race_ids if race_id <= ultima_carrera)
+    if incluidas:
+        raise ValueError(
+            f"Las carreras {incluidas} ya están incluidas en el estado (última carrera: {ultima_carrera}); "
+            "las features se calcularían con información posterior a ellas."
+        )
+    races_df = leer_tabla('races', ['raceId', 'circuitId', 'date', 'year', 'round', 'time', 'quali_date', 'quali_time'],
+                          race_ids=race_ids)
+    circuits_df = leer_tabla('circuits', ['circuitId', 'lat', 'lng', 'lap_distance_km', 'urban'])
+    carreras = races_df.merge(circuits_df, on='circuitId', how='left')
+
+    # --- 1. Datos meteorológicos (solo se descargan los días que faltan en el almacén) ---
+    if descargar_clima:
+        dias = carreras[['lat', 'lng', 'date']]
+        if clima_ventanas:
+            dias = pd.concat([dias, dias_ventanas(carreras)])
+        actualizar_almacen(dias)
+    weather_df = leer_clima_carreras(race_ids)
+    if clima_ventanas:
+        weather_df = weather_df.merge(clima_ventanas_carreras(race_ids), on='raceId', how='left')
+
+    # --- 2. Pilotos de las carreras (desde qualifying, aún no hay resultados) ---
+    merged_df = leer_tabla('qualifying', ['raceId', 'driverId', 'constructorId', 'q1', 'q2', 'q3'], race_ids=race_ids)
+    sin_parrilla = sorted(set(race_ids) - set(merged_df['raceId']))
+    if sin_parrilla:
+        raise ValueError(f"Las carreras {sin_parrilla} no tienen qualifying: hace falta la parrilla para predecirlas.")
+
+    # Fusión con Información de Pilotos y de Carreras
+    drivers_df = leer_tabla('drivers', ['driverId', 'dob'])
     drivers_df.rename(columns={'dob': 'DOB'}, inplace=True)
     drivers_df['DOB'] = pd.to_datetime(drivers_df['DOB'])
-    
-    # f) driver_standings.csv (Campeonato de pilotos)
-    driver_standings_df = pd.read_csv(DRIVER_STANDINGS_FILE, sep=COMMON_DELIMITER, na_values=['\\N'])
-    driver_standings_df = driver_standings_df[driver_standings_df['raceId'].isin(recent_race_ids)]
-    driver_standings_df = driver_standings_df[['raceId', 'driverId', 'points', 'position']].copy()
-    driver_standings_df.rename(columns={
-        'points': 'POINTS STANDINGS',
-        'position': 'POSITION STANDINGS'
-    }, inplace=True)
-
-    # g) constructor_standings.csv
-    constructor_standings_df = pd.read_csv(CONSTRUCTOR_STANDINGS_FILE, sep=COMMON_DELIMITER, na_values=['\\N'])
-    constructor_standings_df = constructor_standings_df[constructor_standings_df['raceId'].isin(recent_race_ids)]
-    constructor_standings_df = constructor_standings_df[['raceId', 'constructorId', 'points']].copy()
-    constructor_standings_df.rename(columns={'points': 'CONSTRUCTOR POINTS'}, inplace=True)
+    merged_df = merged_df.merge(drivers_df, on='driverId', how='left')
+    merged_df = merged_df.merge(carreras[['raceId', 'circuitId', 'date', 'year', 'round', 'lap_distance_km', 'urban']],
+                                on='raceId', how='left')
 
-    # h) status.csv
-    status_df = pd.read_csv(STATUS_FILE, sep=COMMON_DELIMITER)
-    status_dict = status_df.set_index('statusId')['status'].to_dict()
+    # --- 3. Transformaciones ---
 
-    # --- 5. Fusiones para la carrera 1168 (sin resultados) ---
-    print("Procesando datos de la carrera...")
-    
-    # Como la carrera 1168 no tiene resultados, solo usamos qualifying
-    # Cargar pilotos que participarán (desde qualifying)
-    merged_df = qualifying_df[qualifying_df['raceId'] == RACE_ID].copy()
-
-    # Fusión con Información de Pilotos
-    merged_df = pd.merge(
-        merged_df,
-        drivers_df,
-        on='driverId',
-        how='left'
-    )
-    
-    # Fusión con Driver Standings de la carrera ANTERIOR (1167)
-    merged_df = pd.merge(
-        merged_df,
-        driver_standings_df[driver_standings_df['raceId'] == RACE_ID - 1],
-        on='driverId',
-        how='left',
-        suffixes=('', '_prev')
-    )
-    
-    # Fusión con Constructor Standings de la carrera ANTERIOR (1167)
-    merged_df = pd.merge(
-        merged_df,
-        constructor_standings_df[constructor_standings_df['raceId'] == RACE_ID - 1],
-        on='constructorId',
-        how='left',
-        suffixes=('', '_const')
-    )
-
-    # --- 6. Transformaciones ---
-    
     # Verificar si hubo sprint (aunque probablemente no haya datos)
-    sprint_check = sprint_df[sprint_df['raceId'] == RACE_ID]
-    merged_df['SPRINT Y/N'] = 1 if not sprint_check.empty else 0
-    
-    # Función para convertir tiempo MM:SS.SSS a milisegundos
-    def time_to_milliseconds(time_str):
-        if pd.isna(time_str):
-            return None
-        try:
-            parts = str(time_str).split(':')
-            minutes = int(parts[0])
-            seconds = float(parts[1])
-            return int(minutes * 60 * 1000 + seconds * 1000)
-        except:
-            return None
-    
-    # Convertir Q1, Q2, Q3 a milisegundos
-    merged_df['q1'] = merged_df['q1'].apply(time_to_milliseconds)
-    merged_df['q2'] = merged_df['q2'].apply(time_to_milliseconds)
-    merged_df['q3'] = merged_df['q3'].apply(time_to_milliseconds)
-    
+    sprint_check = leer_tabla('sprint_results', ['raceId'], race_ids=race_ids)
+    merged_df['SPRINT Y/N'] = merged_df['raceId'].isin(sprint_check['raceId']).astype(int)
+
+    # Convertir Q1, Q2, Q3 a milisegundos en una sola pasada vectorizada
+    q_ms, q_validos = parsear_tiempos_clasificacion(merged_df[['q1', 'q2', 'q3']])
+
     # Sustituir valores nulos por 300000 (penalización por no clasificar)
-    merged_df['q1'] = merged_df['q1'].fillna(300000)
-    merged_df['q2'] = merged_df['q2'].fillna(300000)
-    merged_df['q3'] = merged_df['q3'].fillna(300000)
-    
+    merged_df[['q1', 'q2', 'q3']] = np.where(q_validos, q_ms, 300000).astype(float)
+
+    # Columnas binarias de validez a partir de la máscara del parser
+    merged_df[['Q1 VALID', 'Q2 VALID', 'Q3 VALID']] = q_validos.astype(int)
+
     # Renombrar IDs y Qs a mayúsculas
     merged_df.rename(columns={
         'raceId': 'RACEID',
         'driverId': 'DRIVERID',
         'constructorId': 'CONSTRUCTORID',
+        'circuitId': 'CIRCUITID',
+        'year': 'YEAR',
+        'round': 'ROUND',
+        'lap_distance_km': 'LAP DISTANCE KM',
+        'urban': 'URBAN',
         'q1': 'Q1',
         'q2': 'Q2',
         'q3': 'Q3'
     }, inplace=True)
-    
+
     # Calcular BEST Q (el menor tiempo entre Q1, Q2, Q3)
     merged_df['BEST Q'] = merged_df[['Q1', 'Q2', 'Q3']].min(axis=1)
-    
-    # Calcular GRID desde qualifying (ordenar por BEST Q)
-    merged_df['GRID'] = merged_df['BEST Q'].rank(method='min').astype(int)
+
+    # Calcular GRID desde qualifying (ordenar por BEST Q dentro de cada carrera)
+    merged_df['GRID'] = merged_df.groupby('RACEID')['BEST Q'].rank(method='min').astype(int)
     merged_df['GRID'] = merged_df['GRID'].replace(0, 20)
-    
-    # --- 7. Calcular columnas sin necesitar resultados de la carrera 1168 ---
-    
-    # Cargar resultados históricos (excluyendo la carrera 1168)
-    results_full = pd.read_csv(RESULTS_FILE, sep=COMMON_DELIMITER)
-    results_full = results_full[results_full['raceId'].isin(recent_race_ids)]
-    results_full = results_full[results_full['raceId'] < RACE_ID]  # Solo carreras anteriores
-    results_full['position'] = pd.to_numeric(results_full['position'], errors='coerce')
-
-    # LAPS RACE: Obtener de una carrera reciente en el mismo circuito o usar promedio
-    previous_race_same_circuit = results_full[results_full['raceId'] == RACE_ID - 1]
-    if not previous_race_same_circuit.empty:
-        winner_prev = previous_race_same_circuit[previous_race_same_circuit['position'] == 1]
-        if not winner_prev.empty:
-            laps_race = winner_prev['laps'].iloc[0]
-        else:
-            laps_race = 58  # Valor por defecto típico
-    else:
-        laps_race = 58  # Valor por defecto típico
-    
-    merged_df['LAPS RACE'] = laps_race
-    
+
     # Columnas relacionadas con resultados: se rellenan con valores por defecto
-    # ya que no tenemos resultados de esta carrera (es para predicción)
+    # ya que no tenemos resultados de estas carreras (es para predicción)
     merged_df['RACE VALID'] = 1
-    
-    # Crear columnas binarias para validez
-    merged_df['Q1 VALID'] = (merged_df['Q1'] != 300000).astype(int)
-    merged_df['Q2 VALID'] = (merged_df['Q2'] != 300000).astype(int)
-    merged_df['Q3 VALID'] = (merged_df['Q3'] != 300000).astype(int)
-    
-    # Crear tabla de información de carreras
-    race_info = pd.read_csv(RACES_FILE, sep=COMMON_DELIMITER)[['raceId', 'year']].copy()
-    race_info = race_info[race_info['year'] >= PROCESS_FROM_YEAR]
-    race_info = race_info.sort_values('raceId').reset_index(drop=True)
-    race_info['RACE_ORDER'] = range(len(race_info))
-    
+
     # AGE: Calcular edad del piloto en la fecha de la carrera
-    race_date_dt = pd.to_datetime(race_date)
-    merged_df['AGE'] = ((race_date_dt - merged_df['DOB']).dt.days / 365.25).astype(int)
-    
-    # Renombrar columnas
-    merged_df.rename(columns={
-        'raceId': 'RACEID',
-        'driverId': 'DRIVERID',
-        'constructorId': 'CONSTRUCTORID'
-    }, inplace=True)
-    
-    # DRIVER LAST POSITION: Posición del piloto en la carrera anterior (1167)
-    previous_race_results = results_full[results_full['raceId'] == RACE_ID - 1][['driverId', 'position']].copy()
-    previous_race_results.rename(columns={'position': 'DRIVER LAST POSITION'}, inplace=True)
-    previous_race_results['DRIVER LAST POSITION'] = pd.to_numeric(previous_race_results['DRIVER LAST POSITION'], errors='coerce')
-    
-    merged_df = merged_df.merge(previous_race_results, left_on='DRIVERID', right_on='driverId', how='left', suffixes=('', '_drop'))
-    merged_df['DRIVER LAST POSITION'] = merged_df['DRIVER LAST POSITION'].fillna(21).astype(int)
-    
-    # POINTS BEFORE GP: Usar los standings de la carrera anterior ya fusionados
-    merged_df['POINTS BEFORE GP'] = merged_df['POINTS STANDINGS'].fillna(0)
-    
-    # YEARS OF EXPERIENCE: Años desde el debut
-    first_race = results_full[['raceId', 'driverId']].copy()
-    first_race = first_race.merge(race_info[['raceId', 'year']], on='raceId', how='left')
-    first_race = first_race.drop_duplicates('driverId', keep='first').rename(columns={'year': 'DEBUT_YEAR'})
-    
-    merged_df = merged_df.merge(first_race[['driverId', 'DEBUT_YEAR']], left_on='DRIVERID', right_on='driverId', how='left', suffixes=('', '_debut'))
-    merged_df['YEARS OF EXPERIENCE'] = (race_year - merged_df['DEBUT_YEAR']).fillna(0).astype(int)
-    
-    # WINS SEASON y WINS CAREER
-    wins_by_race = results_full[results_full['position'] == 1][['raceId', 'driverId']].copy()
-    wins_by_race = wins_by_race.merge(race_info, on='raceId', how='left')
-    
-    current_race_order = race_info[race_info['raceId'] == RACE_ID]['RACE_ORDER'].iloc[0]
-    
-    def calc_wins(driver_id):
-        wins_career = wins_by_race[(wins_by_race['driverId'] == driver_id) & (wins_by_race['RACE_ORDER'] < current_race_order)].shape[0]
-        wins_season = wins_by_race[(wins_by_race['driverId'] == driver_id) & (wins_by_race['RACE_ORDER'] < current_race_order) & (wins_by_race['year'] == race_year)].shape[0]
-        return wins_career, wins_season
-    
-    wins_data = merged_df['DRIVERID'].apply(lambda x: calc_wins(x)).apply(pd.Series)
-    merged_df['WINS CAREER'] = wins_data[0].fillna(0).astype(int)
-    merged_df['WINS SEASON'] = wins_data[1].fillna(0).astype(int)
-    
-    # CONSTRUCTOR POINTS BEFORE GP
-    previous_constructor_standings = constructor_standings_df[constructor_standings_df['raceId'] == RACE_ID - 1][['constructorId', 'CONSTRUCTOR POINTS']].copy()
-    previous_constructor_standings.rename(columns={'CONSTRUCTOR POINTS': 'CONSTRUCTOR POINTS BEFORE GP'}, inplace=True)
-    
-    merged_df = merged_df.merge(previous_constructor_standings, left_on='CONSTRUCTORID', right_on='constructorId', how='left', suffixes=('', '_const'))
-    merged_df['CONSTRUCTOR POINTS BEFORE GP'] = merged_df['CONSTRUCTOR POINTS BEFORE GP'].fillna(0)
-    
-    # CONSTRUCTOR WINS SEASON
-    constructor_wins = results_full[results_full['position'] == 1][['raceId', 'constructorId']].copy()
-    constructor_wins = constructor_wins.merge(race_info, on='raceId', how='left')
-    
-    def calc_constructor_wins_season(constructor_id):
-        wins_season = constructor_wins[(constructor_wins['constructorId'] == constructor_id) & 
-                                      (constructor_wins['RACE_ORDER'] < current_race_order) & 
-                                      (constructor_wins['year'] == race_year)].shape[0]
-        return wins_season
-    
-    merged_df['CONSTRUCTOR WINS SEASON'] = merged_df['CONSTRUCTORID'].apply(calc_constructor_wins_season).fillna(0).astype(int)
-    
-    # MATE LAST POSITION
-    mate_positions = []
-    
-    for idx, row in merged_df.iterrows():
-        driver_id = row['DRIVERID']
-        constructor_id = row['CONSTRUCTORID']
-        
-        # Buscar al compañero de equipo en la carrera anterior (1167)
-        mate_prev = results_full[
-            (results_full['raceId'] == RACE_ID - 1) &
-            (results_full['constructorId'] == constructor_id) &
-            (results_full['driverId'] != driver_id)
-        ]
-        
-        if mate_prev.empty:
-            mate_positions.append(21)
-        else:
-            mate_last_pos = mate_prev['position'].iloc[0]
-            mate_positions.append(int(mate_last_pos) if pd.notna(mate_last_pos) else 21)
-    
-    merged_df['MATE LAST POSITION'] = mate_positions
+    merged_df['AGE'] = ((pd.to_datetime(merged_df['date']) - merged_df['DOB']).dt.days / 365.25).astype(int)
+
+    # --- 4. Features históricas desde el estado guardado ---
+    historicas = calcular_features_desde_estado(merged_df, estado_pilotos, estado_constructores, estado_circuitos)
+    merged_df[historicas.columns] = historicas
+    if paradas:
+        # Como el estado, las paradas son las anteriores a la primera carrera de race_ids
+        merged_df[COLUMNAS_PARADAS] = calcular_features_paradas(merged_df, leer_paradas(hasta_race_id=min(race_ids)))
+    if forma:
+        merged_df[COLUMNAS_FORMA] = calcular_features_forma(merged_df, historial_resultados(hasta_race_id=min(race_ids)))
+
+    # LAPS RACE: vueltas de la última carrera en el circuito o valor típico
+    merged_df['LAPS RACE'] = merged_df['LAPS RACE'].fillna(58).astype(int)
+
+    # Transformar año
+    merged_df['YEAR'] = merged_df['YEAR'] - YEAR_REFERENCIA
+
+    # Añadir datos meteorológicos (0 si faltan)
+    columnas_clima = list(COLUMNAS_CLIMA.values()) + (COLUMNAS_VENTANAS if clima_ventanas else [])
+    merged_df = merged_df.merge(weather_df.rename(columns={'raceId': 'RACEID'}), on='RACEID', how='left')
+    merged_df[columnas_clima] = merged_df[columnas_clima].fillna(0)
+
+    # --- 5. Seleccionar y reordenar las columnas finales, con los tipos del dataset de entrenamiento ---
+    return tipar_dataset(merged_df[COLUMNAS_FEATURES + (COLUMNAS_VENTANAS if clima_ventanas else [])
+                                   + (COLUMNAS_PARADAS if paradas else []) + (COLUMNAS_FORMA if forma else [])])
+
+
+def generar_dataset_carrera(race_id=None, min_year=2014, clima_ventanas=False, paradas=False, forma=False,
+                            formato='csv'):
+    """
+    Genera el dataset de predicción de una carrera sin resultados, con datos meteorológicos.
+
+    Las features históricas (posiciones, puntos, victorias, experiencia,
+    vueltas del circuito) se leen del estado que guarda generar_dataset_f1_completo
+    en script_carga.py, con la misma definición que el dataset de entrenamiento.
+
+    Parámetros:
+        race_id (int): Carrera a predecir; por defecto, la siguiente a la última del estado.
+        min_year (int): Año mínimo del dataset de entrenamiento cuyo estado se usa.
+        clima_ventanas (bool): Añadir el clima de las ventanas de carrera y clasificación
+            (para modelos entrenados con script_carga.py --clima-ventanas).
+        paradas (bool): Añadir las features de paradas en boxes (script_carga.py --paradas).
+        forma (bool): Añadir las features de forma reciente (script_carga.py --forma).
+        formato (str): Formato del archivo: 'csv', 'csv.gz' o 'parquet' (ver datos.guardar_dataset).
+    """
     
-    # --- 8. Añadir información constante de la carrera ---
-    merged_df['CIRCUITID'] = circuit_id
-    merged_df['ROUND'] = race_round
-    merged_df['YEAR'] = race_year - 2025  # Transformar año
-    merged_df['LAP DISTANCE KM'] = lap_distance
-    merged_df['URBAN'] = urban
+    # --- 1. Cargar el estado tras la última carrera procesada ---
+    estado_pilotos, estado_constructores, estado_circuitos = cargar_estado(min_year)
+    ultima_carrera = ultima_carrera_estado(estado_pilotos, estado_constructores)
     
-    # Añadir datos meteorológicos
-    for key, value in weather_data.items():
-        merged_df[key] = value if value is not None else 0
+    races_df = leer_tabla('races', ['raceId', 'circuitId', 'name', 'date', 'year', 'round'])
+    if race_id is None:
+        race_id = races_df.loc[races_df['raceId'] > ultima_carrera, 'raceId'].min()
+    if race_id <= ultima_carrera:
+        raise ValueError(
+            f"La carrera {race_id} ya está incluida en el estado (última carrera: {ultima_carrera}); "
+            "las features se calcularían con información posterior a ella."
+        )
     
-    # Sustituir GRID = 0 por 20
-    merged_df['GRID'] = merged_df['GRID'].replace(0, 20)
+    OUTPUT_FILE = f'f1_race_{race_id}_data.{formato}'
+
+    print(f"=== Iniciando generación de datos para carrera {race_id} ===\n")
+
+    # --- 2. Información de la carrera ---
+    race = races_df[races_df['raceId'] == race_id].iloc[0]
+    print(f"Carrera {race_id}: {race['name']}")
+    print(f"Circuito ID: {race['circuitId']}, Fecha: {race['date']}, Año: {race['year']}, Ronda: {race['round']}\n")
     
-    # --- 9. Seleccionar y reordenar las columnas finales ---
-    final_df = merged_df[COLUMNAS_FINALES].copy()
+    # --- 3. Filas de la carrera (clima, qualifying, features históricas) ---
+    print("Procesando datos de la carrera...")
+    final_df = construir_filas_carreras([race_id], estado_pilotos, estado_constructores, estado_circuitos,
+                                        clima_ventanas=clima_ventanas, paradas=paradas, forma=forma)
+    if (final_df[list(COLUMNAS_CLIMA.values())] == 0).all(axis=None):
+        print("⚠ No se pudieron obtener datos meteorológicos\n")
     
-    # --- 10. Guardar el Resultado Final ---
+    # --- 4. Guardar el Resultado Final ---
     print(f"\nGuardando el dataset en {OUTPUT_FILE}...")
-    final_df.to_csv(OUTPUT_FILE, index=False)
+    guardar_dataset(final_df, OUTPUT_FILE)
 
     print("\n✅ ¡Proceso completado!")
     print(f"Dataset generado con {final_df.shape[0]} filas y {final_df.shape[1]} columnas.")
+    return final_df
 
 # Ejecutar la función principal
 if __name__ == "__main__":
-    generar_dataset_carrera_1168()
+    parser = argparse.ArgumentParser(description="Genera el dataset de predicción de una carrera de F1.")
+    parser.add_argument('race_id', type=int, nargs='?', default=None,
+                        help="Carrera a predecir (por defecto, la siguiente a la última del estado).")
+    parser.add_argument('--clima-ventanas', action='store_true',
+                        help="Añadir el clima de las ventanas de carrera y clasificación.")
+    parser.add_argument('--paradas', action='store_true', help="Añadir las features de paradas en boxes.")
+    parser.add_argument('--forma', action='store_true', help="Añadir las features de forma reciente.")
+    parser.add_argument('--formato', choices=['csv', 'csv.gz', 'parquet'], default='csv', help="Formato del archivo.")
+    args = parser.parse_args()
+
+    generar_dataset_carrera(args.race_id, clima_ventanas=args.clima_ventanas, paradas=args.paradas, forma=args.forma,
+                            formato=args.formato)
@@ -0,0 +1,261 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from datos import escritura_atomica, huella_archivo, huella_tabla
+from perfil import RegistroEtapas
+
+CACHE_ETAPAS_DIR = 'f1_etapas_cache'
+
+# Tamaño máximo de la caché; al superarlo se borran las entradas usadas hace más tiempo
+MAX_MB_CACHE_ETAPAS = 1024
+
+
+class Etapa:
+    """
+    Nodo del grafo de etapas de un cálculo.
+
+    La función recibe (entradas, parametros, registro): entradas es un dict
+    {etapa de entrada: su salida}, parametros los valores de `parametros` y
+    registro el de RegistroEtapas.etapa (puede anotar 'filas'). Devuelve un
+    dict con sus resultados, o None si no hay nada que calcular (las etapas
+    que dependen de ella tampoco se calculan). Las tablas de DataFrame de las
+    entradas son copias superficiales: la función puede añadir o sustituir columnas.
+
+    Parámetros:
+        nombre (str): Nombre de la etapa (también en el perfil).
+        funcion (callable): Cálculo de la etapa.
+        entradas (tuple): Etapas cuyas salidas usa.
+        tablas (tuple): Tablas de f1_data que lee (su contenido forma parte de la clave).
+        archivos (tuple): Otros archivos que lee (p. ej. el almacén de clima).
+        parametros (tuple): Nombres de los parámetros del cálculo que usa.
+        codigo (tuple): Módulos y funciones de los que depende, además de funcion:
+            su código fuente es la versión de la etapa.
+    """
+
+    def __init__(self, nombre, funcion, entradas=(), tablas=(), archivos=(), parametros=(), codigo=()):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.entradas = tuple(entradas)
+        self.tablas = tuple(tablas)
+        self.archivos = tuple(archivos)
+        self.parametros = tuple(parametros)
+        self.codigo = (funcion,) + tuple(codigo)
+
+
+@functools.lru_cache(maxsize=None)
+def huella_codigo(objeto):
+    """SHA-256 del código fuente de un módulo o función."""
+    return hashlib.sha256(inspect.getsource(objeto).encode('utf-8')).hexdigest()
+
+
+def huella_valor(valor):
+    """Representación estable de un parámetro para la clave: los DataFrame por el hash de su contenido."""
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        columnas = valor.columns if isinstance(valor, pd.DataFrame) else [valor.name]
+        sha = hashlib.sha256(json.dumps([str(c) for c in columnas]).encode('utf-8'))
+        sha.update(pd.util.hash_pandas_object(valor, index=True).to_numpy().tobytes())
+        return sha.hexdigest()
+    if isinstance(valor, dict):
+        return {str(clave): huella_valor(v) for clave, v in sorted(valor.items(), key=lambda item: str(item[0]))}
+    if isinstance(valor, (set, frozenset, list, tuple, np.ndarray, pd.Index)):
+        valores = [huella_valor(v) for v in valor]
+        return sorted(valores) if isinstance(valor, (set, frozenset)) else valores
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+
+class CacheEtapas:
+    """
+    Caché en disco de las salidas de las etapas, direccionada por contenido.
+
+    Cada salida se guarda como <clave>.joblib, con <clave>.json (etapa y
+    segundos que costó calcularla). La clave de una etapa es el SHA-256 de su
+    código, sus tablas y archivos de entrada, sus parámetros y las claves de
+    sus entradas, así que cambia si cambia cualquier cosa de la que dependa.
+    registro guarda, por ejecución, qué etapas se calcularon, se leyeron de
+    la caché o no hicieron falta (ver tabla).
+
+    Parámetros:
+        directorio (str): Carpeta de la caché.
+        max_mb (float): Tamaño máximo tras podar().
+    """
+
+    def __init__(self, directorio=CACHE_ETAPAS_DIR, max_mb=MAX_MB_CACHE_ETAPAS):
+        self.directorio = directorio
+        self.max_mb = max_mb
+        self.registro = []
+
+    def ruta(self, clave, extension='.joblib'):
+        return os.path.join(self.directorio, clave + extension)
+
+    def meta(self, clave):
+        """Metadatos de una entrada, o None si no está en la caché."""
+        if not (os.path.exists(self.ruta(clave)) and os.path.exists(self.ruta(clave, '.json'))):
+            return None
+        with open(self.ruta(clave, '.json')) as archivo:
+            return json.load(archivo)
+
+    def leer(self, clave):
+        ruta = self.ruta(clave)
+        valor = joblib.load(ruta)
+        # Las entradas leídas cuentan como recientes para podar()
+        os.utime(ruta)
+        return valor
+
+    def guardar(self, clave, valor, meta):
+        os.makedirs(self.directorio, exist_ok=True)
+        with escritura_atomica(self.ruta(clave)) as temporal:
+            joblib.dump(valor, temporal)
+        with open(self.ruta(clave, '.json'), 'w') as archivo:
+            json.dump(meta, archivo)
+
+    def podar(self):
+        """Borra las entradas usadas hace más tiempo hasta que la caché ocupa como mucho max_mb."""
+        if not os.path.isdir(self.directorio):
+            return
+        entradas = [os.path.join(self.directorio, nombre) for nombre in os.listdir(self.directorio)
+                    if nombre.endswith('.joblib')]
+        entradas.sort(key=os.path.getmtime, reverse=True)
+        ocupado = 0
+        for ruta in entradas:
+            ocupado += os.path.getsize(ruta)
+            if ocupado > self.max_mb * 2 ** 20:
+                os.remove(ruta)
+                if os.path.exists(os.path.splitext(ruta)[0] + '.json'):
+                    os.remove(os.path.splitext(ruta)[0] + '.json')
+
+    def tabla(self, registro=None):
+        """
+        Texto con una línea por etapa del registro: cuántas veces se calculó, se
+        leyó de la caché o no hizo falta, el tiempo empleado y el ahorrado
+        (lo que costó calcularla menos lo que costó leerla).
+        """
+        registro = self.registro if registro is None else registro
+        por_etapa = {}
+        for fila in registro:
+            resumen = por_etapa.setdefault(fila['etapa'], {'calculada': 0, 'caché': 0, 'omitida': 0,
+                                                           'segundos': 0.0, 'ahorro': 0.0})
+            resumen[fila['resultado']] += 1
+            resumen['segundos'] += fila['segundos']
+            resumen['ahorro'] += fila['ahorro']
+        lineas = [f"{'Etapa':20s} {'Calculada':>9s} {'Caché':>6s} {'Omitida':>8s} {'Tiempo (s)':>10s} {'Ahorro (s)':>10s}"]
+        for nombre, resumen in por_etapa.items():
+            lineas.append(f"{nombre:20s} {resumen['calculada']:9d} {resumen['caché']:6d} {resumen['omitida']:8d} "
+                          f"{resumen['segundos']:10.3f} {resumen['ahorro']:10.3f}")
+        total = sum(fila['ahorro'] for fila in registro)
+        lineas.append(f"Ahorro total: {total:.3f} s")
+        return '\n'.join(lineas)
+
+
+def claves_etapas(etapas, parametros):
+    """
+    Clave de cada etapa, en orden (cada etapa va después de sus entradas).
+
+    Devuelve:
+        dict: {nombre: SHA-256}.
+    """
+    claves = {}
+    for etapa in etapas:
+        contenido = [
+            etapa.nombre,
+            [huella_codigo(objeto) for objeto in etapa.codigo],
+            {tabla: huella_tabla(tabla) for tabla in etapa.tablas},
+            {archivo: huella_archivo(archivo) if os.path.exists(archivo) else None for archivo in etapa.archivos},
+            {nombre: huella_valor(parametros[nombre]) for nombre in etapa.parametros},
+            [claves[entrada] for entrada in etapa.entradas],
+        ]
+        claves[etapa.nombre] = hashlib.sha256(json.dumps(contenido).encode('utf-8')).hexdigest()
+    return claves
+
+
+def copia_entrada(salida):
+    """Salida de una etapa para la siguiente: las tablas como copias superficiales."""
+    if salida is None:
+        return None
+    return {nombre: valor.copy(deep=False) if isinstance(valor, pd.DataFrame) else valor
+            for nombre, valor in salida.items()}
+
+
+def ejecutar_etapas(etapas, objetivo, parametros, cache=None, perfil=None):
+    """
+    Calcula la salida de la etapa objetivo.
+
+    Sin caché se ejecutan en orden todas las etapas de las que depende. Con
+    caché se recorre el grafo desde el objetivo hacia atrás: una etapa cuya
+    clave está en la caché se lee y sus entradas no se calculan (ni se leen),
+    así que solo se ejecutan las etapas cuya clave cambió y, de las que no,
+    solo se leen las que necesitan ellas.
+
+    Parámetros:
+        etapas (list): Etapas (Etapa) en orden, cada una después de sus entradas.
+        objetivo (str): Nombre de la etapa cuya salida se devuelve.
+        parametros (dict): Valores de los parámetros de las etapas.
+        cache (CacheEtapas): Opcional, caché donde leer y guardar las salidas.
+        perfil (RegistroEtapas): Opcional, registro de las etapas ejecutadas o leídas.
+
+    Devuelve:
+        dict: La salida de objetivo (None si alguna etapa no tenía nada que calcular).
+    """
+    if perfil is None:
+        perfil = RegistroEtapas()
+    por_nombre = {etapa.nombre: etapa for etapa in etapas}
+    claves = claves_etapas(etapas, parametros) if cache is not None else {}
+
+    # Etapas necesarias: desde el objetivo, sin pasar de las que están en la caché
+    metas = {}
+    necesarias = set()
+    pendientes = [objetivo]
+    while pendientes:
+        nombre = pendientes.pop()
+        if nombre in necesarias:
+            continue
+        necesarias.add(nombre)
+        metas[nombre] = cache.meta(claves[nombre]) if cache is not None else None
+        if metas[nombre] is None:
+            pendientes.extend(por_nombre[nombre].entradas)
+
+    salidas = {}
+    for etapa in etapas:
+        if etapa.nombre not in necesarias:
+            if cache is not None:
+                meta = cache.meta(claves[etapa.nombre])
+                cache.registro.append({'etapa': etapa.nombre, 'resultado': 'omitida', 'segundos': 0.0,
+                                       'ahorro': meta['segundos'] if meta else 0.0})
+            continue
+        if metas[etapa.nombre] is None and any(salidas[nombre] is None for nombre in etapa.entradas):
+            # Una entrada no tenía nada que calcular: esta etapa tampoco (ni figura en el perfil)
+            salidas[etapa.nombre] = None
+            if cache is not None:
+                cache.guardar(claves[etapa.nombre], None, {'etapa': etapa.nombre, 'segundos': 0.0, 'filas': None})
+                cache.registro.append({'etapa': etapa.nombre, 'resultado': 'omitida', 'segundos': 0.0, 'ahorro': 0.0})
+            continue
+        inicio = time.perf_counter()
+        with perfil.etapa(etapa.nombre) as registro:
+            if metas[etapa.nombre] is not None:
+                salida = cache.leer(claves[etapa.nombre])
+                registro['filas'] = metas[etapa.nombre]['filas']
+            else:
+                entradas = {nombre: copia_entrada(salidas[nombre]) for nombre in etapa.entradas}
+                salida = etapa.funcion(entradas, {nombre: parametros[nombre] for nombre in etapa.parametros}, registro)
+        segundos = time.perf_counter() - inicio
+        salidas[etapa.nombre] = salida
+
+        if cache is None:
+            continue
+        if metas[etapa.nombre] is not None:
+            cache.registro.append({'etapa': etapa.nombre, 'resultado': 'caché', 'segundos': segundos,
+                                   'ahorro': max(metas[etapa.nombre]['segundos'] - segundos, 0.0)})
+        else:
+            cache.guardar(claves[etapa.nombre], salida,
+                          {'etapa': etapa.nombre, 'segundos': segundos, 'filas': registro['filas']})
+            cache.registro.append({'etapa': etapa.nombre, 'resultado': 'calculada', 'segundos': segundos, 'ahorro': 0.0})
+    return salidas[objetivo]
@@ -0,0 +1,563 @@
+import numpy as np
+import pandas as pd
+
+# Columnas de entrada del modelo, comunes al dataset de entrenamiento y al de predicción
+COLUMNAS_FEATURES = [
+    'RACEID', 'DRIVERID', 'CONSTRUCTORID', 'CIRCUITID', 'ROUND', 'YEAR', 'LAP DISTANCE KM', 'LAPS RACE', 'URBAN',
+    'AVG WIND SPEED', 'MAX WIND SPEED', 'AVG TEMPERATURE', 'MIN TEMPERATURE', 'MAX TEMPERATURE',
+    'AVG HUMIDITY', 'PRECIPITATION', 'AVG PRESSURE MSL', 'AVG SURFACE PRESSURE',
+    'DRIVER LAST POSITION', 'WINS SEASON', 'WINS CAREER', 'POINTS BEFORE GP', 'YEARS OF EXPERIENCE', 'AGE',
+    'MATE LAST POSITION',
+    'CONSTRUCTOR POINTS BEFORE GP', 'CONSTRUCTOR WINS SEASON',
+    'Q1', 'Q2', 'Q3', 'BEST Q', 'GRID',
+    'Q1 VALID', 'Q2 VALID', 'Q3 VALID', 'RACE VALID',
+    'SPRINT Y/N'
+]
+
+# Estado por piloto, constructor y circuito tras la última carrera del dataset
+ESTADO_FILE = 'f1_training_data_{min_year}_onwards_estado_{tabla}.csv'
+ESTADO_CLAVES = {'pilotos': 'DRIVERID', 'constructores': 'CONSTRUCTORID', 'circuitos': 'CIRCUITID'}
+
+# Ventanas de agregados_previos (además de un entero k: las últimas k carreras de la clave)
+VENTANA_TEMPORADA = 'temporada'
+VENTANA_HISTORIAL = 'historial'
+ESTADISTICOS_PREVIOS = ('mean', 'sum', 'count', 'max', 'min', 'last')
+
+
+def codificar_claves(columnas):
+    """
+    Combina columnas enteras de clave (ids no negativos) en un único código int64
+    por fila, reservando 63 // len(columnas) bits a cada clave.
+
+    Parámetros:
+        columnas (list): Arrays o Series de la misma longitud, una por clave.
+
+    Devuelve:
+        ndarray: Código int64 de cada fila.
+    """
+    bits = 63 // len(columnas)
+    codigo = np.zeros(len(columnas[0]), dtype=np.int64)
+    for valores in columnas:
+        valores = np.asarray(valores, dtype=np.int64)
+        if len(valores) and (valores.min() < 0 or valores.max() >= 1 << bits):
+            raise ValueError(f"Hay ids de clave fuera del rango [0, 2**{bits})")
+        codigo = (codigo << bits) | valores
+    return codigo
+
+
+def indexar(tabla_df, claves):
+    """
+    Tabla de búsqueda para anadir_columnas: las columnas de tabla_df salvo las
+    claves, indexadas por el código de sus claves (codificar_claves).
+
+    Parámetros:
+        tabla_df (DataFrame): Tabla con las columnas claves y las que se añadirán.
+        claves (list): Columnas enteras que identifican cada fila (deben ser únicas).
+
+    Devuelve:
+        DataFrame: La tabla indexada por el código de las claves.
+    """
+    codigo = pd.Index(codificar_claves([tabla_df[clave] for clave in claves]))
+    if not codigo.is_unique:
+        raise ValueError(f"Las claves {claves} de la tabla de búsqueda no son únicas")
+    return tabla_df.drop(columns=claves).set_axis(codigo)
+
+
+def anadir_columnas(filas_df, busquedas):
+    """
+    Añade a filas_df las columnas de varias tablas de búsqueda (left join) sin
+    encadenar pd.merge: las filas se localizan en cada tabla por el código de
+    sus claves, cada columna se toma por posición y el DataFrame resultante se
+    construye una sola vez, con las filas en el mismo orden. Una búsqueda puede
+    usar como clave una columna añadida por otra anterior (p. ej. CIRCUITID desde races).
+
+    Como en un left join, las filas sin correspondencia quedan con nulos (y
+    los enteros pasan a decimales).
+
+    Parámetros:
+        filas_df (DataFrame): Filas a enriquecer.
+        busquedas (list): Pares (tabla devuelta por indexar, columnas de filas_df con sus claves en el mismo orden).
+
+    Devuelve:
+        DataFrame: filas_df con las columnas de todas las tablas.
+    """
+    columnas = {col: filas_df[col].array for col in filas_df.columns}
+    for tabla, claves in busquedas:
+        repetidas = [col for col in tabla.columns if col in columnas]
+        if repetidas:
+            raise ValueError(f"Las columnas {repetidas} ya existen en las filas")
+        # Posición de cada fila en la tabla (-1 si no está) y take posicional de cada columna
+        posiciones = tabla.index.get_indexer(codificar_claves([columnas[clave] for clave in claves]))
+        for col in tabla.columns:
+            # take admite ndarray o ExtensionArray (no el envoltorio de .array de las columnas numpy)
+            serie = tabla[col]
+            valores = serie.to_numpy() if isinstance(serie.dtype, np.dtype) else serie.array
+            columnas[col] = pd.api.extensions.take(valores, posiciones, allow_fill=True)
+    return pd.DataFrame(columnas, index=filas_df.index, copy=False)
+
+
+def agregados_previos(historico_df, filas_df, definiciones, orden='RACEID', temporada='YEAR'):
+    """
+    Calcula agregados históricos declarados en `definiciones`, sin fuga: para
+    cada fila, el estadístico de un valor en las carreras anteriores de su clave
+    (orden estrictamente menor), dentro de la ventana.
+
+    Cada definición es (claves, valor, ventana, estadístico):
+
+    - claves: columnas de la serie, p. ej. ['DRIVERID'] o ['DRIVERID', 'CIRCUITID'];
+    - valor: columna de historico_df;
+    - ventana: k (las últimas k carreras de la clave), VENTANA_TEMPORADA (las
+      del mismo año) o VENTANA_HISTORIAL (todas);
+    - estadístico: uno de ESTADISTICOS_PREVIOS. Los nulos no cuentan, salvo en
+      'last', que es el valor de la carrera anterior aunque sea nulo.
+
+    Las definiciones con las mismas claves y tipo de ventana comparten una sola
+    ordenación del histórico por (clave, orden). Cada fila localiza con
+    searchsorted dónde empiezan y acaban sus carreras previas, y cada
+    estadístico es un único cálculo vectorizado: sumas acumuladas (sum, mean,
+    count), máximos/mínimos acumulados por clave o una ventana de k columnas (max, min).
+
+    Parámetros:
+        historico_df (DataFrame): Carreras ya disputadas, normalmente una fila por clave y carrera,
+            con las claves, orden, temporada (si alguna ventana la usa) y los valores.
+        filas_df (DataFrame): Filas para las que se calculan, con las claves, orden y temporada.
+        definiciones (dict): {columna: (claves, valor, ventana, estadístico)}.
+        orden (str): Columna con el orden de las carreras (el de las demás features: RACEID).
+        temporada (str): Columna del año, para VENTANA_TEMPORADA.
+
+    Devuelve:
+        DataFrame: Una columna por definición, con el índice de filas_df; NaN si no hay valores previos.
+    """
+    grupos = {}
+    for columna, (claves, valor, ventana, estadistico) in definiciones.items():
+        if estadistico not in ESTADISTICOS_PREVIOS:
+            raise ValueError(f"Estadístico desconocido para {columna}: {estadistico} (admitidos: {ESTADISTICOS_PREVIOS})")
+        if not (ventana in (VENTANA_TEMPORADA, VENTANA_HISTORIAL) or (isinstance(ventana, int) and ventana > 0)):
+            raise ValueError(f"Ventana no válida para {columna}: {ventana!r}")
+        serie = list(claves) + ([temporada] if ventana == VENTANA_TEMPORADA else [])
+        grupos.setdefault(tuple(serie), []).append(columna)
+
+    resultado = {}
+    for serie, columnas in grupos.items():
+        # Clave densa de cada serie (común a histórico y filas) y orden por (clave, carrera)
+        codigos = np.unique(np.concatenate([codificar_claves([historico_df[col] for col in serie]),
+                                            codificar_claves([filas_df[col] for col in serie])]),
+                            return_inverse=True)[1]
+        clave_historico, clave_filas = codigos[:len(historico_df)], codigos[len(historico_df):]
+        codigo = codificar_claves([clave_historico, historico_df[orden]])
+        posiciones = np.argsort(codigo, kind='stable')
+        codigo = codigo[posiciones]
+        clave_ordenada = clave_historico[posiciones]
+
+        # Carreras previas de cada fila: [primero, fin) en el histórico ordenado
+        fin = np.searchsorted(codigo, codificar_claves([clave_filas, filas_df[orden]]))
+        primero = np.searchsorted(codigo, codificar_claves([clave_filas, np.zeros(len(filas_df), dtype=np.int64)]))
+
+        for columna in columnas:
+            _, valor, ventana, estadistico = definiciones[columna]
+            valores = historico_df[valor].to_numpy(dtype=float)[posiciones]
+            inicio = np.maximum(primero, fin - ventana) if isinstance(ventana, int) else primero
+            resultado[columna] = estadistico_previo(valores, clave_ordenada, inicio, fin, ventana, estadistico)
+
+    return pd.DataFrame(resultado, index=filas_df.index)[list(definiciones)]
+
+
+def estadistico_previo(valores, claves, inicio, fin, ventana, estadistico):
+    """
+    Estadístico de valores[inicio:fin] para cada fila (ver agregados_previos),
+    con valores y claves ordenados por (clave, orden).
+
+    Devuelve:
+        ndarray: Un valor por fila; NaN si el tramo no tiene valores no nulos.
+    """
+    resultado = np.full(len(fin), np.nan)
+    hay = fin > inicio
+    if estadistico == 'last':
+        resultado[hay] = valores[fin[hay] - 1]
+        return resultado
+
+    validos = ~np.isnan(valores)
+    if estadistico in ('sum', 'mean', 'count'):
+        suma = np.concatenate([[0.0], np.cumsum(np.where(validos, valores, 0.0))])
+        cuenta = np.concatenate([[0], np.cumsum(validos)])
+        n = cuenta[fin] - cuenta[inicio]
+        if estadistico == 'count':
+            return n.astype(float)
+        total = suma[fin] - suma[inicio]
+        hay = n > 0
+        resultado[hay] = total[hay] if estadistico == 'sum' else total[hay] / n[hay]
+        return resultado
+
+    # max / min
+    if not len(valores):
+        return resultado
+    if isinstance(ventana, int):
+        # Matriz (filas, k) con las k carreras previas de cada fila (NaN fuera del tramo)
+        indices = fin[:, None] - 1 - np.arange(ventana)[None, :]
+        dentro = indices >= inicio[:, None]
+        tramo = np.where(dentro, valores[np.where(dentro, indices, 0)], np.nan)
+        hay = (dentro & ~np.isnan(tramo)).any(axis=1)
+        reducir = np.max if estadistico == 'max' else np.min
+        resultado[hay] = reducir(np.where(np.isnan(tramo[hay]), -np.inf if estadistico == 'max' else np.inf,
+                                          tramo[hay]), axis=1)
+        return resultado
+    # Acumulado por clave desde su primera carrera (los nulos conservan el valor anterior)
+    por_clave = pd.Series(valores).groupby(claves)
+    acumulado = (por_clave.cummax() if estadistico == 'max' else por_clave.cummin())
+    acumulado = acumulado.groupby(claves).ffill().to_numpy()
+    resultado[hay] = acumulado[fin[hay] - 1]
+    return resultado
+
+
+def calcular_victorias_previas(filas_df, victorias_df, clave, previas=None):
+    """
+    Calcula, para cada fila, las victorias acumuladas ANTES de esa carrera
+    (en toda la carrera deportiva y en la temporada actual) en una sola pasada.
+
+    Ordena por el código de (clave, RACE_ORDER), suma acumulativamente un
+    indicador de victoria desplazado una carrera y lo reinicia en cada temporada.
+
+    Parámetros:
+        filas_df (DataFrame): Filas a enriquecer, con columnas [clave, 'RACE_ORDER', 'YEAR'].
+        victorias_df (DataFrame): Una fila por victoria, con columnas [clave, 'RACE_ORDER', 'YEAR'].
+        clave (str): Columna por la que se agrupa (piloto o constructor).
+        previas (DataFrame): Opcional, victorias anteriores a victorias_df indexadas por
+            clave, con columnas ['YEAR', 'WINS CAREER', 'WINS SEASON'] (temporada de
+            'YEAR'). Se suman como punto de partida de cada clave.
+
+    Devuelve:
+        tuple: (wins_career, wins_season) como Series de enteros alineadas con filas_df.
+    """
+    columnas = [clave, 'RACE_ORDER', 'YEAR']
+
+    # Número de victorias de cada clave en cada carrera
+    victorias_por_carrera = victorias_df.groupby([clave, 'RACE_ORDER', 'YEAR']).size().rename('WINS')
+
+    # Una fila por (clave, carrera): las carreras disputadas más las ganadas
+    carreras = pd.concat([filas_df[columnas], victorias_df[columnas]]).drop_duplicates([clave, 'RACE_ORDER'])
+    carreras = carreras.join(victorias_por_carrera, on=columnas)
+    carreras['WINS'] = carreras['WINS'].fillna(0).astype(int)
+    orden = np.argsort(codificar_claves([carreras[clave], carreras['RACE_ORDER']]), kind='stable')
+    carreras = carreras.iloc[orden].reset_index(drop=True)
+
+    # Suma acumulada menos la carrera actual = victorias previas
+    carreras['WINS CAREER'] = carreras.groupby(clave)['WINS'].cumsum() - carreras['WINS']
+    carreras['WINS SEASON'] = carreras.groupby([clave, 'YEAR'])['WINS'].cumsum() - carreras['WINS']
+
+    # Devolver los valores en el orden de filas_df
+    resultado = anadir_columnas(filas_df[[clave, 'RACE_ORDER']], [
+        (indexar(carreras[[clave, 'RACE_ORDER', 'WINS CAREER', 'WINS SEASON']], [clave, 'RACE_ORDER']),
+         [clave, 'RACE_ORDER'])
+    ])
+    resultado[['WINS CAREER', 'WINS SEASON']] = resultado[['WINS CAREER', 'WINS SEASON']].fillna(0)
+
+    # Sumar las victorias anteriores como punto de partida
+    if previas is not None:
+        career_previas, season_previas = victorias_anteriores(filas_df, clave, previas)
+        resultado['WINS CAREER'] += career_previas
+        resultado['WINS SEASON'] += season_previas
+
+    return (
+        resultado['WINS CAREER'].astype(int),
+        resultado['WINS SEASON'].astype(int)
+    )
+
+
+def victorias_anteriores(filas_df, clave, previas):
+    """
+    Victorias guardadas en el estado de cada clave; las de temporada solo
+    cuentan si la fila es de la misma temporada que el estado.
+
+    Parámetros:
+        filas_df (DataFrame): Filas con columnas [clave, 'YEAR'].
+        clave (str): Columna por la que se agrupa (piloto o constructor).
+        previas (DataFrame): Estado indexado por clave con ['YEAR', 'WINS CAREER', 'WINS SEASON'].
+
+    Devuelve:
+        tuple: (wins_career, wins_season) como Series de enteros alineadas con filas_df.
+    """
+    claves = filas_df[clave]
+    misma_temporada = filas_df['YEAR'] == claves.map(previas['YEAR'])
+    return (
+        claves.map(previas['WINS CAREER']).fillna(0).astype(int),
+        claves.map(previas['WINS SEASON']).where(misma_temporada, 0).fillna(0).astype(int)
+    )
+
+
+def valor_anterior(filas_df, clave, columna, semilla=None):
+    """
+    Valor de columna en la fila anterior de la misma clave (groupby + shift(1)).
+
+    Las filas de cada clave deben estar en orden de RACEID (basta con ordenar
+    filas_df por RACEID). La primera fila de cada clave toma el valor de
+    semilla, que representa la última fila ya procesada de esa clave (p. ej.
+    en una construcción incremental).
+
+    Parámetros:
+        filas_df (DataFrame): Filas en orden de RACEID, con columnas [clave, columna].
+        clave (str): Columna por la que se agrupa (piloto o constructor).
+        columna (str): Columna cuyo valor anterior se devuelve.
+        semilla (Series): Opcional, valor anterior a filas_df indexado por clave.
+
+    Devuelve:
+        Series: Valores anteriores alineados con filas_df (NaN si no hay).
+    """
+    anterior = filas_df.groupby(clave)[columna].shift(1)
+    if semilla is not None:
+        primera = ~filas_df[clave].duplicated()
+        anterior = anterior.where(~primera, filas_df[clave].map(semilla))
+    return anterior
+
+
+def calcular_posicion_companero(filas_df, candidatos_df, claves, valor_col, defecto=21):
+    """
+    Obtiene para cada fila el valor de su compañero de equipo mediante una
+    auto-unión agrupada, sin recorrer las filas una a una.
+
+    El compañero es el primer candidato (en el orden de candidatos_df) con las
+    mismas claves y un DRIVERID distinto. Con 1 coche no hay compañero; con 3
+    coches cada piloto recibe siempre el primer compañero del grupo.
+
+    Parámetros:
+        filas_df (DataFrame): Filas a enriquecer, con columnas claves + ['DRIVERID'].
+        candidatos_df (DataFrame): Posibles compañeros, con columnas claves + ['DRIVERID', valor_col].
+        claves (list): Columnas que definen el equipo (p. ej. ['RACEID', 'CONSTRUCTORID']).
+        valor_col (str): Columna del compañero que se devuelve.
+        defecto (int): Valor si no hay compañero o su valor es nulo.
+
+    Devuelve:
+        Series: Valores enteros alineados con filas_df.
+    """
+    candidatos = candidatos_df[claves + ['DRIVERID', valor_col]]
+
+    # Primer candidato de cada grupo
+    primero = candidatos.groupby(claves, sort=False).head(1)
+    primero = primero.rename(columns={'DRIVERID': 'DRIVERID_1', valor_col: 'VALOR_1'})
+
+    # Primer candidato cuyo piloto es distinto del primero del grupo
+    candidatos = candidatos.merge(primero[claves + ['DRIVERID_1']], on=claves, how='left')
+    segundo = candidatos[candidatos['DRIVERID'] != candidatos['DRIVERID_1']].groupby(claves, sort=False).head(1)
+    segundo = segundo[claves + [valor_col]].rename(columns={valor_col: 'VALOR_2'})
+
+    resultado = filas_df[claves + ['DRIVERID']].merge(primero, on=claves, how='left').merge(segundo, on=claves, how='left')
+    resultado.index = filas_df.index
+
+    # Si la fila es el primer piloto del grupo, su compañero es el segundo
+    es_primero = resultado['DRIVERID'] == resultado['DRIVERID_1']
+    companero = resultado['VALOR_1'].where(~es_primero, resultado['VALOR_2'])
+    return companero.fillna(defecto).astype(int)
+
+
+def parsear_tiempos_clasificacion(tiempos):
+    """
+    Convierte tiempos de clasificación 'M:SS.mmm' a milisegundos para todas las
+    columnas a la vez, operando con NumPy sobre la matriz de caracteres.
+
+    Los valores nulos, '\\N' o con formato incorrecto se marcan como no válidos.
+
+    Parámetros:
+        tiempos (DataFrame): Columnas de tiempos en texto (p. ej. q1, q2, q3).
+
+    Devuelve:
+        tuple: (milisegundos, validos), dos arrays de forma (filas, columnas):
+            int32 con los milisegundos (0 si no es válido) y bool con la validez.
+    """
+    forma = np.shape(tiempos)
+    texto = np.asarray(tiempos, dtype=str).ravel()
+    ancho = texto.dtype.itemsize // 4
+
+    # Matriz (valores, caracteres) de códigos Unicode; 0 es relleno
+    codigos = texto.view(np.uint32).reshape(len(texto), ancho)
+    es_digito = (codigos >= ord('0')) & (codigos <= ord('9'))
+    es_dos_puntos = codigos == ord(':')
+    es_punto = codigos == ord('.')
+
+    # Formato válido: solo dígitos, ':' y '.', con exactamente un ':' y como mucho un '.'
+    validos = (
+        (es_digito | es_dos_puntos | es_punto | (codigos == 0)).all(axis=1)
+        & (es_dos_puntos.sum(axis=1) == 1)
+        & (es_punto.sum(axis=1) <= 1)
+    )
+
+    # Recorrer las posiciones de carácter (pocas) acumulando las cifras por el método de Horner
+    n = len(texto)
+    minutos = np.zeros(n, dtype=np.int64)
+    cifras_segundos = np.zeros(n, dtype=np.int64)
+    n_cifras_minutos = np.zeros(n, dtype=np.int64)
+    n_cifras_segundos = np.zeros(n, dtype=np.int64)
+    n_decimales = np.zeros(n, dtype=np.int64)
+    tras_dos_puntos = np.zeros(n, dtype=bool)
+    tras_punto = np.zeros(n, dtype=bool)
+    for j in range(ancho):
+        digito = codigos[:, j].astype(np.int64) - ord('0')
+        en_minutos = es_digito[:, j] & ~tras_dos_puntos
+        en_segundos = es_digito[:, j] & tras_dos_puntos
+        minutos = np.where(en_minutos, minutos * 10 + digito, minutos)
+        cifras_segundos = np.where(en_segundos, cifras_segundos * 10 + digito, cifras_segundos)
+        n_cifras_minutos += en_minutos
+        n_cifras_segundos += en_segundos
+        n_decimales += en_segundos & tras_punto
+        # El punto debe ir en los segundos, detrás de al menos una cifra
+        validos &= ~(es_punto[:, j] & ((n_cifras_segundos == 0) | ~tras_dos_puntos))
+        tras_punto |= es_punto[:, j]
+        tras_dos_puntos |= es_dos_puntos[:, j]
+
+    # Al menos una cifra a cada lado del ':' y sin desbordar los enteros
+    validos &= (n_cifras_minutos >= 1) & (n_cifras_minutos <= 6)
+    validos &= (n_cifras_segundos >= 1) & (n_cifras_segundos <= 15)
+
+    # N / 10**k con dos enteros exactos da el mismo double que float('SS.mmm');
+    # después, misma aritmética que int(minutos * 60 * 1000 + segundos * 1000)
+    segundos = cifras_segundos / 10.0 ** n_decimales
+    milisegundos = np.trunc(minutos * 60 * 1000 + segundos * 1000)
+    validos &= milisegundos <= np.iinfo(np.int32).max
+    milisegundos = np.where(validos, milisegundos, 0).astype(np.int32)
+
+    return milisegundos.reshape(forma), validos.reshape(forma)
+
+
+def calcular_vueltas_perdidas_por_estado(status_df, max_vueltas=4):
+    """
+    Precalcula un array de búsqueda statusId -> vueltas de retraso a partir de
+    los estados '+N Lap(s)' de status.csv.
+
+    Parámetros:
+        status_df (DataFrame): Tabla status.csv con columnas ['statusId', 'status'].
+        max_vueltas (int): Máximo de vueltas de retraso que se imputan; el resto cuenta como 0.
+
+    Devuelve:
+        ndarray: Array indexado por statusId con las vueltas de retraso (0 si no aplica).
+    """
+    vueltas = status_df['status'].str.extract(r'^\+(\d+) Laps?$')[0].astype(float).fillna(0).astype(int)
+    vueltas = vueltas.where(vueltas <= max_vueltas, 0)
+
+    lookup = np.zeros(status_df['statusId'].max() + 1, dtype=np.int32)
+    lookup[status_df['statusId'].to_numpy()] = vueltas.to_numpy()
+    return lookup
+
+
+def imputar_tiempo_vueltas_perdidas(df, vueltas_por_estado, perdida_ms=7000, perdida_por_circuito=None):
+    """
+    Estima MS RACE de los pilotos que terminan a N vueltas del ganador:
+    WINNER_TIME + (BEST Q + pérdida) * N, con aritmética de arrays enmascarada.
+
+    Parámetros:
+        df (DataFrame): Con columnas ['MS RACE', 'STATUS RACE', 'WINNER_TIME', 'BEST Q', 'CIRCUITID'].
+        vueltas_por_estado (ndarray): Array statusId -> vueltas (ver calcular_vueltas_perdidas_por_estado).
+        perdida_ms (float): Pérdida por vuelta de retraso sobre el mejor tiempo de clasificación.
+        perdida_por_circuito (dict): Opcional, {circuitId: pérdida en ms} que sustituye a perdida_ms.
+
+    Devuelve:
+        ndarray: MS RACE con los tiempos imputados (NaN donde no se puede estimar).
+    """
+    ms_race = df['MS RACE'].to_numpy(dtype=float)
+    estado = df['STATUS RACE'].to_numpy(dtype=float)
+
+    # Estados nulos o fuera de la tabla no tienen vueltas de retraso
+    estado_conocido = ~np.isnan(estado) & (estado >= 0) & (estado < len(vueltas_por_estado))
+    indices = np.where(estado_conocido, estado, 0).astype(np.int64)
+    vueltas = np.where(estado_conocido, vueltas_por_estado[indices], 0)
+
+    perdida = np.full(len(df), float(perdida_ms))
+    if perdida_por_circuito:
+        perdida = df['CIRCUITID'].map(perdida_por_circuito).fillna(perdida_ms).to_numpy(dtype=float)
+
+    estimado = df['WINNER_TIME'].to_numpy(dtype=float) + (df['BEST Q'].to_numpy(dtype=float) + perdida) * vueltas
+    imputar = np.isnan(ms_race) & (vueltas > 0) & ~np.isnan(estimado)
+    return np.where(imputar, estimado, ms_race)
+
+
+def actualizar_estado(estado, ultimas_df, victorias_df, clave):
+    """
+    Actualiza el estado por piloto o constructor tras procesar un bloque de
+    carreras, para poder continuar después solo con las carreras nuevas.
+
+    Parámetros:
+        estado (DataFrame): Estado anterior indexado por clave, o None si no hay.
+        ultimas_df (DataFrame): Última fila procesada de cada clave, con [clave, 'YEAR']
+            y las columnas que sirven de semilla (posición, puntos...).
+        victorias_df (DataFrame): Victorias del bloque, con columnas [clave, 'YEAR'].
+        clave (str): Columna por la que se agrupa (piloto o constructor).
+
+    Devuelve:
+        DataFrame: Estado indexado por clave con las columnas de ultimas_df más
+            'WINS CAREER' y 'WINS SEASON' (de la temporada 'YEAR'), incluyendo la última carrera.
+    """
+    nuevo = ultimas_df.set_index(clave)
+
+    # Victorias del bloque: totales y en la temporada de la última carrera de cada clave
+    victorias = victorias_df.groupby([clave, 'YEAR']).size()
+    temporada = pd.MultiIndex.from_arrays([nuevo.index, nuevo['YEAR']])
+    nuevo['WINS CAREER'] = victorias.groupby(level=0).sum().reindex(nuevo.index, fill_value=0)
+    nuevo['WINS SEASON'] = victorias.reindex(temporada, fill_value=0).to_numpy()
+
+    if estado is None:
+        return nuevo
+
+    # Sumar las victorias anteriores y conservar las claves que no aparecen en el bloque
+    misma_temporada = nuevo['YEAR'] == nuevo.index.map(estado['YEAR'])
+    nuevo['WINS CAREER'] += nuevo.index.map(estado['WINS CAREER']).fillna(0).astype(int)
+    nuevo['WINS SEASON'] += np.where(misma_temporada, nuevo.index.map(estado['WINS SEASON']).fillna(0), 0).astype(int)
+    return pd.concat([estado[~estado.index.isin(nuevo.index)], nuevo])
+
+
+def cargar_estado(min_year=2014):
+    """
+    Carga el estado guardado por generar_dataset_f1_completo.
+
+    Devuelve:
+        tuple: (estado_pilotos, estado_constructores, estado_circuitos), indexados por su clave.
+    """
+    return tuple(
+        pd.read_csv(ESTADO_FILE.format(min_year=min_year, tabla=tabla), index_col=clave, float_precision='round_trip')
+        for tabla, clave in ESTADO_CLAVES.items()
+    )
+
+
+def ultima_carrera_estado(estado_pilotos, estado_constructores):
+    """raceId de la última carrera incluida en el estado de pilotos y constructores."""
+    return int(max(estado_pilotos['RACEID'].max(), estado_constructores['RACEID'].max()))
+
+
+def guardar_estado(min_year, estado_pilotos, estado_constructores, estado_circuitos):
+    """Guarda el estado por piloto, constructor y circuito (ver cargar_estado)."""
+    for (tabla, clave), estado in zip(ESTADO_CLAVES.items(), [estado_pilotos, estado_constructores, estado_circuitos]):
+        estado.rename_axis(clave).sort_index().to_csv(ESTADO_FILE.format(min_year=min_year, tabla=tabla))
+
+
+def calcular_features_desde_estado(filas_df, estado_pilotos, estado_constructores, estado_circuitos):
+    """
+    Calcula las features históricas de una carrera futura a partir del estado
+    guardado, sin releer el histórico: es la misma definición que usa el
+    dataset de entrenamiento para la carrera siguiente a la última procesada.
+
+    Parámetros:
+        filas_df (DataFrame): Una fila por piloto, con columnas
+            ['RACEID', 'DRIVERID', 'CONSTRUCTORID', 'CIRCUITID', 'YEAR'] (año real).
+        estado_pilotos, estado_constructores, estado_circuitos (DataFrame): Ver cargar_estado.
+
+    Devuelve:
+        DataFrame: Features alineadas con filas_df. LAPS RACE (vueltas de la
+            última carrera en el circuito) es NaN si no hay carreras previas en él.
+    """
+    pilotos = filas_df['DRIVERID']
+    constructores = filas_df['CONSTRUCTORID']
+    features = pd.DataFrame(index=filas_df.index)
+
+    features['LAPS RACE'] = filas_df['CIRCUITID'].map(estado_circuitos['LAPS RACE'])
+    features['DRIVER LAST POSITION'] = pilotos.map(estado_pilotos['LAST POSITION']).fillna(21).astype(int)
+    features['POINTS BEFORE GP'] = pilotos.map(estado_pilotos['POINTS STANDINGS']).fillna(0)
+    features['YEARS OF EXPERIENCE'] = (filas_df['YEAR'] - pilotos.map(estado_pilotos['DEBUT_YEAR'])).fillna(0).astype(int)
+    features['WINS CAREER'], features['WINS SEASON'] = victorias_anteriores(filas_df, 'DRIVERID', estado_pilotos)
+
+    features['CONSTRUCTOR POINTS BEFORE GP'] = constructores.map(estado_constructores['CONSTRUCTOR POINTS']).fillna(0)
+    _, features['CONSTRUCTOR WINS SEASON'] = victorias_anteriores(filas_df, 'CONSTRUCTORID', estado_constructores)
+
+    # Mismo orden de candidatos que en el dataset de entrenamiento: (RACEID, DRIVERID)
+    candidatos = filas_df[['RACEID', 'CONSTRUCTORID', 'DRIVERID']].assign(**{
+        'DRIVER LAST POSITION': features['DRIVER LAST POSITION']
+    }).sort_values(['RACEID', 'DRIVERID'])
+    features['MATE LAST POSITION'] = calcular_posicion_companero(
+        filas_df, candidatos, ['RACEID', 'CONSTRUCTORID'], 'DRIVER LAST POSITION'
+    )
+    return features
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from datos import leer_tabla
+from features import VENTANA_HISTORIAL, VENTANA_TEMPORADA, agregados_previos, anadir_columnas, indexar
+
+# Forma reciente a partir de los resultados de las carreras anteriores, declarada
+# para agregados_previos: {columna: (claves, valor, ventana, estadístico)}. Valores
+# de cada resultado (ver historial_resultados):
+#   POSICION: orden de llegada (positionOrder, definido también si no terminó)
+#   TERMINA: 1 si fue clasificado, 0 si no
+#   GANADAS: posiciones ganadas desde la parrilla (GRID 0, salida desde boxes, cuenta como 20)
+DEFINICIONES_FORMA = {
+    'DRIVER AVG POSITION 5': (['DRIVERID'], 'POSICION', 5, 'mean'),
+    'DRIVER FINISH RATE 10': (['DRIVERID'], 'TERMINA', 10, 'mean'),
+    'DRIVER POSITIONS GAINED SEASON': (['DRIVERID'], 'GANADAS', VENTANA_TEMPORADA, 'mean'),
+    'DRIVER BEST POSITION CIRCUIT': (['DRIVERID', 'CIRCUITID'], 'POSICION', VENTANA_HISTORIAL, 'min'),
+    'CONSTRUCTOR AVG POSITION 5': (['CONSTRUCTORID'], 'POSICION', 5, 'mean'),
+}
+COLUMNAS_FORMA = list(DEFINICIONES_FORMA)
+
+# Definiciones que se calculan con una fila por constructor y carrera (media de sus coches)
+FORMA_CONSTRUCTORES = ['CONSTRUCTOR AVG POSITION 5']
+
+# Valores sin historial: posición 21 (como DRIVER LAST POSITION), la tasa media de
+# clasificados desde 2014 y ninguna posición ganada
+DEFECTO_FORMA = {
+    'DRIVER AVG POSITION 5': 21.0,
+    'DRIVER FINISH RATE 10': 0.86,
+    'DRIVER POSITIONS GAINED SEASON': 0.0,
+    'DRIVER BEST POSITION CIRCUIT': 21.0,
+    'CONSTRUCTOR AVG POSITION 5': 21.0,
+}
+
+
+def historial_resultados(hasta_race_id=None):
+    """
+    Resultados de carrera de results.csv con su circuito y año, y los valores de DEFINICIONES_FORMA.
+
+    Parámetros:
+        hasta_race_id (int): Opcional, solo carreras con raceId anterior.
+
+    Devuelve:
+        DataFrame: RACEID, DRIVERID, CONSTRUCTORID, CIRCUITID, YEAR, POSICION, TERMINA y GANADAS,
+            una fila por piloto y carrera (en los coches compartidos de los años 50, la primera).
+    """
+    results_df = leer_tabla('results', ['raceId', 'driverId', 'constructorId', 'grid', 'position', 'positionOrder'])
+    if hasta_race_id is not None:
+        results_df = results_df[results_df['raceId'] < hasta_race_id]
+    results_df = results_df.drop_duplicates(['raceId', 'driverId'])
+    historial = anadir_columnas(results_df, [
+        (indexar(leer_tabla('races', ['raceId', 'circuitId', 'year']), ['raceId']), ['raceId']),
+    ])
+    return pd.DataFrame({
+        'RACEID': historial['raceId'],
+        'DRIVERID': historial['driverId'],
+        'CONSTRUCTORID': historial['constructorId'],
+        'CIRCUITID': historial['circuitId'],
+        'YEAR': historial['year'],
+        'POSICION': historial['positionOrder'],
+        'TERMINA': historial['position'].notna().astype(np.int8),
+        'GANADAS': historial['grid'].replace(0, 20) - historial['positionOrder'],
+    }).reset_index(drop=True)
+
+
+def calcular_features_forma(filas_df, historial_df):
+    """
+    Calcula COLUMNAS_FORMA de cada fila con los resultados de las carreras
+    anteriores (raceId menor), según DEFINICIONES_FORMA. Sin historial se usa DEFECTO_FORMA.
+
+    Parámetros:
+        filas_df (DataFrame): Filas con RACEID, DRIVERID, CONSTRUCTORID, CIRCUITID y YEAR (el año, sin transformar).
+        historial_df (DataFrame): Ver historial_resultados (puede incluir carreras posteriores: no se usan).
+
+    Devuelve:
+        DataFrame: COLUMNAS_FORMA, con el índice de filas_df.
+    """
+    constructores = historial_df.groupby(['RACEID', 'CONSTRUCTORID'], as_index=False)['POSICION'].mean()
+    features = pd.concat([
+        agregados_previos(historial_df, filas_df,
+                          {col: DEFINICIONES_FORMA[col] for col in COLUMNAS_FORMA if col not in FORMA_CONSTRUCTORES}),
+        agregados_previos(constructores, filas_df, {col: DEFINICIONES_FORMA[col] for col in FORMA_CONSTRUCTORES}),
+    ], axis=1)
+    return features[COLUMNAS_FORMA].fillna(DEFECTO_FORMA)
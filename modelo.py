@@ -0,0 +1,240 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+
+from clima import COLUMNAS_VENTANAS
+from datos import huella_archivo, leer_csv_dataset, leer_dataset
+from features import COLUMNAS_FEATURES
+from forma import COLUMNAS_FORMA
+from paradas import COLUMNAS_PARADAS
+
+MODEL_FILE = 'f1_modelo.joblib'
+DATASET_FILE = 'f1_training_data_2014_onwards.csv'
+
+# Versión del formato del artefacto: cambiarla invalida los modelos guardados
+VERSION_ARTEFACTO = 1
+
+# Columnas del dataset que no entran al modelo: identificadores y temperaturas
+# máxima/mínima (muy correladas con la media, ver entrenamiento_modelo.ipynb)
+COLUMNAS_EXCLUIDAS = ['RACEID', 'DRIVERID', 'CONSTRUCTORID', 'CIRCUITID', 'MAX TEMPERATURE', 'MIN TEMPERATURE']
+OBJETIVO = 'MS RACE'
+
+# Mejores parámetros del GridSearchCV de los notebooks
+PARAMETROS_MODELO = {'n_estimators': 100, 'learning_rate': 0.1, 'max_depth': 4}
+
+# Motores de boosting: 'gbr' (GradientBoostingRegressor, divisiones exactas, el de
+# los notebooks) o 'hist' (HistGradientBoostingRegressor, por histogramas y con
+# soporte nativo de valores nulos)
+MOTORES = ('gbr', 'hist')
+
+# Valores centinela del dataset que el motor 'hist' puede tratar como nulos
+SENTINELAS = {'Q1': 300000, 'Q2': 300000, 'Q3': 300000, 'BEST Q': 300000}
+
+
+def columnas_modelo(clima_ventanas=False, paradas=False, forma=False):
+    """Columnas de entrada del modelo, en orden, para las features que generan script_carga.py y entry.py."""
+    features = (COLUMNAS_FEATURES + (COLUMNAS_VENTANAS if clima_ventanas else []) + (COLUMNAS_PARADAS if paradas else [])
+                + (COLUMNAS_FORMA if forma else []))
+    return [col for col in features if col not in COLUMNAS_EXCLUIDAS]
+
+
+def huella_esquema(columnas):
+    """SHA-256 de la lista ordenada de columnas de entrada."""
+    return hashlib.sha256(json.dumps(list(columnas)).encode('utf-8')).hexdigest()
+
+
+def sentinelas_a_nulos(X):
+    """Sustituye los valores centinela de SENTINELAS por NaN (el motor 'hist' los trata como faltantes)."""
+    X = X.copy()
+    for col, valor in SENTINELAS.items():
+        if col in X.columns:
+            X[col] = X[col].mask(X[col] == valor)
+    return X
+
+
+def crear_pipeline(columnas, motor='gbr', nulos_nativos=False, **parametros):
+    """
+    Pipeline de los notebooks: StandardScaler sobre todas las columnas + regresor de boosting.
+
+    Parámetros:
+        columnas (list): Columnas de entrada.
+        motor (str): 'gbr' o 'hist' (ver MOTORES).
+        nulos_nativos (bool): Solo con 'hist', pasar los centinelas de SENTINELAS como NaN.
+        **parametros: n_estimators, learning_rate, max_depth (con 'hist', n_estimators es max_iter).
+
+    Devuelve:
+        Pipeline: Con los pasos 'preprocessor' y 'model' (y 'nulos' antes si nulos_nativos).
+    """
+    from sklearn.compose import ColumnTransformer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import FunctionTransformer, StandardScaler
+
+    if motor not in MOTORES:
+        raise ValueError(f"Motor desconocido: {motor} (disponibles: {MOTORES})")
+    if nulos_nativos and motor != 'hist':
+        raise ValueError("nulos_nativos solo es compatible con el motor 'hist'")
+
+    parametros = {**PARAMETROS_MODELO, **parametros}
+    if motor == 'gbr':
+        from sklearn.ensemble import GradientBoostingRegressor
+        model = GradientBoostingRegressor(random_state=42, **parametros)
+    else:
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        model = HistGradientBoostingRegressor(random_state=42, early_stopping=False,
+                                              max_iter=parametros.pop('n_estimators'), **parametros)
+
+    preprocessor = ColumnTransformer(transformers=[('num', StandardScaler(), list(columnas))])
+    pasos = [('preprocessor', preprocessor), ('model', model)]
+    if nulos_nativos:
+        pasos.insert(0, ('nulos', FunctionTransformer(sentinelas_a_nulos)))
+    return Pipeline(steps=pasos)
+
+
+def entrenar_modelo(dataset_file=DATASET_FILE, model_file=MODEL_FILE, clima_ventanas=False, motor='gbr',
+                    nulos_nativos=False, paradas=False, forma=False, **parametros):
+    """
+    Entrena el modelo con todo el dataset y lo guarda junto a sus metadatos.
+
+    El objetivo es log1p(MS RACE), como en los notebooks; predecir_carrera
+    deshace la transformación.
+
+    Parámetros:
+        dataset_file (str): CSV generado por script_carga.py.
+        model_file (str): Ruta del artefacto (joblib).
+        clima_ventanas (bool): Si el dataset incluye COLUMNAS_VENTANAS (--clima-ventanas).
+        paradas (bool): Si el dataset incluye COLUMNAS_PARADAS (--paradas).
+        forma (bool): Si el dataset incluye COLUMNAS_FORMA (--forma).
+        motor (str), nulos_nativos (bool): Ver crear_pipeline.
+        **parametros: Parámetros del regresor (por defecto PARAMETROS_MODELO).
+
+    Devuelve:
+        dict: El artefacto guardado.
+    """
+    columnas = columnas_modelo(clima_ventanas, paradas, forma)
+    df = leer_dataset(dataset_file)
+    faltan = [col for col in columnas + [OBJETIVO] if col not in df.columns]
+    if faltan:
+        raise ValueError(f"{dataset_file} no tiene las columnas {faltan}; ¿clima_ventanas={clima_ventanas}, paradas={paradas} y forma={forma} son correctos?")
+
+    pipeline = crear_pipeline(columnas, motor=motor, nulos_nativos=nulos_nativos, **parametros)
+    inicio = time.perf_counter()
+    pipeline.fit(df[columnas], np.log1p(df[OBJETIVO]))
+    duracion = time.perf_counter() - inicio
+
+    import sklearn
+    artefacto = {
+        'version': VERSION_ARTEFACTO,
+        'pipeline': pipeline,
+        'columnas': columnas,
+        'esquema': huella_esquema(columnas),
+        'datos': {
+            'archivo': os.path.basename(dataset_file),
+            'sha256': huella_archivo(dataset_file),
+            'filas': len(df),
+            'ultima_carrera': int(df['RACEID'].max()),
+        },
+        'motor': motor,
+        'nulos_nativos': nulos_nativos,
+        'parametros': pipeline.named_steps['model'].get_params(),
+        'sklearn': sklearn.__version__,
+        'entrenado': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'segundos_entrenamiento': round(duracion, 3),
+    }
+
+    # Escribir a un temporal y renombrar para no dejar artefactos a medias
+    temporal = model_file + '.tmp'
+    joblib.dump(artefacto, temporal)
+    os.replace(temporal, model_file)
+    return artefacto
+
+
+def cargar_modelo(model_file=MODEL_FILE):
+    """
+    Carga un artefacto guardado por entrenar_modelo.
+
+    Rechaza el modelo si su versión de formato no es la actual o si sus
+    columnas no coinciden con las features que generan ahora
+    script_carga.py/entry.py (con o sin ventanas de clima, paradas en boxes y forma reciente).
+
+    Devuelve:
+        dict: El artefacto, con el Pipeline en 'pipeline'.
+    """
+    artefacto = joblib.load(model_file)
+    if artefacto.get('version') != VERSION_ARTEFACTO:
+        raise ValueError(f"{model_file} tiene formato v{artefacto.get('version')} (actual: v{VERSION_ARTEFACTO}); "
+                         "hay que volver a entrenarlo.")
+    esquemas = {huella_esquema(columnas_modelo(*opciones)) for opciones in itertools.product((False, True), repeat=3)}
+    if artefacto['esquema'] != huella_esquema(artefacto['columnas']) or artefacto['esquema'] not in esquemas:
+        raise ValueError(f"{model_file} se entrenó con otras features que las actuales de script_carga.py/entry.py; "
+                         "hay que volver a entrenarlo.")
+    return artefacto
+
+
+def predecir_carrera(race_file, artefacto):
+    """
+    Predice el tiempo de carrera de cada piloto de un archivo de entry.py.
+
+    Parámetros:
+        race_file (str): Archivo de entrada (p. ej. f1_race_1168_data.csv, o .csv.gz / .parquet).
+        artefacto (dict): Modelo devuelto por cargar_modelo.
+
+    Devuelve:
+        DataFrame: RACEID, DRIVERID, CONSTRUCTORID, PREDICTED MS RACE y PREDICTED POSITION,
+            ordenado por la posición predicha.
+    """
+    # El CSV de una carrera es pequeño: se lee sin crear caché
+    race_df = leer_dataset(race_file) if race_file.endswith('.parquet') else leer_csv_dataset(race_file)
+    faltan = [col for col in artefacto['columnas'] if col not in race_df.columns]
+    if faltan:
+        raise ValueError(f"{race_file} no tiene las columnas del modelo: {faltan}")
+
+    prediccion = race_df[['RACEID', 'DRIVERID', 'CONSTRUCTORID']].copy()
+    prediccion['PREDICTED MS RACE'] = np.expm1(artefacto['pipeline'].predict(race_df[artefacto['columnas']]))
+    prediccion['PREDICTED POSITION'] = prediccion['PREDICTED MS RACE'].rank(method='first').astype(int)
+    return prediccion.sort_values('PREDICTED POSITION').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrena el modelo de tiempos de carrera o predice una carrera.")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    entrenar = subparsers.add_parser('entrenar', help="Entrena con todo el dataset y guarda el modelo.")
+    entrenar.add_argument('--dataset', default=DATASET_FILE, help="CSV de entrenamiento de script_carga.py.")
+    entrenar.add_argument('--modelo', default=MODEL_FILE, help="Ruta del modelo a guardar.")
+    entrenar.add_argument('--clima-ventanas', action='store_true',
+                          help="El dataset incluye el clima de las ventanas de sesión.")
+    entrenar.add_argument('--paradas', action='store_true', help="El dataset incluye las features de paradas en boxes.")
+    entrenar.add_argument('--forma', action='store_true', help="El dataset incluye las features de forma reciente.")
+    entrenar.add_argument('--motor', choices=MOTORES, default='gbr', help="Motor de boosting.")
+    entrenar.add_argument('--nulos-nativos', action='store_true',
+                          help="Con --motor hist, tratar los tiempos de clasificación centinela como nulos.")
+
+    predecir = subparsers.add_parser('predecir', help="Predice una carrera con el modelo guardado.")
+    predecir.add_argument('race_file', help="Archivo de entry.py (p. ej. f1_race_1168_data.csv).")
+    predecir.add_argument('--modelo', default=MODEL_FILE, help="Ruta del modelo guardado.")
+    predecir.add_argument('--salida', default=None, help="Opcional, CSV donde guardar la predicción.")
+    args = parser.parse_args()
+
+    if args.comando == 'entrenar':
+        artefacto = entrenar_modelo(args.dataset, args.modelo, clima_ventanas=args.clima_ventanas,
+                                    motor=args.motor, nulos_nativos=args.nulos_nativos, paradas=args.paradas,
+                                    forma=args.forma)
+        print(f"✓ Modelo guardado en {args.modelo} ({artefacto['datos']['filas']} filas, "
+              f"hasta raceId {artefacto['datos']['ultima_carrera']}, {artefacto['segundos_entrenamiento']:.1f} s)")
+    else:
+        inicio = time.perf_counter()
+        artefacto = cargar_modelo(args.modelo)
+        prediccion = predecir_carrera(args.race_file, artefacto)
+        duracion = time.perf_counter() - inicio
+        print(prediccion.to_string(index=False))
+        print(f"\nModelo entrenado el {artefacto['entrenado']} con {artefacto['datos']['archivo']} "
+              f"(hasta raceId {artefacto['datos']['ultima_carrera']}); carga y predicción en {duracion:.3f} s")
+        if args.salida:
+            prediccion.to_csv(args.salida, index=False)
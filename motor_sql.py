@@ -0,0 +1,402 @@
+import contextlib
+import sqlite3
+
+import pandas as pd
+
+from clima import COLUMNAS_VENTANAS, clima_ventanas_carreras, leer_clima_carreras
+from datos import YEAR_REFERENCIA, huella_tabla, leer_tabla
+from features import COLUMNAS_FEATURES
+from perfil import RegistroEtapas
+
+SQL_FILE = 'f1_data.sqlite'
+
+# Tablas de f1_data que se cargan en la base de datos, con sus índices
+TABLAS_SQL = {
+    'races': [['raceId'], ['year']],
+    'results': [['raceId', 'driverId', 'constructorId'], ['driverId'], ['constructorId']],
+    'sprint_results': [['raceId', 'driverId', 'constructorId']],
+    'qualifying': [['raceId', 'driverId', 'constructorId']],
+    'circuits': [['circuitId']],
+    'drivers': [['driverId']],
+    'driver_standings': [['raceId', 'driverId']],
+    'constructor_standings': [['raceId', 'constructorId']],
+    'status': [['statusId']],
+}
+
+
+def cargar_base(conexion):
+    """
+    Carga en la base de datos las tablas de TABLAS_SQL que no están o cuyo CSV
+    cambió desde la última carga (según su SHA-256, ver datos.huella_tabla).
+
+    Cada tabla se lee con leer_tabla ('\\N' como nulo), se guarda con el mismo
+    nombre y sus columnas y se indexa. Las filas conservan el orden del CSV
+    (rowid), que es el que usan las consultas para desempatar.
+
+    Parámetros:
+        conexion (sqlite3.Connection): Conexión a la base de datos.
+
+    Devuelve:
+        list: Tablas cargadas (vacía si todas estaban al día).
+    """
+    conexion.execute('CREATE TABLE IF NOT EXISTS origen_tablas (tabla TEXT PRIMARY KEY, sha256 TEXT)')
+    guardadas = dict(conexion.execute('SELECT tabla, sha256 FROM origen_tablas'))
+    cargadas = []
+    for tabla, indices in TABLAS_SQL.items():
+        sha256 = huella_tabla(tabla)
+        if guardadas.get(tabla) == sha256:
+            continue
+        df = leer_tabla(tabla)
+        df = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+        df.to_sql(tabla, conexion, if_exists='replace', index=False, chunksize=100000)
+        for i, columnas in enumerate(indices):
+            conexion.execute(f'CREATE INDEX {tabla}_{i} ON {tabla} ({", ".join(columnas)})')
+        conexion.execute('INSERT OR REPLACE INTO origen_tablas VALUES (?, ?)', (tabla, sha256))
+        conexion.commit()
+        cargadas.append(tabla)
+    return cargadas
+
+
+def tabla_temporal(conexion, nombre, df, clave):
+    """Copia df a la tabla temporal nombre (los nulos como NULL), indexada por la columna clave."""
+    # Con el tipo declarado, la columna clave tiene la afinidad de las de las
+    # tablas con las que se une y SQLite puede usar su índice
+    tipos = {col: 'INTEGER' if pd.api.types.is_integer_dtype(df[col]) else
+             'REAL' if pd.api.types.is_float_dtype(df[col]) else 'TEXT' for col in df.columns}
+    columnas = ', '.join(f'"{col}" {tipos[col]}' for col in df.columns)
+    conexion.execute(f'CREATE TEMP TABLE {nombre} ({columnas})')
+    valores = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    conexion.executemany(f'INSERT INTO {nombre} VALUES ({", ".join("?" * len(df.columns))})', valores)
+    conexion.execute(f'CREATE INDEX {nombre}_{clave} ON {nombre} ({clave})')
+
+
+def sql_tiempo_clasificacion(col):
+    """
+    Expresiones SQL de un tiempo de clasificación 'M:SS.mmm': milisegundos y
+    validez, con las reglas y la aritmética de features.parsear_tiempos_clasificacion
+    (las cifras de los segundos entre 10**decimales dan el mismo double que float('SS.mmm')).
+    Los tiempos con la forma habitual 'M:SS.mmm' se resuelven por posición
+    sin evaluar la expresión general, que es mucho más larga.
+
+    Devuelve:
+        tuple: (expresión de los milisegundos, expresión de la validez).
+    """
+    habitual = f"{col} GLOB '[0-9]:[0-9][0-9].[0-9][0-9][0-9]'"
+    ms_habitual = (f"CAST(CAST(substr({col}, 1, 1) AS INTEGER) * 60000 "
+                   f"+ CAST(substr({col}, 3, 2) || substr({col}, 6, 3) AS INTEGER) / 1000.0 * 1000 AS INTEGER)")
+    dos_puntos = f"instr({col}, ':')"
+    segundos = f"substr({col}, {dos_puntos} + 1)"
+    punto = f"instr({segundos}, '.')"
+    cifras = f"replace({segundos}, '.', '')"
+    decimales = f"(CASE WHEN {punto} = 0 THEN 0 ELSE length({segundos}) - {punto} END)"
+    ms = (f"CAST(CAST(substr({col}, 1, {dos_puntos} - 1) AS INTEGER) * 60000 "
+          f"+ CAST({cifras} AS INTEGER) / CAST('1e' || {decimales} AS REAL) * 1000 AS INTEGER)")
+    valido = (f"({col} IS NOT NULL AND {col} NOT GLOB '*[^0-9:.]*' "
+              f"AND length({col}) - length(replace({col}, ':', '')) = 1 "
+              f"AND length({col}) - length(replace({col}, '.', '')) <= 1 "
+              # El punto va en los segundos, detrás de al menos una cifra
+              f"AND (instr({col}, '.') = 0 OR instr({col}, '.') > {dos_puntos} + 1) "
+              f"AND {dos_puntos} BETWEEN 2 AND 7 AND length({cifras}) BETWEEN 1 AND 15 "
+              f"AND {ms} <= 2147483647)")
+    return f"CASE WHEN {habitual} THEN {ms_habitual} ELSE {ms} END", f"CASE WHEN {habitual} THEN 1 ELSE {valido} END"
+
+
+# --- 1. Carreras y filas (como filas_carreras: resultados más sprints sin resultado, en orden de claves) ---
+
+SQL_CARRERAS = """
+CREATE TEMP TABLE carreras AS
+SELECT raceId, year, round, circuitId, date FROM races WHERE year >= :desde
+"""
+
+SQL_FILAS = """
+CREATE TEMP TABLE filas AS
+SELECT ROW_NUMBER() OVER (ORDER BY raceId, driverId, constructorId, origen, fila) AS seq, *
+FROM (
+    SELECT r.raceId, r.driverId, r.constructorId, r.grid, r.milliseconds, r.statusId, r.position,
+           0 AS origen, r.rowid AS fila
+    FROM results r JOIN carreras c ON c.raceId = r.raceId
+    UNION ALL
+    SELECT s.raceId, s.driverId, s.constructorId, NULL, NULL, NULL, NULL, 1, s.rowid
+    FROM sprint_results s JOIN carreras c ON c.raceId = s.raceId
+    WHERE NOT EXISTS (SELECT 1 FROM results r WHERE r.raceId = s.raceId AND r.driverId = s.driverId
+                      AND r.constructorId = s.constructorId)
+)
+"""
+
+# --- 2. Tablas auxiliares: ganador, vueltas de retraso por estado, debut y victorias ---
+
+# Primer ganador de cada carrera en el orden del CSV (coches compartidos en los años 50)
+SQL_GANADORES = """
+CREATE TEMP TABLE ganadores AS
+SELECT raceId, laps, milliseconds FROM (
+    SELECT r.raceId, r.laps, r.milliseconds, ROW_NUMBER() OVER (PARTITION BY r.raceId ORDER BY r.rowid) AS n
+    FROM results r JOIN carreras c ON c.raceId = r.raceId WHERE r.position = 1
+) WHERE n = 1
+"""
+
+# statusId -> N de '+N Lap(s)' (0 si no aplica o si N > max_vueltas), como calcular_vueltas_perdidas_por_estado
+SQL_VUELTAS = """
+CREATE TEMP TABLE vueltas AS
+SELECT statusId,
+       CASE WHEN status GLOB '+[0-9]*' AND substr(status, instr(status, ' ')) IN (' Lap', ' Laps')
+                 AND substr(status, 2, instr(status, ' ') - 2) NOT GLOB '*[^0-9]*'
+                 AND CAST(substr(status, 2, instr(status, ' ') - 2) AS INTEGER) <= :max_vueltas
+            THEN CAST(substr(status, 2, instr(status, ' ') - 2) AS INTEGER) ELSE 0 END AS vueltas
+FROM status
+"""
+
+# Año de debut: el de la carrera de la primera fila del piloto en results (nulo si es anterior a :desde)
+# (con min(rowid), SQLite toma raceId de esa misma fila)
+SQL_DEBUTS = """
+CREATE TEMP TABLE debuts AS
+SELECT p.driverId, c.year AS debut
+FROM (SELECT driverId, raceId, min(rowid) FROM results GROUP BY driverId) p
+LEFT JOIN carreras c ON c.raceId = p.raceId
+"""
+
+SQL_GANADAS = """
+CREATE TEMP TABLE ganadas AS
+SELECT r.raceId, r.driverId, r.constructorId, c.year
+FROM results r JOIN carreras c ON c.raceId = r.raceId WHERE r.position = 1
+"""
+
+# Victorias anteriores a cada (clave, carrera) disputada, en total y en la temporada
+SQL_VICTORIAS = """
+CREATE TEMP TABLE victorias_{clave} AS
+SELECT {clave}, raceId,
+       COALESCE(SUM(victorias) OVER (PARTITION BY {clave} ORDER BY raceId
+                                     ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS carrera,
+       COALESCE(SUM(victorias) OVER (PARTITION BY {clave}, year ORDER BY raceId
+                                     ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS temporada
+FROM (
+    SELECT p.{clave}, p.raceId, c.year, COALESCE(g.victorias, 0) AS victorias
+    FROM (SELECT DISTINCT {clave}, raceId FROM filas) p
+    JOIN carreras c ON c.raceId = p.raceId
+    LEFT JOIN (SELECT {clave}, raceId, COUNT(*) AS victorias FROM ganadas GROUP BY {clave}, raceId) g
+           ON g.{clave} = p.{clave} AND g.raceId = p.raceId
+)
+"""
+
+# --- 3. Fusiones (left joins) y clasificación ---
+
+SQL_FUSIONES = """
+CREATE TEMP TABLE fusiones AS
+SELECT f.seq, f.raceId, f.driverId, f.constructorId, c.circuitId, c.round, c.year, c.date, d.dob,
+       ci.lap_distance_km, ci.urban, f.grid, f.position, f.milliseconds, f.statusId,
+       s.statusId IS NOT NULL AS sprint,
+       {q1_ms} AS q1_ms, {q1_valido} AS q1_valido,
+       {q2_ms} AS q2_ms, {q2_valido} AS q2_valido,
+       {q3_ms} AS q3_ms, {q3_valido} AS q3_valido,
+       ds.points AS puntos, cs.points AS puntos_constructor, g.laps, g.milliseconds AS tiempo_ganador
+FROM filas f
+JOIN carreras c ON c.raceId = f.raceId
+LEFT JOIN sprint_results s ON s.raceId = f.raceId AND s.driverId = f.driverId AND s.constructorId = f.constructorId
+LEFT JOIN qualifying q ON q.raceId = f.raceId AND q.driverId = f.driverId AND q.constructorId = f.constructorId
+LEFT JOIN circuits ci ON ci.circuitId = c.circuitId
+LEFT JOIN drivers d ON d.driverId = f.driverId
+LEFT JOIN driver_standings ds ON ds.raceId = f.raceId AND ds.driverId = f.driverId
+LEFT JOIN constructor_standings cs ON cs.raceId = f.raceId AND cs.constructorId = f.constructorId
+LEFT JOIN ganadores g ON g.raceId = f.raceId
+"""
+
+# --- 4. Tiempo de carrera y features históricas (ventanas sobre las filas en orden) ---
+
+SQL_HISTORICO = """
+CREATE TEMP TABLE historico AS
+SELECT h.*,
+       COALESCE(h.milliseconds,
+                CASE WHEN v.vueltas > 0
+                     THEN h.tiempo_ganador + (h.mejor_q + COALESCE(p.perdida, :perdida)) * v.vueltas END,
+                10000000) AS ms_race,
+       CAST((julianday(h.date) - julianday(h.dob)) / 365.25 AS INTEGER) AS edad,
+       COALESCE(LAG(h.position) OVER pilotos, 21) AS posicion_anterior,
+       COALESCE(LAG(h.puntos) OVER pilotos, 0) AS puntos_anteriores,
+       COALESCE(LAG(h.puntos_constructor) OVER constructores, 0) AS puntos_constructor_anteriores,
+       COALESCE(h.year - db.debut, 0) AS experiencia,
+       vp.carrera AS victorias_carrera, vp.temporada AS victorias_temporada,
+       vc.temporada AS victorias_constructor
+FROM (
+    SELECT *, CASE WHEN q1_valido THEN q1_ms ELSE 300000 END AS q1,
+              CASE WHEN q2_valido THEN q2_ms ELSE 300000 END AS q2,
+              CASE WHEN q3_valido THEN q3_ms ELSE 300000 END AS q3,
+              min(CASE WHEN q1_valido THEN q1_ms ELSE 300000 END, CASE WHEN q2_valido THEN q2_ms ELSE 300000 END,
+                  CASE WHEN q3_valido THEN q3_ms ELSE 300000 END) AS mejor_q
+    FROM fusiones
+) h
+LEFT JOIN vueltas v ON v.statusId = h.statusId
+LEFT JOIN perdidas p ON p.circuitId = h.circuitId
+LEFT JOIN debuts db ON db.driverId = h.driverId
+LEFT JOIN victorias_driverId vp ON vp.driverId = h.driverId AND vp.raceId = h.raceId
+LEFT JOIN victorias_constructorId vc ON vc.constructorId = h.constructorId AND vc.raceId = h.raceId
+WINDOW pilotos AS (PARTITION BY h.driverId ORDER BY h.seq),
+       constructores AS (PARTITION BY h.constructorId ORDER BY h.seq)
+"""
+
+# Compañero: el primer piloto del equipo en la carrera, o el primero distinto de él (calcular_posicion_companero)
+SQL_COMPANEROS = """
+CREATE TEMP TABLE companeros AS
+WITH primeros AS (
+    SELECT seq, raceId, constructorId, driverId, posicion_anterior,
+           FIRST_VALUE(driverId) OVER equipo AS piloto_1, FIRST_VALUE(posicion_anterior) OVER equipo AS valor_1
+    FROM historico
+    WINDOW equipo AS (PARTITION BY raceId, constructorId ORDER BY seq)
+), segundos AS (
+    SELECT raceId, constructorId, posicion_anterior AS valor_2 FROM (
+        SELECT raceId, constructorId, posicion_anterior,
+               ROW_NUMBER() OVER (PARTITION BY raceId, constructorId ORDER BY seq) AS n
+        FROM primeros WHERE driverId <> piloto_1
+    ) WHERE n = 1
+)
+SELECT p.seq, COALESCE(CASE WHEN p.driverId = p.piloto_1 THEN s.valor_2 ELSE p.valor_1 END, 21) AS companero
+FROM primeros p LEFT JOIN segundos s ON s.raceId = p.raceId AND s.constructorId = p.constructorId
+"""
+
+# --- 5. Filtrado final: columnas del dataset ---
+
+EXPRESIONES_DATASET = {
+    'RACEID': 'h.raceId',
+    'DRIVERID': 'h.driverId',
+    'CONSTRUCTORID': 'h.constructorId',
+    'CIRCUITID': 'h.circuitId',
+    'ROUND': 'h.round',
+    'YEAR': f'h.year - {YEAR_REFERENCIA}',
+    'LAP DISTANCE KM': 'h.lap_distance_km',
+    'LAPS RACE': 'h.laps',
+    'URBAN': 'h.urban',
+    'DRIVER LAST POSITION': 'h.posicion_anterior',
+    'WINS SEASON': 'h.victorias_temporada',
+    'WINS CAREER': 'h.victorias_carrera',
+    'POINTS BEFORE GP': 'h.puntos_anteriores',
+    'YEARS OF EXPERIENCE': 'h.experiencia',
+    'AGE': 'h.edad',
+    'MATE LAST POSITION': 'm.companero',
+    'CONSTRUCTOR POINTS BEFORE GP': 'h.puntos_constructor_anteriores',
+    'CONSTRUCTOR WINS SEASON': 'h.victorias_constructor',
+    'Q1': 'h.q1',
+    'Q2': 'h.q2',
+    'Q3': 'h.q3',
+    'BEST Q': 'h.mejor_q',
+    # GRID = 0: el piloto sale desde el fondo
+    'GRID': 'CASE WHEN h.grid = 0 THEN 20 ELSE h.grid END',
+    'Q1 VALID': 'h.q1_valido',
+    'Q2 VALID': 'h.q2_valido',
+    'Q3 VALID': 'h.q3_valido',
+    'RACE VALID': 'h.ms_race <> 10000000',
+    'SPRINT Y/N': 'h.sprint',
+    'MS RACE': 'h.ms_race',
+}
+
+SQL_DATASET = """
+SELECT {columnas}
+FROM historico h
+JOIN companeros m ON m.seq = h.seq
+LEFT JOIN clima cl ON cl.raceId = h.raceId
+{ventanas}
+WHERE h.year >= :min_year
+ORDER BY h.seq
+"""
+
+# Última fila de cada piloto, constructor y circuito (ultimas_filas): con max(seq),
+# SQLite toma el resto de columnas de esa misma fila
+SQL_ULTIMAS = """
+SELECT {columnas} FROM (SELECT *, max(seq) AS ultima FROM historico {filtro} GROUP BY {clave}) ORDER BY ultima
+"""
+
+
+def consulta(conexion, sql, parametros=None):
+    """Resultado de una consulta como DataFrame."""
+    return pd.read_sql_query(sql, conexion, params=parametros)
+
+
+def calcular_bloque_sql(min_year=2014, process_from_year=2001, max_vueltas_perdidas=4, perdida_por_circuito=None,
+                        clima_ventanas=False, perfil=None, sql_file=SQL_FILE):
+    """
+    Calcula las filas del dataset completo con consultas SQL (SQLite) sobre
+    una base de datos con las tablas de f1_data, en lugar de con pandas.
+
+    Las fusiones son joins y las features históricas, funciones de ventana
+    (LAG por piloto y constructor, sumas acumuladas de victorias por temporada
+    y en total, FIRST_VALUE por equipo para el compañero) sobre las filas en
+    el mismo orden que calcular_bloque, así que el resultado es el mismo. El
+    clima sale de clima.py (como en calcular_bloque) y se une como tabla temporal.
+
+    Parámetros:
+        min_year, process_from_year, max_vueltas_perdidas, perdida_por_circuito,
+        clima_ventanas: Ver script_carga.generar_dataset_f1_completo.
+        perfil (RegistroEtapas): Opcional, registro de las etapas.
+        sql_file (str): Base de datos; se crea o se pone al día con cargar_base.
+
+    Devuelve:
+        dict: Lo mismo que script_carga.calcular_bloque para una reconstrucción
+            completa (filas, últimas filas, victorias y first_race); None si no
+            hay carreras con resultados.
+    """
+    if perfil is None:
+        perfil = RegistroEtapas()
+    parametros = {'desde': process_from_year, 'min_year': min_year, 'max_vueltas': max_vueltas_perdidas,
+                  'perdida': 7000.0}
+
+    with contextlib.closing(sqlite3.connect(sql_file)) as conexion:
+        conexion.execute('PRAGMA temp_store = MEMORY')
+
+        with perfil.etapa('ingesta') as etapa:
+            etapa['filas'] = len(cargar_base(conexion))
+
+        with perfil.etapa('consultas') as etapa:
+            tabla_temporal(conexion, 'perdidas', pd.DataFrame(list((perdida_por_circuito or {}).items()),
+                                                              columns=['circuitId', 'perdida']), 'circuitId')
+            q = {}
+            for col in ('q1', 'q2', 'q3'):
+                q[f'{col}_ms'], q[f'{col}_valido'] = sql_tiempo_clasificacion(f'q.{col}')
+            for sql in (SQL_CARRERAS, SQL_FILAS, SQL_GANADORES, SQL_VUELTAS, SQL_DEBUTS, SQL_GANADAS,
+                        SQL_VICTORIAS.format(clave='driverId'), SQL_VICTORIAS.format(clave='constructorId'),
+                        SQL_FUSIONES.format(**q), SQL_HISTORICO, SQL_COMPANEROS):
+                conexion.execute(sql, parametros)
+            etapa['filas'] = conexion.execute('SELECT COUNT(*) FROM historico').fetchone()[0]
+        if etapa['filas'] == 0:
+            return None
+
+        with perfil.etapa('clima') as etapa:
+            # Meteorología de las carreras del bloque, con las mismas funciones que calcular_bloque
+            race_ids = set(consulta(conexion, 'SELECT raceId FROM carreras')['raceId'])
+            weather_df = leer_clima_carreras(race_ids)
+            tabla_temporal(conexion, 'clima', weather_df, 'raceId')
+            if clima_ventanas:
+                tabla_temporal(conexion, 'ventanas', clima_ventanas_carreras(race_ids), 'raceId')
+            etapa['filas'] = len(weather_df)
+
+        with perfil.etapa('filtrado') as etapa:
+            expresiones = {**EXPRESIONES_DATASET, **{col: f'cl."{col}"' for col in weather_df.columns if col != 'raceId'}}
+            if clima_ventanas:
+                expresiones.update({col: f'v."{col}"' for col in COLUMNAS_VENTANAS})
+            columnas = COLUMNAS_FEATURES + (COLUMNAS_VENTANAS if clima_ventanas else []) + ['MS RACE']
+            final_df = consulta(conexion, SQL_DATASET.format(
+                columnas=', '.join(f'{expresiones[col]} AS "{col}"' for col in columnas),
+                ventanas='LEFT JOIN ventanas v ON v.raceId = cl.raceId' if clima_ventanas else ''), parametros)
+
+            ultimas_pilotos = consulta(conexion, SQL_ULTIMAS.format(
+                columnas='driverId AS DRIVERID, raceId AS RACEID, year AS YEAR, position AS "LAST POSITION", '
+                         'puntos AS "POINTS STANDINGS"', clave='driverId', filtro=''))
+            ultimas_constructores = consulta(conexion, SQL_ULTIMAS.format(
+                columnas='constructorId AS CONSTRUCTORID, raceId AS RACEID, year AS YEAR, '
+                         'puntos_constructor AS "CONSTRUCTOR POINTS"', clave='constructorId', filtro=''))
+            ultimas_circuitos = consulta(conexion, SQL_ULTIMAS.format(
+                columnas='circuitId AS CIRCUITID, raceId AS RACEID, laps AS "LAPS RACE"', clave='circuitId',
+                filtro='WHERE laps IS NOT NULL'))
+            wins_by_race = consulta(conexion, 'SELECT raceId, driverId AS DRIVERID, year AS YEAR FROM ganadas')
+            constructor_wins = consulta(conexion, 'SELECT raceId, constructorId AS CONSTRUCTORID, year AS YEAR FROM ganadas')
+            first_race = consulta(conexion, 'SELECT driverId, debut AS DEBUT_YEAR FROM debuts')
+            # Como el merge de script_carga.primeras_carreras: entero, o decimal si hay debuts anteriores a :desde
+            first_race['DEBUT_YEAR'] = first_race['DEBUT_YEAR'].astype(
+                float if first_race['DEBUT_YEAR'].isna().any() else int)
+            etapa['filas'] = len(final_df)
+
+    return {
+        'filas': final_df,
+        'ultimas_pilotos': ultimas_pilotos.astype({'LAST POSITION': float, 'POINTS STANDINGS': float}),
+        'ultimas_constructores': ultimas_constructores.astype({'CONSTRUCTOR POINTS': float}),
+        'ultimas_circuitos': ultimas_circuitos.set_index('CIRCUITID'),
+        'wins_by_race': wins_by_race,
+        'constructor_wins': constructor_wins,
+        'first_race': first_race,
+    }
@@ -0,0 +1,122 @@
+import pandas as pd
+
+from datos import leer_tabla
+from features import agregados_previos, anadir_columnas, indexar
+
+# Features de paradas en boxes (pit_stops.csv, desde 2011). Todas se calculan con
+# las carreras anteriores a la de cada fila: las paradas de la propia carrera son
+# un resultado y no se conocen antes de la salida
+COLUMNAS_PARADAS = ['CONSTRUCTOR PIT DELTA MS', 'DRIVER PIT STOPS', 'CIRCUIT PIT MS', 'CIRCUIT PIT STOPS']
+
+# Carreras previas que se promedian para pilotos y constructores (para el circuito, su edición anterior)
+VENTANA_PARADAS = 5
+
+# Definición de cada columna para agregados_previos: (claves, valor, ventana, estadístico).
+# CONSTRUCTOR PIT DELTA MS usa los agregados por constructor, DRIVER PIT STOPS los
+# de piloto y las de circuito los de cada carrera (ver agregados_paradas)
+DEFINICIONES_PARADAS = {
+    'CONSTRUCTOR PIT DELTA MS': (['CONSTRUCTORID'], 'DIFERENCIA', VENTANA_PARADAS, 'mean'),
+    'DRIVER PIT STOPS': (['DRIVERID'], 'PARADAS', VENTANA_PARADAS, 'mean'),
+    'CIRCUIT PIT MS': (['CIRCUITID'], 'MEDIANA', 1, 'last'),
+    'CIRCUIT PIT STOPS': (['CIRCUITID'], 'PARADAS', 1, 'last'),
+}
+
+# Paradas más largas que no son de boxes (reparaciones, banderas rojas): no cuentan (~4%)
+MAX_MS_PARADA = 60000
+
+# Valores sin historial: el constructor no se separa de la mediana, y la mediana por
+# carrera de paradas por piloto y de tiempo en boxes (2011-2024)
+DEFECTO_PARADAS = {
+    'CONSTRUCTOR PIT DELTA MS': 0.0,
+    'DRIVER PIT STOPS': 2.0,
+    'CIRCUIT PIT MS': 23400.0,
+    'CIRCUIT PIT STOPS': 2.0,
+}
+
+
+def leer_paradas(hasta_race_id=None):
+    """
+    Lee pit_stops.csv con el constructor (de results) y el circuito (de races) de cada parada.
+
+    Parámetros:
+        hasta_race_id (int): Opcional, solo paradas de carreras con raceId anterior.
+
+    Devuelve:
+        DataFrame: raceId, driverId, constructorId, circuitId y milliseconds, en el orden del CSV.
+    """
+    paradas_df = leer_tabla('pit_stops', ['raceId', 'driverId', 'milliseconds'])
+    if hasta_race_id is not None:
+        paradas_df = paradas_df[paradas_df['raceId'] < hasta_race_id]
+    race_ids = paradas_df['raceId'].unique()
+    claves = ['raceId', 'driverId']
+    paradas_df = anadir_columnas(paradas_df, [
+        (indexar(leer_tabla('results', claves + ['constructorId'], race_ids=race_ids), claves), claves),
+        (indexar(leer_tabla('races', ['raceId', 'circuitId'], race_ids=race_ids), ['raceId']), ['raceId']),
+    ])
+    # Paradas sin resultado del piloto en la carrera: no se sabe su constructor
+    return paradas_df.dropna(subset=['constructorId']).astype({'constructorId': int})
+
+
+def agregados_paradas(paradas_df):
+    """
+    Agregados de cada carrera en una pasada agrupada por carrera:
+
+    - por piloto, número de paradas (PARADAS);
+    - por constructor, mediana del tiempo en boxes menos la de toda la carrera
+      (DIFERENCIA: la velocidad del equipo, sin la longitud del pit lane de cada circuito);
+    - por carrera, mediana del tiempo en boxes (MEDIANA) y paradas medias por piloto que paró (PARADAS).
+
+    No cuentan las paradas de más de MAX_MS_PARADA.
+
+    Parámetros:
+        paradas_df (DataFrame): Ver leer_paradas.
+
+    Devuelve:
+        tuple: (pilotos, constructores, carreras), DataFrames con RACEID, la clave
+            (DRIVERID, CONSTRUCTORID o CIRCUITID) y el valor agregado.
+    """
+    paradas_df = paradas_df[paradas_df['milliseconds'] <= MAX_MS_PARADA]
+    ms = paradas_df['milliseconds'].to_numpy(dtype=float)
+    carreras = paradas_df.groupby('raceId', sort=False)
+    mediana = carreras['milliseconds'].transform('median').to_numpy()
+
+    pilotos = paradas_df.groupby(['raceId', 'driverId'], sort=False).size().rename('PARADAS').reset_index()
+    constructores = (paradas_df[['raceId', 'constructorId']]
+                     .assign(DIFERENCIA=ms - mediana)
+                     .groupby(['raceId', 'constructorId'], sort=False)['DIFERENCIA'].median().reset_index())
+    resumen = pd.DataFrame({
+        'circuitId': carreras['circuitId'].first(),
+        'MEDIANA': carreras['milliseconds'].median(),
+        'PARADAS': pilotos.groupby('raceId', sort=False)['PARADAS'].mean(),
+    }).reset_index()
+    columnas = {'raceId': 'RACEID', 'driverId': 'DRIVERID', 'constructorId': 'CONSTRUCTORID', 'circuitId': 'CIRCUITID'}
+    return pilotos.rename(columns=columnas), constructores.rename(columns=columnas), resumen.rename(columns=columnas)
+
+
+def calcular_features_paradas(filas_df, paradas_df):
+    """
+    Calcula COLUMNAS_PARADAS de cada fila con las paradas de las carreras
+    anteriores (raceId menor, el orden de las demás features históricas):
+
+    - CONSTRUCTOR PIT DELTA MS: media de la diferencia del constructor con la
+      mediana de la carrera en sus últimas VENTANA_PARADAS carreras (negativa: más rápido).
+    - DRIVER PIT STOPS: media de paradas del piloto en sus últimas VENTANA_PARADAS carreras con paradas.
+    - CIRCUIT PIT MS y CIRCUIT PIT STOPS: mediana del tiempo en boxes y paradas
+      por piloto en la edición anterior del circuito.
+
+    Sin historial se usa DEFECTO_PARADAS.
+
+    Parámetros:
+        filas_df (DataFrame): Filas con RACEID, DRIVERID, CONSTRUCTORID y CIRCUITID.
+        paradas_df (DataFrame): Ver leer_paradas (puede incluir carreras posteriores: no se usan).
+
+    Devuelve:
+        DataFrame: COLUMNAS_PARADAS, con el índice de filas_df.
+    """
+    pilotos, constructores, carreras = agregados_paradas(paradas_df)
+    features = pd.concat([
+        agregados_previos(historico_df, filas_df, {col: DEFINICIONES_PARADAS[col] for col in columnas})
+        for historico_df, columnas in ((constructores, ['CONSTRUCTOR PIT DELTA MS']), (pilotos, ['DRIVER PIT STOPS']),
+                                       (carreras, ['CIRCUIT PIT MS', 'CIRCUIT PIT STOPS']))
+    ], axis=1)
+    return features[COLUMNAS_PARADAS].fillna(DEFECTO_PARADAS)
@@ -0,0 +1,118 @@
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+PERFIL_FILE = 'f1_perfil_carga.json'
+
+# Intervalo de muestreo de la memoria residente durante cada etapa
+INTERVALO_RSS = 0.005
+
+
+def rss_actual_mb():
+    """Memoria residente actual del proceso en MB (Linux; en otros sistemas, el pico del proceso)."""
+    try:
+        with open('/proc/self/statm') as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return rss_pico_proceso_mb()
+
+
+def rss_pico_proceso_mb():
+    """Pico de memoria residente del proceso desde su inicio, en MB."""
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 2 ** 20 if sys.platform == 'darwin' else pico / 2 ** 10
+
+
+class RegistroEtapas:
+    """
+    Registro de tiempo, memoria y filas por etapa de un proceso.
+
+    Cada etapa se mide con etapa(nombre): tiempo de reloj, pico de memoria
+    residente (muestreado en un hilo mientras dura la etapa) y las filas que
+    la propia etapa anota. Con cprofile=True se guarda además un perfil de
+    cProfile por etapa (<prefijo>.<etapa>.prof, para pstats o snakeviz).
+
+    Parámetros:
+        cprofile (bool): Perfilar cada etapa con cProfile.
+        prefijo_cprofile (str): Prefijo de los archivos .prof.
+    """
+
+    def __init__(self, cprofile=False, prefijo_cprofile='f1_perfil_carga'):
+        self.cprofile = cprofile
+        self.prefijo_cprofile = prefijo_cprofile
+        self.etapas = []
+        self.inicio = time.perf_counter()
+
+    @contextlib.contextmanager
+    def etapa(self, nombre):
+        """
+        Mide el bloque como la etapa `nombre`.
+
+        Devuelve (en el with):
+            dict: Registro de la etapa; el bloque puede anotar 'filas'.
+        """
+        registro = {'nombre': nombre, 'filas': None}
+        pico = [rss_actual_mb()]
+        fin_muestreo = threading.Event()
+
+        def muestrear():
+            while not fin_muestreo.wait(INTERVALO_RSS):
+                pico[0] = max(pico[0], rss_actual_mb())
+
+        hilo = threading.Thread(target=muestrear, daemon=True)
+        hilo.start()
+        perfil = cProfile.Profile() if self.cprofile else None
+        inicio = time.perf_counter()
+        if perfil:
+            perfil.enable()
+        try:
+            yield registro
+        finally:
+            if perfil:
+                perfil.disable()
+            registro['segundos'] = round(time.perf_counter() - inicio, 4)
+            fin_muestreo.set()
+            hilo.join()
+            registro['rss_fin_mb'] = round(rss_actual_mb(), 1)
+            registro['rss_pico_mb'] = round(max(pico[0], registro['rss_fin_mb']), 1)
+            if perfil:
+                registro['cprofile'] = f'{self.prefijo_cprofile}.{nombre}.prof'
+                perfil.dump_stats(registro['cprofile'])
+            self.etapas.append(registro)
+
+    def resumen(self, **metadatos):
+        """
+        Resumen de todas las etapas medidas.
+
+        Parámetros:
+            **metadatos: Datos adicionales (parámetros de la ejecución...).
+
+        Devuelve:
+            dict: metadatos, total (segundos, pico de RSS del proceso) y la lista de etapas en orden.
+        """
+        return {
+            **metadatos,
+            'total': {
+                'segundos': round(time.perf_counter() - self.inicio, 4),
+                'rss_pico_proceso_mb': round(rss_pico_proceso_mb(), 1),
+            },
+            'etapas': self.etapas,
+        }
+
+    def guardar(self, ruta=PERFIL_FILE, **metadatos):
+        """Escribe resumen(**metadatos) como JSON en ruta."""
+        with open(ruta, 'w') as archivo:
+            json.dump(self.resumen(**metadatos), archivo, indent=2, ensure_ascii=False)
+
+    def tabla(self):
+        """Texto con una línea por etapa, para mostrar por pantalla."""
+        lineas = [f"{'Etapa':24s} {'Tiempo (s)':>10s} {'RSS pico (MB)':>14s} {'Filas':>8s}"]
+        for registro in self.etapas:
+            filas = '' if registro['filas'] is None else str(registro['filas'])
+            lineas.append(f"{registro['nombre']:24s} {registro['segundos']:10.3f} {registro['rss_pico_mb']:14.1f} {filas:>8s}")
+        return '\n'.join(lineas)
@@ -0,0 +1,142 @@
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from modelo import MODEL_FILE
+from servicio import ServicioPrediccion, crear_servidor
+
+
+def pedir(url, ruta, cuerpo=None):
+    """Petición JSON al servicio (POST si hay cuerpo); devuelve la respuesta decodificada."""
+    datos = None if cuerpo is None else json.dumps(cuerpo).encode()
+    peticion = urllib.request.Request(url + ruta, data=datos, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(peticion, timeout=60) as respuesta:
+        return json.loads(respuesta.read())
+
+
+def cuerpos_filas(servicio, race_id, filas_peticion):
+    """Peticiones de filas de features: la parrilla de race_id en grupos de filas_peticion filas."""
+    filas = servicio.filas_carrera(race_id)
+    registros = json.loads(filas.to_json(orient='records'))
+    return [{'filas': registros[i:i + filas_peticion]} for i in range(0, len(registros), filas_peticion)]
+
+
+def prueba_carga(url, cuerpos, clientes=16, peticiones=50):
+    """
+    Lanza clientes hilos que envían peticiones peticiones cada uno a /predecir,
+    rotando entre cuerpos, y mide la latencia vista por el cliente.
+
+    Devuelve:
+        dict: peticiones, errores, segundos, peticiones_por_segundo y latencia_ms (media, p50, p95, p99, max).
+    """
+    def cliente(indice):
+        latencias, errores = [], 0
+        for i in range(peticiones):
+            inicio = time.perf_counter()
+            try:
+                pedir(url, '/predecir', cuerpos[(indice + i) % len(cuerpos)])
+                latencias.append(time.perf_counter() - inicio)
+            except OSError:
+                errores += 1
+        return latencias, errores
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(clientes) as pool:
+        resultados = list(pool.map(cliente, range(clientes)))
+    segundos = time.perf_counter() - inicio
+    latencias = np.concatenate([r[0] for r in resultados]) * 1000
+    p50, p95, p99 = np.percentile(latencias, [50, 95, 99])
+    return {
+        'peticiones': clientes * peticiones,
+        'errores': sum(r[1] for r in resultados),
+        'segundos': round(segundos, 3),
+        'peticiones_por_segundo': round(clientes * peticiones / segundos, 2),
+        'latencia_ms': {'media': round(latencias.mean(), 3), 'p50': round(p50, 3), 'p95': round(p95, 3),
+                        'p99': round(p99, 3), 'max': round(latencias.max(), 3)},
+    }
+
+
+def servicio_local(model_file=MODEL_FILE, **kwargs):
+    """
+    Arranca ServicioPrediccion en un puerto libre de 127.0.0.1, en un hilo.
+
+    Devuelve:
+        tuple: (url, servicio, servidor); al terminar, servidor.shutdown() y servicio.cerrar().
+    """
+    servicio = ServicioPrediccion(model_file, descargar_clima=False, **kwargs)
+    servidor = crear_servidor(servicio, puerto=0)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{servidor.server_address[1]}', servicio, servidor
+
+
+def comparar_lotes(race_id=None, clientes=16, peticiones=50, filas_peticion=1, por_carrera=False,
+                   model_file=MODEL_FILE):
+    """
+    Prueba de carga contra dos servicios locales, con micro-lotes y con
+    max_filas_lote=1 (un predict por petición), con las mismas peticiones
+    (filas de features de race_id, o la carrera por su raceId con por_carrera).
+
+    Devuelve:
+        dict: {'lotes': ..., 'sin_lotes': ...} con el resultado de prueba_carga y las /metricas del servicio.
+    """
+    resultados = {}
+    for nombre, opciones in (('sin_lotes', {'max_filas_lote': 1}), ('lotes', {})):
+        url, servicio, servidor = servicio_local(model_file, **opciones)
+        try:
+            carrera = race_id if race_id is not None else servicio.ultima_carrera() + 1
+            cuerpos = [{'race_id': carrera}] if por_carrera else cuerpos_filas(servicio, carrera, filas_peticion)
+            pedir(url, '/predecir', cuerpos[0])  # calentamiento
+            resultados[nombre] = prueba_carga(url, cuerpos, clientes, peticiones)
+            resultados[nombre]['servicio'] = pedir(url, '/metricas')
+        finally:
+            servidor.shutdown()
+            servidor.server_close()
+            servicio.cerrar()
+    return resultados
+
+
+def imprimir(nombre, resultado):
+    latencia = resultado['latencia_ms']
+    linea = (f"  {nombre:<10} {resultado['peticiones_por_segundo']:8.1f} pet/s   p50 {latencia['p50']:7.2f} ms   "
+             f"p95 {latencia['p95']:7.2f} ms   p99 {latencia['p99']:7.2f} ms   errores {resultado['errores']}")
+    lotes = resultado.get('servicio', {}).get('lotes')
+    if lotes:
+        linea += f"   ({lotes['peticiones_media']:.1f} peticiones por predict)"
+    print(linea)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del servicio de predicción (solo en localhost).")
+    parser.add_argument('--url', default=None,
+                        help="Servicio ya arrancado (p. ej. http://127.0.0.1:8765); por defecto se arrancan dos "
+                             "locales, con y sin micro-lotes, y se comparan.")
+    parser.add_argument('--race-id', type=int, default=None,
+                        help="Carrera cuyas filas se envían (por defecto, la siguiente al estado).")
+    parser.add_argument('--clientes', type=int, default=16, help="Clientes concurrentes.")
+    parser.add_argument('--peticiones', type=int, default=50, help="Peticiones por cliente.")
+    parser.add_argument('--filas', type=int, default=1, help="Filas de features por petición.")
+    parser.add_argument('--por-carrera', action='store_true', help="Pedir por raceId en lugar de enviar filas.")
+    parser.add_argument('--modelo', default=MODEL_FILE, help="Modelo de los servicios locales.")
+    args = parser.parse_args()
+
+    print(f"Prueba de carga: {args.clientes} clientes x {args.peticiones} peticiones")
+    if args.url:
+        race_id = args.race_id or pedir(args.url, '/salud')['ultima_carrera'] + 1
+        if args.por_carrera:
+            cuerpos = [{'race_id': race_id}]
+        else:
+            # Las filas se construyen con el modelo y el estado locales (el servicio está en la misma máquina)
+            local = ServicioPrediccion(args.modelo, descargar_clima=False)
+            cuerpos = cuerpos_filas(local, race_id, args.filas)
+            local.cerrar()
+        imprimir('servicio', prueba_carga(args.url, cuerpos, args.clientes, args.peticiones))
+        print(json.dumps(pedir(args.url, '/metricas'), indent=2))
+    else:
+        for nombre, resultado in comparar_lotes(args.race_id, args.clientes, args.peticiones, args.filas,
+                                                args.por_carrera, args.modelo).items():
+            imprimir(nombre, resultado)
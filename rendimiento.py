@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from clima import ALMACEN_FILE, CLIMA_FILE, clima_ventanas_carreras, leer_clima_carreras
+from datos import CACHE_DIR, DATA_DIR, guardar_dataset, leer_dataset, leer_tabla
+from entry import construir_filas_carreras
+from features import cargar_estado
+from modelo import DATASET_FILE, entrenar_modelo
+from perfil import RegistroEtapas
+from script_carga import generar_dataset_f1_completo
+from simulacion import predecir_carreras
+
+RESULTADOS_FILE = 'f1_rendimiento.json'
+REFERENCIA_FILE = 'f1_rendimiento_referencia.json'
+
+# Tablas por carrera que se replican en los datos sintéticos, con su id de fila (si tienen)
+TABLAS_SINTETICAS = {
+    'races': None,
+    'results': 'resultId',
+    'sprint_results': 'resultId',
+    'qualifying': 'qualifyId',
+    'driver_standings': 'driverStandingsId',
+    'constructor_standings': 'constructorStandingsId',
+    'constructor_results': 'constructorResultsId',
+    'pit_stops': None,
+}
+
+# Casos medidos en cada escenario, en orden
+CASOS = ['carga', 'dataset', 'carrera', 'clima', 'ajuste', 'prediccion_carreras', 'prediccion_modelo']
+
+# Diferencia relativa a partir de la cual un caso se marca como regresión, y
+# tiempo mínimo de la referencia para comparar tiempos (por debajo domina el ruido)
+UMBRAL_REGRESION = 0.25
+SEGUNDOS_MINIMOS = 0.05
+
+
+def replicar_tabla(df, factor, id_fila=None):
+    """
+    Replica cada carrera de una tabla factor veces: la copia j de la carrera r
+    pasa a tener raceId r * factor + j, así que se conserva el orden del
+    calendario y las copias quedan seguidas (misma fecha, circuito y pilotos).
+
+    Parámetros:
+        df (DataFrame): Tabla de f1_data leída como texto.
+        factor (int): Copias de cada carrera.
+        id_fila (str): Opcional, columna de id de fila que se renumera.
+
+    Devuelve:
+        DataFrame: La tabla con factor veces más filas, ordenada por raceId.
+    """
+    race_ids = df['raceId'].astype(int)
+    copias = pd.concat([df.assign(raceId=(race_ids * factor + j).astype(str)) for j in range(factor)])
+    copias = copias.iloc[np.argsort(copias['raceId'].astype(int).to_numpy(), kind='stable')]
+    if id_fila:
+        copias[id_fila] = np.arange(1, len(copias) + 1).astype(str)
+    return copias
+
+
+def preparar_datos(destino, factor=1):
+    """
+    Copia f1_data y los datos meteorológicos a destino; con factor > 1 replica
+    cada carrera factor veces (replicar_tabla), de modo que results.csv y el
+    resto de tablas por carrera tienen factor veces más filas.
+
+    Devuelve:
+        int: Filas de results.csv en destino.
+    """
+    os.makedirs(os.path.join(destino, DATA_DIR), exist_ok=True)
+    for archivo in (CLIMA_FILE, ALMACEN_FILE):
+        if os.path.exists(archivo):
+            shutil.copy(archivo, destino)
+    for archivo in os.listdir(DATA_DIR):
+        origen = os.path.join(DATA_DIR, archivo)
+        nombre = os.path.splitext(archivo)[0]
+        if factor > 1 and nombre in TABLAS_SINTETICAS:
+            tabla = pd.read_csv(origen, dtype=str, keep_default_na=False)
+            replicar_tabla(tabla, factor, TABLAS_SINTETICAS[nombre]).to_csv(
+                os.path.join(destino, DATA_DIR, archivo), index=False)
+        elif nombre != 'lap_times':
+            shutil.copy(origen, os.path.join(destino, DATA_DIR))
+    if factor > 1:
+        clima = pd.read_csv(CLIMA_FILE, dtype=str, keep_default_na=False)
+        replicar_tabla(clima, factor).to_csv(os.path.join(destino, CLIMA_FILE), index=False)
+    with open(os.path.join(destino, DATA_DIR, 'results.csv')) as archivo:
+        return sum(1 for _ in archivo) - 1
+
+
+def medir_escenario(directorio):
+    """
+    Ejecuta los casos de CASOS con directorio como carpeta de trabajo.
+
+    - carga: lectura en frío de las tablas de f1_data (incluye crear la caché).
+    - dataset: generar_dataset_f1_completo.
+    - carrera: filas y CSV de la última carrera con qualifying (como entry.py, sin descargar clima).
+    - clima: agregados diarios y de ventanas de todas las carreras desde 2014.
+    - ajuste: entrenar_modelo con el dataset generado.
+    - prediccion_carreras: predecir_carreras de las carreras con qualifying posteriores al dataset.
+    - prediccion_modelo: predict del modelo sobre todo el dataset.
+
+    Devuelve:
+        dict: {caso: {segundos, rss_pico_mb, filas, filas_por_segundo}}.
+    """
+    import sklearn.ensemble  # noqa: F401 (la importación no cuenta en el ajuste)
+
+    actual = os.getcwd()
+    os.chdir(directorio)
+    perfil = RegistroEtapas()
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            shutil.rmtree(CACHE_DIR, ignore_errors=True)
+            with perfil.etapa('carga') as etapa:
+                tablas = ['races', 'results', 'sprint_results', 'qualifying', 'drivers', 'circuits',
+                          'driver_standings', 'constructor_standings', 'status']
+                etapa['filas'] = sum(len(leer_tabla(tabla)) for tabla in tablas)
+
+            with perfil.etapa('dataset') as etapa:
+                generar_dataset_f1_completo()
+                etapa['filas'] = len(leer_dataset(DATASET_FILE))
+
+            ultima = leer_dataset(DATASET_FILE)['RACEID'].max()
+            clasificadas = leer_tabla('qualifying', ['raceId'])['raceId']
+            pendientes = sorted(set(clasificadas[clasificadas > ultima]))
+            with perfil.etapa('carrera') as etapa:
+                filas = construir_filas_carreras(pendientes[-1:], *cargar_estado(), descargar_clima=False)
+                guardar_dataset(filas, f'f1_race_{pendientes[-1]}_data.csv')
+                etapa['filas'] = len(filas)
+
+            with perfil.etapa('clima') as etapa:
+                race_ids = leer_tabla('races', ['raceId'], desde_year=2014)['raceId']
+                clima = leer_clima_carreras(race_ids).merge(clima_ventanas_carreras(race_ids), on='raceId')
+                etapa['filas'] = len(clima)
+
+            with perfil.etapa('ajuste') as etapa:
+                artefacto = entrenar_modelo(DATASET_FILE, 'f1_modelo.joblib')
+                etapa['filas'] = artefacto['datos']['filas']
+
+            with perfil.etapa('prediccion_carreras') as etapa:
+                etapa['filas'] = len(predecir_carreras(pendientes, artefacto, descargar_clima=False))
+
+            dataset = leer_dataset(DATASET_FILE)
+            with perfil.etapa('prediccion_modelo') as etapa:
+                artefacto['pipeline'].predict(dataset[artefacto['columnas']])
+                etapa['filas'] = len(dataset)
+    finally:
+        os.chdir(actual)
+
+    resultados = {}
+    for registro in perfil.etapas:
+        resultados[registro['nombre']] = {
+            'segundos': registro['segundos'],
+            'rss_pico_mb': registro['rss_pico_mb'],
+            'filas': registro['filas'],
+            'filas_por_segundo': round(registro['filas'] / max(registro['segundos'], 1e-9), 1),
+        }
+    return resultados
+
+
+def ejecutar_suite(factores=(1, 10)):
+    """
+    Mide todos los casos con los datos reales (factor 1) y con datos
+    sintéticos factor veces más grandes.
+
+    Devuelve:
+        dict: entorno (versiones, CPU) y escenarios {'x<factor>': {'filas_results', 'casos'}}.
+    """
+    import sklearn
+
+    escenarios = {}
+    for factor in factores:
+        with tempfile.TemporaryDirectory() as tmp:
+            filas = preparar_datos(tmp, factor)
+            escenarios[f'x{factor}'] = {'filas_results': filas, 'casos': medir_escenario(tmp)}
+    return {
+        'entorno': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'cpus': os.cpu_count(),
+            'plataforma': platform.platform(),
+        },
+        'escenarios': escenarios,
+    }
+
+
+def comparar_con_referencia(resultados, referencia, umbral=UMBRAL_REGRESION, segundos_minimos=SEGUNDOS_MINIMOS):
+    """
+    Compara tiempo y pico de memoria de cada caso con una ejecución de referencia.
+
+    Parámetros:
+        resultados, referencia (dict): Salidas de ejecutar_suite.
+        umbral (float): Aumento relativo a partir del cual hay regresión (0.25 = +25%).
+        segundos_minimos (float): No se comparan tiempos de referencia menores.
+
+    Devuelve:
+        list: Un dict por regresión (escenario, caso, métrica, referencia, actual, cambio).
+    """
+    regresiones = []
+    for escenario, datos in resultados['escenarios'].items():
+        casos_referencia = referencia['escenarios'].get(escenario, {}).get('casos', {})
+        for caso, medidas in datos['casos'].items():
+            base = casos_referencia.get(caso)
+            if base is None:
+                continue
+            for metrica in ('segundos', 'rss_pico_mb'):
+                if metrica == 'segundos' and base[metrica] < segundos_minimos:
+                    continue
+                cambio = medidas[metrica] / base[metrica] - 1
+                if cambio > umbral:
+                    regresiones.append({'escenario': escenario, 'caso': caso, 'metrica': metrica,
+                                        'referencia': base[metrica], 'actual': medidas[metrica],
+                                        'cambio': round(cambio, 3)})
+    return regresiones
+
+
+def tabla_resultados(resultados):
+    """Texto con una línea por escenario y caso."""
+    lineas = [f"{'Escenario':10s} {'Caso':20s} {'Tiempo (s)':>10s} {'RSS pico (MB)':>14s} {'Filas':>9s} {'Filas/s':>12s}"]
+    for escenario, datos in resultados['escenarios'].items():
+        for caso, medidas in datos['casos'].items():
+            lineas.append(f"{escenario:10s} {caso:20s} {medidas['segundos']:10.3f} {medidas['rss_pico_mb']:14.1f} "
+                          f"{medidas['filas']:9d} {medidas['filas_por_segundo']:12,.0f}")
+    return '\n'.join(lineas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Suite de rendimiento: carga, dataset, clima, ajuste y predicción.")
+    parser.add_argument('--factores', type=int, nargs='+', default=[1, 10],
+                        help="Tamaños a medir: 1 son los datos reales, N replica cada carrera N veces.")
+    parser.add_argument('--salida', default=RESULTADOS_FILE, help="JSON donde guardar los resultados.")
+    parser.add_argument('--referencia', default=REFERENCIA_FILE, help="JSON de referencia con el que comparar.")
+    parser.add_argument('--guardar-referencia', action='store_true',
+                        help="Guardar estos resultados como nueva referencia.")
+    parser.add_argument('--umbral', type=float, default=UMBRAL_REGRESION,
+                        help="Aumento relativo de tiempo o memoria que se marca como regresión.")
+    args = parser.parse_args()
+
+    resultados = ejecutar_suite(args.factores)
+    print(tabla_resultados(resultados))
+    with open(args.salida, 'w') as archivo:
+        json.dump(resultados, archivo, indent=2)
+    print(f"\nResultados guardados en {args.salida}")
+
+    if args.guardar_referencia:
+        shutil.copy(args.salida, args.referencia)
+        print(f"Referencia guardada en {args.referencia}")
+    elif os.path.exists(args.referencia):
+        with open(args.referencia) as archivo:
+            regresiones = comparar_con_referencia(resultados, json.load(archivo), umbral=args.umbral)
+        for regresion in regresiones:
+            print(f"✗ Regresión en {regresion['escenario']}/{regresion['caso']}: {regresion['metrica']} "
+                  f"{regresion['referencia']} -> {regresion['actual']} ({regresion['cambio']:+.0%})")
+        if regresiones:
+            sys.exit(1)
+        print(f"✓ Sin regresiones de más del {args.umbral:.0%} respecto a {args.referencia}")
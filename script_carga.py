@@ -1,44 +1,183 @@
+import argparse
+import contextlib
+import os
+
+import numpy as np
 import pandas as pd
+from joblib import Parallel, cpu_count, delayed, effective_n_jobs
+
+import clima as clima_mod
+import datos as datos_mod
+import features as features_mod
+import forma as forma_mod
+import paradas as paradas_mod
+from clima import ALMACEN_FILE, CLIMA_FILE, COLUMNAS_VENTANAS, clima_ventanas_carreras, leer_clima_carreras
+from datos import YEAR_REFERENCIA, actualizar_cache, guardar_dataset, leer_dataset, leer_tabla
+from etapas import CACHE_ETAPAS_DIR, CacheEtapas, Etapa, ejecutar_etapas
+from features import (
+    COLUMNAS_FEATURES,
+    actualizar_estado,
+    anadir_columnas,
+    calcular_posicion_companero,
+    calcular_victorias_previas,
+    calcular_vueltas_perdidas_por_estado,
+    cargar_estado,
+    codificar_claves,
+    guardar_estado,
+    imputar_tiempo_vueltas_perdidas,
+    indexar,
+    parsear_tiempos_clasificacion,
+    valor_anterior,
+)
+from forma import COLUMNAS_FORMA, calcular_features_forma, historial_resultados
+from motor_sql import SQL_FILE, calcular_bloque_sql
+from paradas import COLUMNAS_PARADAS, calcular_features_paradas, leer_paradas
+from perfil import PERFIL_FILE, RegistroEtapas
+
+# Tablas de f1_data que lee calcular_bloque (con n_jobs se preparan sus cachés antes de repartir temporadas)
+TABLAS_BLOQUE = ['races', 'results', 'sprint_results', 'qualifying', 'circuits', 'drivers',
+                 'driver_standings', 'constructor_standings', 'status', 'pit_stops']
 
-def generar_dataset_f1_completo(min_year=2014):
+# Motores de cálculo del dataset: pandas (calcular_bloque) o SQLite (motor_sql.calcular_bloque_sql)
+MOTORES_DATASET = ('pandas', 'sql')
+
+
+def filas_carreras(results_df, sprint_df, race_ids):
     """
-    Carga, fusiona, reorganiza y filtra los datos de F1 a partir de un año específico.
+    Filas del dataset: una por resultado de carrera más una por cada sprint sin
+    resultado de carrera (como un full outer join por raceId, driverId y
+    constructorId), ordenadas por esas claves. Las columnas de results_df van
+    con sus filas, así que se conservan los pilotos con dos filas en la misma
+    carrera (coches compartidos en los años 50).
 
     Parámetros:
-        min_year (int): El año mínimo (inclusive) para el filtrado de carreras.
+        results_df (DataFrame): Resultados de carrera, con columnas raceId, driverId y constructorId.
+        sprint_df (DataFrame): Resultados de sprint, con las mismas claves.
+        race_ids (set): Carreras que se incluyen.
+
+    Devuelve:
+        DataFrame: Las columnas de results_df (nulas en las filas que solo tienen sprint).
     """
-    # --- 1. Definición de Archivos y Delimitadores ---
-    RESULTS_FILE = 'f1_data/results.csv'
-    SPRINT_RESULTS_FILE = 'f1_data/sprint_results.csv'
-    QUALIFYING_FILE = 'f1_data/qualifying.csv'
-    RACES_FILE = 'f1_data/races.csv'
-
-    COMMON_DELIMITER = ','
-    # Año mínimo de datos que se cargan para todos los cálculos (reduce volumen)
-    PROCESS_FROM_YEAR = 2001
-    
-    OUTPUT_FILE = f'f1_training_data_{min_year}_onwards.csv'
-
-    # Columnas finales requeridas
-    COLUMNAS_FINALES = [
-        'RACEID', 'DRIVERID', 'CONSTRUCTORID', 'CIRCUITID', 'ROUND', 'YEAR', 'LAP DISTANCE KM', 'LAPS RACE', 'URBAN',
-        'AVG WIND SPEED', 'MAX WIND SPEED', 'AVG TEMPERATURE', 'MIN TEMPERATURE', 'MAX TEMPERATURE',
-        'AVG HUMIDITY', 'PRECIPITATION', 'AVG PRESSURE MSL', 'AVG SURFACE PRESSURE',
-        'DRIVER LAST POSITION', 'WINS SEASON', 'WINS CAREER', 'POINTS BEFORE GP', 'YEARS OF EXPERIENCE', 'AGE', 
-        'MATE LAST POSITION',
-        'CONSTRUCTOR POINTS BEFORE GP', 'CONSTRUCTOR WINS SEASON',
-        'Q1', 'Q2', 'Q3', 'BEST Q', 'GRID',
-        'Q1 VALID', 'Q2 VALID', 'Q3 VALID', 'RACE VALID',
-        'SPRINT Y/N', 'MS RACE'
-    ]
+    claves = ['raceId', 'driverId', 'constructorId']
+    filas_df = results_df[results_df['raceId'].isin(race_ids)]
+    sprints = sprint_df.loc[sprint_df['raceId'].isin(race_ids), claves]
+    solo_sprint = ~np.isin(codificar_claves([sprints[clave] for clave in claves]),
+                           codificar_claves([filas_df[clave] for clave in claves]))
+    if solo_sprint.any():
+        filas_df = pd.concat([filas_df, sprints[solo_sprint]], ignore_index=True)
+    return filas_df.sort_values(claves, kind='stable').reset_index(drop=True)
 
-    # --- 2. Cargar y Preparar DataFrames ---
 
-    print("Iniciando la carga y preparación de datos...")
+def info_carreras(races_all_df):
+    """Tabla raceId -> year con RACE_ORDER, el orden de la carrera por raceId."""
+    race_info = races_all_df[['raceId', 'year']].sort_values('raceId').reset_index(drop=True)
+    race_info['RACE_ORDER'] = range(len(race_info))
+    return race_info
+
+
+def ganadores_carreras(results_df):
+    """
+    Vueltas y tiempo del ganador de cada carrera (LAPS RACE y WINNER_TIME).
+    En algunas carreras antiguas hay dos ganadores por coche compartido; se toma el primero.
+    """
+    ganadores = results_df[results_df['position'] == 1][['raceId', 'laps', 'milliseconds']]
+    return ganadores.drop_duplicates('raceId').rename(
+        columns={'raceId': 'RACEID', 'laps': 'LAPS RACE', 'milliseconds': 'WINNER_TIME'})
+
+
+def victorias_carreras(results_df, race_info, columna, clave):
+    """Una fila por victoria de results_df con [raceId, clave, 'YEAR', 'RACE_ORDER'] (columna: driverId o constructorId)."""
+    victorias = results_df[results_df['position'] == 1][['raceId', columna]].merge(race_info, on='raceId', how='left')
+    return victorias.rename(columns={columna: clave, 'year': 'YEAR'})
+
+
+def primeras_carreras(results_df, race_info, estado_pilotos=None):
+    """
+    Año de debut de cada piloto: el de su primera fila en results_df. Con
+    estado, solo se calcula el de los pilotos que no están en él y el resto
+    conserva el año de debut del estado.
+
+    Devuelve:
+        DataFrame: Columnas ['driverId', 'DEBUT_YEAR'].
+    """
+    if estado_pilotos is not None:
+        results_df = results_df[~results_df['driverId'].isin(estado_pilotos.index)]
+    first_race = results_df[['raceId', 'driverId']].merge(race_info, on='raceId', how='left')[['driverId', 'year']]
+    first_race = first_race.drop_duplicates('driverId', keep='first').rename(columns={'year': 'DEBUT_YEAR'})
+    if estado_pilotos is not None:
+        first_race = pd.concat([estado_pilotos['DEBUT_YEAR'].rename_axis('driverId').reset_index(), first_race], ignore_index=True)
+    return first_race
 
-    # a) results.csv (Carrera Principal)
-    results_df = pd.read_csv(RESULTS_FILE, sep=COMMON_DELIMITER)
-    results_df = results_df[['raceId', 'driverId', 'constructorId', 'grid', 'milliseconds', 'statusId', 'position']].copy()
+
+def ultimas_filas(filas_df):
+    """
+    Última fila de cada piloto, constructor y circuito (con LAPS RACE): la
+    semilla de la siguiente ejecución incremental.
+
+    Parámetros:
+        filas_df (DataFrame): Filas en orden de (RACEID, DRIVERID).
+
+    Devuelve:
+        tuple: (ultimas_pilotos, ultimas_constructores, ultimas_circuitos).
+    """
+    ultimas_pilotos = filas_df[['DRIVERID', 'RACEID', 'YEAR', 'position', 'POINTS STANDINGS']].groupby('DRIVERID').tail(1)
+    ultimas_pilotos = ultimas_pilotos.rename(columns={'position': 'LAST POSITION'})
+    ultimas_constructores = filas_df[['CONSTRUCTORID', 'RACEID', 'YEAR', 'CONSTRUCTOR POINTS']].groupby('CONSTRUCTORID').tail(1)
+    # Vueltas de la última carrera disputada en cada circuito
+    ultimas_circuitos = filas_df[['CIRCUITID', 'RACEID', 'LAPS RACE']].dropna(subset=['LAPS RACE']).groupby('CIRCUITID').tail(1)
+    return ultimas_pilotos, ultimas_constructores, ultimas_circuitos.set_index('CIRCUITID')
+
+
+def estado_tras_bloque(estado_pilotos, estado_constructores, estado_circuitos, bloque):
+    """
+    Estado por piloto, constructor y circuito tras procesar un bloque de carreras.
+
+    Parámetros:
+        estado_pilotos, estado_constructores, estado_circuitos (DataFrame): Estado
+            anterior al bloque (ver cargar_estado), o None si no hay.
+        bloque (dict): ultimas_pilotos, ultimas_constructores y ultimas_circuitos
+            (ultimas_filas), wins_by_race y constructor_wins (victorias del bloque)
+            y first_race (primeras_carreras).
+
+    Devuelve:
+        tuple: (estado_pilotos, estado_constructores, estado_circuitos).
+    """
+    estado_pilotos = actualizar_estado(estado_pilotos, bloque['ultimas_pilotos'], bloque['wins_by_race'], 'DRIVERID')
+    debut = bloque['first_race'].set_index('driverId')['DEBUT_YEAR']
+    estado_pilotos = estado_pilotos.reindex(estado_pilotos.index.union(debut.index))
+    estado_pilotos['DEBUT_YEAR'] = debut
+    estado_pilotos[['WINS CAREER', 'WINS SEASON']] = estado_pilotos[['WINS CAREER', 'WINS SEASON']].fillna(0).astype(int)
+
+    estado_constructores = actualizar_estado(estado_constructores, bloque['ultimas_constructores'],
+                                             bloque['constructor_wins'], 'CONSTRUCTORID')
+
+    ultimas_circuitos = bloque['ultimas_circuitos']
+    if estado_circuitos is not None:
+        ultimas_circuitos = pd.concat([estado_circuitos[~estado_circuitos.index.isin(ultimas_circuitos.index)], ultimas_circuitos])
+    return estado_pilotos, estado_constructores, ultimas_circuitos
+
+
+def etapa_carga(entradas, parametros, etapa):
+    """Lectura de las tablas de f1_data (solo las carreras del bloque donde se puede)."""
+    ultima_carrera, race_ids, sembrado = parametros['ultima_carrera'], parametros['race_ids'], parametros['sembrado']
+
+    # d) races.csv (Información de carreras), primero para leer el resto solo de estas carreras
+    races_all_df = leer_tabla('races', ['raceId', 'circuitId', 'round', 'year', 'date'],
+                              desde_year=parametros['process_from_year'])
+    races_df = races_all_df.rename(columns={'round': 'ROUND', 'year': 'YEAR', 'date': 'DATE', 'circuitId': 'CIRCUITID'})
+    # Convertir DATE a datetime para cálculos de edad
+    races_df['DATE'] = pd.to_datetime(races_df['DATE'])
+    # Filtrar lo más pronto posible
+    races_df = races_df[races_df['raceId'] > ultima_carrera].copy()
+    if race_ids is not None:
+        races_df = races_df[races_df['raceId'].isin(race_ids)]
+    recent_race_ids = set(races_df['raceId'].unique())
+
+    # a) results.csv (Carrera Principal): una sola lectura para todos los usos
+    # (sin estado, el año de debut se calcula con todos los resultados)
+    results_all_df = leer_tabla('results', ['raceId', 'driverId', 'constructorId', 'grid', 'milliseconds', 'statusId', 'position', 'laps'],
+                                race_ids=recent_race_ids if sembrado else None)
+    results_df = results_all_df[['raceId', 'driverId', 'constructorId', 'grid', 'milliseconds', 'statusId', 'position']].copy()
     results_df.rename(columns={
         'grid': 'GRID',
         'milliseconds': 'MS RACE',
@@ -46,167 +185,97 @@ def generar_dataset_f1_completo(min_year=2014):
     }, inplace=True)
 
     # b) sprint_results.csv (Carrera Sprint)
-    sprint_df = pd.read_csv(SPRINT_RESULTS_FILE, sep=COMMON_DELIMITER)
-    sprint_df = sprint_df[['raceId', 'driverId', 'constructorId', 'milliseconds', 'statusId']].copy()
+    sprint_df = leer_tabla('sprint_results', ['raceId', 'driverId', 'constructorId', 'milliseconds', 'statusId'], race_ids=recent_race_ids)
     sprint_df.rename(columns={
         'milliseconds': 'MS SPRINT',
         'statusId': 'STATUS SPRINT'
     }, inplace=True)
 
     # c) qualifying.csv (Calificación)
-    qualifying_df = pd.read_csv(QUALIFYING_FILE, sep=COMMON_DELIMITER)
-    qualifying_df = qualifying_df[['raceId', 'driverId', 'constructorId', 'q1', 'q2', 'q3']].copy()
-
-    # d) races.csv (Información de carreras)
-    races_df = pd.read_csv(RACES_FILE, sep=COMMON_DELIMITER)
-    races_df = races_df[['raceId', 'circuitId', 'round', 'year', 'date']].copy()
-    races_df.rename(columns={'round': 'ROUND', 'year': 'YEAR', 'date': 'DATE', 'circuitId': 'CIRCUITID'}, inplace=True)
-    # Convertir DATE a datetime para cálculos de edad
-    races_df['DATE'] = pd.to_datetime(races_df['DATE'])
-    # Filtrar lo más pronto posible
-    races_df = races_df[races_df['YEAR'] >= PROCESS_FROM_YEAR].copy()
-    recent_race_ids = set(races_df['raceId'].unique())
+    qualifying_df = leer_tabla('qualifying', ['raceId', 'driverId', 'constructorId', 'q1', 'q2', 'q3'], race_ids=recent_race_ids)
 
     # g) circuits.csv (añadir distancia por vuelta y si es urbano)
-    circuits_df = pd.read_csv('f1_data/circuits.csv', sep=COMMON_DELIMITER)
-    circuits_df = circuits_df[['circuitId', 'lap_distance_km', 'urban']].copy()
+    circuits_df = leer_tabla('circuits', ['circuitId', 'lap_distance_km', 'urban'])
     circuits_df.rename(columns={'circuitId': 'CIRCUITID', 'lap_distance_km': 'LAP DISTANCE KM', 'urban': 'URBAN'}, inplace=True)
-    
-    # h) f1_weather_data.csv (añadir datos meteorológicos)
-    weather_df = pd.read_csv('f1_weather_data.csv', sep=COMMON_DELIMITER)
-    weather_df = weather_df[[
-        'raceId', 'avg_wind_speed_100m', 'max_wind_speed_100m', 'avg_temperature_2m', 
-        'min_temperature_2m', 'max_temperature_2m', 'avg_humidity', 'total_precipitation',
-        'avg_pressure_msl', 'avg_surface_pressure'
-    ]].copy()
-    # Redondear a 2 decimales
-    weather_df['avg_wind_speed_100m'] = weather_df['avg_wind_speed_100m'].round(2)
-    weather_df['max_wind_speed_100m'] = weather_df['max_wind_speed_100m'].round(2)
-    weather_df['avg_temperature_2m'] = weather_df['avg_temperature_2m'].round(2)
-    weather_df['min_temperature_2m'] = weather_df['min_temperature_2m'].round(2)
-    weather_df['max_temperature_2m'] = weather_df['max_temperature_2m'].round(2)
-    weather_df['avg_humidity'] = weather_df['avg_humidity'].round(2)
-    weather_df['total_precipitation'] = weather_df['total_precipitation'].round(2)
-    weather_df['avg_pressure_msl'] = weather_df['avg_pressure_msl'].round(2)
-    weather_df['avg_surface_pressure'] = weather_df['avg_surface_pressure'].round(2)
-    weather_df.rename(columns={
-        'avg_wind_speed_100m': 'AVG WIND SPEED',
-        'max_wind_speed_100m': 'MAX WIND SPEED',
-        'avg_temperature_2m': 'AVG TEMPERATURE',
-        'min_temperature_2m': 'MIN TEMPERATURE',
-        'max_temperature_2m': 'MAX TEMPERATURE',
-        'avg_humidity': 'AVG HUMIDITY',
-        'total_precipitation': 'PRECIPITATION',
-        'avg_pressure_msl': 'AVG PRESSURE MSL',
-        'avg_surface_pressure': 'AVG SURFACE PRESSURE'
-    }, inplace=True)
-    
+
     # e) drivers.csv (Información de pilotos)
-    drivers_df = pd.read_csv('f1_data/drivers.csv', sep=COMMON_DELIMITER)
-    drivers_df = drivers_df[['driverId', 'dob']].copy()
+    drivers_df = leer_tabla('drivers', ['driverId', 'dob'])
     drivers_df.rename(columns={'dob': 'DOB'}, inplace=True)
     drivers_df['DOB'] = pd.to_datetime(drivers_df['DOB'])
-    
+
     # f) driver_standings.csv (Campeonato de pilotos)
-    driver_standings_df = pd.read_csv('f1_data/driver_standings.csv', sep=COMMON_DELIMITER, na_values=['\\N'])
-    driver_standings_df = driver_standings_df[driver_standings_df['raceId'].isin(recent_race_ids)]
-    driver_standings_df = driver_standings_df[['raceId', 'driverId', 'points', 'position']].copy()
+    driver_standings_df = leer_tabla('driver_standings', ['raceId', 'driverId', 'points', 'position'], race_ids=recent_race_ids)
     driver_standings_df.rename(columns={
         'points': 'POINTS STANDINGS',
         'position': 'POSITION STANDINGS'
     }, inplace=True)
+    etapa['filas'] = len(results_all_df)
+    return {
+        'races_all_df': races_all_df,
+        'races_df': races_df,
+        'recent_race_ids': recent_race_ids,
+        'results_all_df': results_all_df,
+        'results_df': results_df,
+        'sprint_df': sprint_df,
+        'qualifying_df': qualifying_df,
+        'circuits_df': circuits_df,
+        'drivers_df': drivers_df,
+        'driver_standings_df': driver_standings_df,
+    }
 
 
-    # --- 3. Realizar las Fusiones (JOINs) ---
+# --- 3. Realizar las Fusiones (JOINs) ---
 
+def etapa_fusiones(entradas, parametros, etapa):
+    """Filas del bloque (resultados y sprints) con las tablas de carga añadidas por búsquedas indexadas."""
+    carga = entradas['carga']
     print("Realizando fusiones de datos...")
 
-    # Fusión 1: Resultados de Carrera y Sprint (Full Outer Join)
-    merged_df = pd.merge(
-        results_df[results_df['raceId'].isin(recent_race_ids)],
-        sprint_df[sprint_df['raceId'].isin(recent_race_ids)],
-        on=['raceId', 'driverId', 'constructorId'],
-        how='outer'
-    )
+    # Filas: resultados de carrera y sprints (como un full outer join), ordenadas una
+    # sola vez por (raceId, driverId); el resto de etapas conserva este orden
+    claves = ['raceId', 'driverId', 'constructorId']
+    merged_df = filas_carreras(carga['results_df'], carga['sprint_df'], carga['recent_race_ids'])
 
-    # Fusión 2: con Calificación (Left Join)
-    merged_df = pd.merge(
-        merged_df,
-        qualifying_df[qualifying_df['raceId'].isin(recent_race_ids)],
-        on=['raceId', 'driverId', 'constructorId'],
-        how='left'
-    )
+    if merged_df.empty:
+        return None
 
-    # Fusión 3: con Fechas (Left Join)
-    merged_df = pd.merge(
-        merged_df,
-        races_df,
-        on='raceId',
-        how='left'
-    )
+    # Resto de tablas como búsquedas indexadas (left join), añadidas en una sola
+    # construcción del DataFrame: sprint, calificación, fechas, distancia de
+    # vuelta por circuito, pilotos y driver standings (la meteorología, en la etapa clima)
+    merged_df = anadir_columnas(merged_df, [
+        (indexar(carga['sprint_df'], claves), claves),
+        (indexar(carga['qualifying_df'], claves), claves),
+        (indexar(carga['races_df'], ['raceId']), ['raceId']),
+        (indexar(carga['circuits_df'], ['CIRCUITID']), ['CIRCUITID']),
+        (indexar(carga['drivers_df'], ['driverId']), ['driverId']),
+        (indexar(carga['driver_standings_df'], ['raceId', 'driverId']), ['raceId', 'driverId']),
+    ])
+    etapa['filas'] = len(merged_df)
+    return {'merged_df': merged_df}
 
-    # Añadir distancia de vuelta por circuito
-    merged_df = pd.merge(
-        merged_df,
-        circuits_df,
-        on='CIRCUITID',
-        how='left'
-    )
-    
-    # Fusión 6: con Datos Meteorológicos (Left Join)
-    merged_df = pd.merge(
-        merged_df,
-        weather_df,
-        on='raceId',
-        how='left'
-    )
-    
-    # Fusión 4: con Información de Pilotos (Left Join)
-    merged_df = pd.merge(
-        merged_df,
-        drivers_df,
-        on='driverId',
-        how='left'
-    )
-    
-    # Fusión 5: con Driver Standings (Left Join)
-    merged_df = pd.merge(
-        merged_df,
-        driver_standings_df,
-        on=['raceId', 'driverId'],
-        how='left'
-    )
 
-    # --- 4. Transformaciones y Filtrado Finales ---
+# --- 4. Transformaciones y Filtrado Finales ---
+
+def etapa_clasificacion(entradas, parametros, etapa):
+    """Tiempos de clasificación en ms, su validez, BEST Q y SPRINT Y/N."""
+    merged_df = entradas['fusiones']['merged_df']
 
     # Crear la columna 'SPRINT Y/N' (1 si hubo sprint, 0 si no)
-    merged_df['SPRINT Y/N'] = merged_df['MS SPRINT'].notna().astype(int)
-    
-    # Función para convertir tiempo MM:SS.SSS a milisegundos
-    def time_to_milliseconds(time_str):
-        if pd.isna(time_str):
-            return None
-        try:
-            parts = str(time_str).split(':')
-            minutes = int(parts[0])
-            seconds = float(parts[1])
-            return int(minutes * 60 * 1000 + seconds * 1000)
-        except:
-            return None
-    
-    # Convertir Q1, Q2, Q3 a milisegundos
-    merged_df['q1'] = merged_df['q1'].apply(time_to_milliseconds)
-    merged_df['q2'] = merged_df['q2'].apply(time_to_milliseconds)
-    merged_df['q3'] = merged_df['q3'].apply(time_to_milliseconds)
-    
+    # (hay fila de sprint aunque el tiempo sea nulo, p. ej. si abandonó)
+    merged_df['SPRINT Y/N'] = merged_df['STATUS SPRINT'].notna().astype(int)
+
+    # Convertir Q1, Q2, Q3 a milisegundos en una sola pasada vectorizada
+    q_ms, q_validos = parsear_tiempos_clasificacion(merged_df[['q1', 'q2', 'q3']])
+
     # Sustituir valores nulos por 300000 (penalización por no clasificar)
-    merged_df['q1'] = merged_df['q1'].fillna(300000)
-    merged_df['q2'] = merged_df['q2'].fillna(300000)
-    merged_df['q3'] = merged_df['q3'].fillna(300000)
-    
+    merged_df[['q1', 'q2', 'q3']] = np.where(q_validos, q_ms, 300000).astype(float)
+
+    # Columnas binarias de validez a partir de la máscara del parser
+    merged_df[['Q1 VALID', 'Q2 VALID', 'Q3 VALID']] = q_validos.astype(int)
+
     # Convertir 'DATE' a datetime
     merged_df['DATE'] = pd.to_datetime(merged_df['DATE'])
-    
+
     # Renombrar IDs y Qs a mayúsculas primero
     merged_df.rename(columns={
         'raceId': 'RACEID',
@@ -216,225 +285,617 @@ def generar_dataset_f1_completo(min_year=2014):
         'q2': 'Q2',
         'q3': 'Q3'
     }, inplace=True)
-    
+
     # Calcular BEST Q (el menor tiempo entre Q1, Q2, Q3)
     merged_df['BEST Q'] = merged_df[['Q1', 'Q2', 'Q3']].min(axis=1)
-    
-    # --- 5. Calcular nuevas columnas ---
-    
+    etapa['filas'] = len(merged_df)
+    return {'merged_df': merged_df}
+
+
+# --- 5. Calcular nuevas columnas ---
+
+def etapa_tiempo_carrera(entradas, parametros, etapa):
+    """LAPS RACE, imputación de MS RACE para '+N Laps' y RACE VALID."""
+    merged_df = entradas['clasificacion']['merged_df']
+    carga = entradas['carga']
+
     # Cargar todas las carreras con resultados para cálculos históricos
-    results_full = pd.read_csv(RESULTS_FILE, sep=COMMON_DELIMITER)
-    results_full = results_full[results_full['raceId'].isin(recent_race_ids)]
-    results_full['position'] = pd.to_numeric(results_full['position'], errors='coerce')
-
-    # LAPS RACE: número de vueltas completadas por el ganador (referencia de la carrera)
-    laps_per_race = results_full[results_full['position'] == 1][['raceId', 'laps']].copy()
-    laps_per_race.rename(columns={'raceId': 'RACEID', 'laps': 'LAPS RACE'}, inplace=True)
-
-    # Añadir vueltas totales de la carrera (ganador)
-    merged_df = merged_df.merge(laps_per_race, on='RACEID', how='left')
-    
-    # Cargar status para identificar pilotos con +N laps
-    status_df = pd.read_csv('f1_data/status.csv', sep=COMMON_DELIMITER)
-    status_dict = status_df.set_index('statusId')['status'].to_dict()
-    
-    # Obtener tiempos del ganador por carrera
-    winner_times = results_full[results_full['position'] == 1][['raceId', 'milliseconds']].copy()
-    winner_times['milliseconds'] = pd.to_numeric(winner_times['milliseconds'], errors='coerce')
-    winner_times.rename(columns={'raceId': 'RACEID', 'milliseconds': 'WINNER_TIME'}, inplace=True)
-    merged_df = merged_df.merge(winner_times, on='RACEID', how='left')
-    
-    # Convertir MS RACE a numérico
-    merged_df['MS RACE'] = pd.to_numeric(merged_df['MS RACE'], errors='coerce')
-    
-    # Ajustar MS RACE para +1, +2, +3, +4 laps
-    def adjust_race_time(row):
-        if pd.isna(row['MS RACE']):
-            status_id = row['STATUS RACE']
-            status_text = status_dict.get(status_id, '')
-            
-            # Detectar +N Laps (N entre 1 y 4)
-            if status_text in ['+1 Lap', '+2 Laps', '+3 Laps', '+4 Laps']:
-                # Extraer número de vueltas
-                laps_behind = int(status_text.split()[0].replace('+', ''))
-                
-                if laps_behind <= 4 and pd.notna(row['WINNER_TIME']) and pd.notna(row['BEST Q']):
-                    # Calcular tiempo estimado: tiempo_ganador + (mejor_Q + 7s) * vueltas_de_más
-                    estimated_time = row['WINNER_TIME'] + (row['BEST Q'] + 7000) * laps_behind
-                    return estimated_time
-        
-        return row['MS RACE']
-    
-    merged_df['MS RACE'] = merged_df.apply(adjust_race_time, axis=1)
-    
+    results_full = carga['results_all_df'][carga['results_all_df']['raceId'].isin(carga['recent_race_ids'])]
+
+    # LAPS RACE y WINNER_TIME: vueltas completadas y tiempo del ganador (referencia de la carrera)
+    merged_df = anadir_columnas(merged_df, [(indexar(ganadores_carreras(results_full), ['RACEID']), ['RACEID'])])
+
+    # Cargar status y precalcular statusId -> vueltas de retraso (+N Laps)
+    status_df = leer_tabla('status')
+    vueltas_por_estado = calcular_vueltas_perdidas_por_estado(status_df, max_vueltas=parametros['max_vueltas_perdidas'])
+
+    # Ajustar MS RACE para +N laps: tiempo_ganador + (mejor_Q + 7s) * vueltas_de_más
+    merged_df['MS RACE'] = imputar_tiempo_vueltas_perdidas(
+        merged_df, vueltas_por_estado, perdida_por_circuito=parametros['perdida_por_circuito']
+    )
+
     # Rellenar valores NA restantes en MS RACE con valor arbitrariamente alto
     merged_df['MS RACE'] = merged_df['MS RACE'].fillna(10000000)
-    
-    # Crear columnas binarias para indicar si el piloto tiene tiempo válido
-    # Q1 VALID: 1 si Q1 != 300000, 0 si Q1 == 300000
-    merged_df['Q1 VALID'] = (merged_df['Q1'] != 300000).astype(int)
-    # Q2 VALID: 1 si Q2 != 300000, 0 si Q2 == 300000
-    merged_df['Q2 VALID'] = (merged_df['Q2'] != 300000).astype(int)
-    # Q3 VALID: 1 si Q3 != 300000, 0 si Q3 == 300000
-    merged_df['Q3 VALID'] = (merged_df['Q3'] != 300000).astype(int)
+
+    # Crear columna binaria para indicar si el piloto tiene tiempo de carrera válido
     # RACE VALID: 1 si MS RACE != 10000000, 0 si MS RACE == 10000000
     merged_df['RACE VALID'] = (merged_df['MS RACE'] != 10000000).astype(int)
-    
+
     # Eliminar columna auxiliar
     merged_df.drop(columns=['WINNER_TIME'], inplace=True)
-    
+    etapa['filas'] = len(merged_df)
+    return {'merged_df': merged_df, 'results_full': results_full}
+
+
+def etapa_historico_pilotos(entradas, parametros, etapa):
+    """AGE, DRIVER LAST POSITION, POINTS BEFORE GP y YEARS OF EXPERIENCE."""
+    merged_df = entradas['tiempo_carrera']['merged_df']
+    results_full = entradas['tiempo_carrera']['results_full']
+    estado_pilotos = parametros['estado_pilotos']
+    sembrado = estado_pilotos is not None
+
     # Crear tabla de información de carreras
-    race_info = pd.read_csv(RACES_FILE, sep=COMMON_DELIMITER)[['raceId', 'year']].copy()
-    race_info = race_info[race_info['year'] >= PROCESS_FROM_YEAR]
-    race_info = race_info.sort_values('raceId').reset_index(drop=True)
-    race_info['RACE_ORDER'] = range(len(race_info))
-    
-    # Crear diccionario de año por raceId para lookup rápido
-    races_dict = race_info.set_index('raceId')['year'].to_dict()
-    
+    race_info = info_carreras(entradas['carga']['races_all_df'])
+
     # AGE: Calcular edad del piloto en la fecha de la carrera
     merged_df['AGE'] = ((merged_df['DATE'] - merged_df['DOB']).dt.days / 365.25).astype(int)
-    
-    # Ordenar por DRIVERID y RACEID para asegurar el orden correcto en shift
-    merged_df = merged_df.sort_values(['DRIVERID', 'RACEID']).reset_index(drop=True)
-    
+
     # DRIVER LAST POSITION: Posición del piloto en la carrera anterior (no en el campeonato)
-    # Convertir position a numérico si no lo es
-    merged_df['position'] = pd.to_numeric(merged_df['position'], errors='coerce')
-    merged_df['DRIVER LAST POSITION'] = merged_df.groupby('DRIVERID')['position'].shift(1).fillna(21).astype(int)
-    
+    # (las filas ya están en orden de RACEID dentro de cada piloto).
+    # Con estado, la primera fila de cada piloto parte de su última fila guardada
+    merged_df['DRIVER LAST POSITION'] = valor_anterior(
+        merged_df, 'DRIVERID', 'position', estado_pilotos['LAST POSITION'] if sembrado else None
+    ).fillna(21).astype(int)
+
     # POINTS BEFORE GP: Puntos en el campeonato antes de esta carrera
-    merged_df['POINTS BEFORE GP'] = merged_df.groupby('DRIVERID')['POINTS STANDINGS'].shift(1).fillna(0)
-    
+    merged_df['POINTS BEFORE GP'] = valor_anterior(
+        merged_df, 'DRIVERID', 'POINTS STANDINGS', estado_pilotos['POINTS STANDINGS'] if sembrado else None
+    ).fillna(0)
+
     # YEARS OF EXPERIENCE: Años desde el debut
-    # Crear tabla con el año del primer debut de cada piloto
-    first_race = pd.read_csv(RESULTS_FILE, sep=COMMON_DELIMITER)[['raceId', 'driverId']].copy()
-    first_race = first_race.merge(race_info, on='raceId', how='left')[['driverId', 'year']].drop_duplicates('driverId', keep='first').rename(columns={'year': 'DEBUT_YEAR'})
-    
-    merged_df = merged_df.merge(first_race, left_on='DRIVERID', right_on='driverId', how='left')
+    # Con estado, solo se calcula el de los pilotos nuevos; el resto conserva el del estado
+    first_race = primeras_carreras(results_full if sembrado else entradas['carga']['results_all_df'], race_info,
+                                   estado_pilotos)
+
+    merged_df = anadir_columnas(merged_df, [(indexar(first_race, ['driverId']), ['DRIVERID'])])
     merged_df['YEARS OF EXPERIENCE'] = (merged_df['YEAR'] - merged_df['DEBUT_YEAR']).fillna(0).astype(int)
-    
-    # WINS SEASON y WINS CAREER: Usar cálculo eficiente sin apply
-    # Crear tabla de victorias para cada carrera
-    wins_by_race = results_full[results_full['position'] == 1][['raceId', 'driverId']].copy()
-    
-    # Agregar información de año a las victorias
-    wins_by_race = wins_by_race.merge(race_info, on='raceId', how='left')
-    
+    etapa['filas'] = len(merged_df)
+    return {'merged_df': merged_df, 'race_info': race_info, 'first_race': first_race}
+
+
+def etapa_victorias_pilotos(entradas, parametros, etapa):
+    """WINS SEASON y WINS CAREER del piloto."""
+    merged_df = entradas['historico_pilotos']['merged_df']
+    race_info = entradas['historico_pilotos']['race_info']
+
+    # WINS SEASON y WINS CAREER: Suma acumulada de victorias previas por piloto
+    # Crear tabla de victorias para cada carrera, con su año y orden
+    wins_by_race = victorias_carreras(entradas['tiempo_carrera']['results_full'], race_info, 'driverId', 'DRIVERID')
+
     # Agregar RACE_ORDER a merged_df para comparaciones
-    merged_df = merged_df.merge(race_info[['raceId', 'RACE_ORDER']], left_on='RACEID', right_on='raceId', how='left', validate='m:1')
-    
-    # Calcular WINS CAREER y WINS SEASON usando groupby + merge eficiente
-    def calc_wins(driver_id, current_race_order, current_year):
-        # WINS CAREER: todas las victorias antes de esta carrera
-        wins_career = wins_by_race[(wins_by_race['driverId'] == driver_id) & (wins_by_race['RACE_ORDER'] < current_race_order)].shape[0]
-        # WINS SEASON: victorias en la temporada antes de esta carrera
-        wins_season = wins_by_race[(wins_by_race['driverId'] == driver_id) & (wins_by_race['RACE_ORDER'] < current_race_order) & (wins_by_race['year'] == current_year)].shape[0]
-        return wins_career, wins_season
-    
-    # Aplicar cálculo vectorizado
-    wins_data = merged_df.apply(lambda row: calc_wins(row['DRIVERID'], row['RACE_ORDER'], row['YEAR']), axis=1, result_type='expand')
-    merged_df['WINS CAREER'] = wins_data[0].fillna(0).astype(int)
-    merged_df['WINS SEASON'] = wins_data[1].fillna(0).astype(int)
-    
-    # --- Columnas para Constructores ---
-    
+    merged_df = anadir_columnas(merged_df, [(indexar(race_info[['raceId', 'RACE_ORDER']], ['raceId']), ['RACEID'])])
+
+    merged_df['WINS CAREER'], merged_df['WINS SEASON'] = calcular_victorias_previas(
+        merged_df, wins_by_race, 'DRIVERID', previas=parametros['estado_pilotos']
+    )
+    etapa['filas'] = len(merged_df)
+    return {'merged_df': merged_df, 'wins_by_race': wins_by_race}
+
+
+# --- Columnas para Constructores ---
+
+def etapa_constructores(entradas, parametros, etapa):
+    """CONSTRUCTOR POINTS BEFORE GP y CONSTRUCTOR WINS SEASON."""
+    merged_df = entradas['victorias_pilotos']['merged_df']
+    estado_constructores = parametros['estado_constructores']
+
     # CONSTRUCTOR POINTS BEFORE GP: Puntos del constructor antes de esta carrera
     # Cargar constructor standings
-    constructor_standings_df = pd.read_csv('f1_data/constructor_standings.csv', sep=COMMON_DELIMITER, na_values=['\\N'])
-    constructor_standings_df = constructor_standings_df[constructor_standings_df['raceId'].isin(recent_race_ids)]
-    constructor_standings_df = constructor_standings_df[['raceId', 'constructorId', 'points']].copy()
+    constructor_standings_df = leer_tabla('constructor_standings', ['raceId', 'constructorId', 'points'],
+                                          race_ids=entradas['carga']['recent_race_ids'])
     constructor_standings_df.rename(columns={'points': 'CONSTRUCTOR POINTS'}, inplace=True)
-    
-    # Merge con constructor standings
-    merged_df = merged_df.merge(
-        constructor_standings_df,
-        left_on=['RACEID', 'CONSTRUCTORID'],
-        right_on=['raceId', 'constructorId'],
-        how='left'
-    )
-    
-    # Ordenar temporalmente por CONSTRUCTORID y RACEID para calcular CONSTRUCTOR POINTS BEFORE GP
-    merged_df_temp = merged_df.sort_values(['CONSTRUCTORID', 'RACEID']).reset_index(drop=True)
-    
-    # Calcular CONSTRUCTOR POINTS BEFORE GP usando shift
-    merged_df_temp['CONSTRUCTOR POINTS BEFORE GP'] = merged_df_temp.groupby('CONSTRUCTORID')['CONSTRUCTOR POINTS'].shift(1).fillna(0)
-    
-    # Restaurar el orden original por DRIVERID y RACEID
-    merged_df = merged_df_temp.sort_values(['DRIVERID', 'RACEID']).reset_index(drop=True)
-    
+
+    # Añadir constructor standings
+    merged_df = anadir_columnas(merged_df, [
+        (indexar(constructor_standings_df, ['raceId', 'constructorId']), ['RACEID', 'CONSTRUCTORID'])
+    ])
+
+    # Calcular CONSTRUCTOR POINTS BEFORE GP usando shift: con las filas en orden de
+    # (RACEID, DRIVERID), cada constructor toma el valor de su fila anterior
+    merged_df['CONSTRUCTOR POINTS BEFORE GP'] = valor_anterior(
+        merged_df, 'CONSTRUCTORID', 'CONSTRUCTOR POINTS',
+        estado_constructores['CONSTRUCTOR POINTS'] if estado_constructores is not None else None
+    ).fillna(0)
+
     # CONSTRUCTOR WINS SEASON: Victorias del constructor en la temporada actual antes de esta carrera
-    constructor_wins = results_full[results_full['position'] == 1][['raceId', 'constructorId']].copy()
-    constructor_wins = constructor_wins.merge(race_info, on='raceId', how='left')
-    
-    def calc_constructor_wins_season(constructor_id, current_race_order, current_year):
-        # CONSTRUCTOR WINS SEASON: victorias en la temporada antes de esta carrera
-        wins_season = constructor_wins[(constructor_wins['constructorId'] == constructor_id) & 
-                                      (constructor_wins['RACE_ORDER'] < current_race_order) & 
-                                      (constructor_wins['year'] == current_year)].shape[0]
-        return wins_season
-    
-    merged_df['CONSTRUCTOR WINS SEASON'] = merged_df.apply(
-        lambda row: calc_constructor_wins_season(row['CONSTRUCTORID'], row['RACE_ORDER'], row['YEAR']), 
-        axis=1
-    ).fillna(0).astype(int)
-    
+    constructor_wins = victorias_carreras(entradas['tiempo_carrera']['results_full'],
+                                          entradas['historico_pilotos']['race_info'], 'constructorId', 'CONSTRUCTORID')
+
+    _, merged_df['CONSTRUCTOR WINS SEASON'] = calcular_victorias_previas(
+        merged_df, constructor_wins, 'CONSTRUCTORID', previas=estado_constructores
+    )
+    etapa['filas'] = len(merged_df)
+    return {'merged_df': merged_df, 'constructor_wins': constructor_wins}
+
+
+def etapa_companero(entradas, parametros, etapa):
+    """MATE LAST POSITION."""
+    merged_df = entradas['constructores']['merged_df']
+
     # MATE LAST POSITION: Posición del compañero de equipo en su última carrera
-    # Usar el DRIVER LAST POSITION del compañero actual
-    merged_df = merged_df.sort_values(['RACEID', 'DRIVERID']).reset_index(drop=True)
-    
-    # Crear una lista para almacenar las posiciones del compañero
-    mate_positions = []
-    
-    # Para cada fila, buscar al compañero de equipo actual y obtener su DRIVER LAST POSITION
-    for idx, row in merged_df.iterrows():
-        driver_id = row['DRIVERID']
-        current_race_id = row['RACEID']
-        constructor_id = row['CONSTRUCTORID']
-        
-        # Buscar al compañero de equipo en la misma carrera actual
-        mate = merged_df[
-            (merged_df['RACEID'] == current_race_id) &
-            (merged_df['CONSTRUCTORID'] == constructor_id) &
-            (merged_df['DRIVERID'] != driver_id)
-        ]
-        
-        if mate.empty:
-            mate_positions.append(21)
-        else:
-            # Obtener el DRIVER LAST POSITION del compañero (su posición en la carrera anterior)
-            mate_last_pos = mate['DRIVER LAST POSITION'].iloc[0]
-            mate_positions.append(int(mate_last_pos) if pd.notna(mate_last_pos) else 21)
-    
-    merged_df['MATE LAST POSITION'] = mate_positions
-    
-    # --- 6. Filtrado Final ---
+    # Usar el DRIVER LAST POSITION del compañero actual (filas en orden de RACEID y DRIVERID)
+
+    # Auto-unión agrupada por (RACEID, CONSTRUCTORID) para obtener el DRIVER LAST POSITION del compañero
+    merged_df['MATE LAST POSITION'] = calcular_posicion_companero(
+        merged_df, merged_df, ['RACEID', 'CONSTRUCTORID'], 'DRIVER LAST POSITION'
+    )
+    etapa['filas'] = len(merged_df)
+    return {'merged_df': merged_df}
+
+
+def etapa_paradas(entradas, parametros, etapa):
+    """COLUMNAS_PARADAS de las filas del bloque (solo dependen de sus ids, no del resto de features)."""
+    filas_df = entradas['clasificacion']['merged_df']
+    # Paradas en boxes de las carreras anteriores a cada fila (también las previas al bloque)
+    features = calcular_features_paradas(filas_df, leer_paradas(hasta_race_id=filas_df['RACEID'].max()))
+    etapa['filas'] = len(features)
+    return {'features': features}
+
+
+def etapa_forma(entradas, parametros, etapa):
+    """COLUMNAS_FORMA de las filas del bloque (con YEAR aún sin transformar)."""
+    filas_df = entradas['clasificacion']['merged_df']
+    # Forma reciente (DEFINICIONES_FORMA) con los resultados de las carreras anteriores a cada fila
+    features = calcular_features_forma(filas_df, historial_resultados(hasta_race_id=filas_df['RACEID'].max()))
+    etapa['filas'] = len(features)
+    return {'features': features}
+
+
+def etapa_clima(entradas, parametros, etapa):
+    """Features meteorológicas de las carreras del bloque (COLUMNAS_CLIMA y, con clima_ventanas, COLUMNAS_VENTANAS)."""
+    recent_race_ids = entradas['carga']['recent_race_ids']
+
+    # h) Datos meteorológicos (agregados diarios desde el almacén horario, redondeados a 2 decimales)
+    weather_df = leer_clima_carreras(recent_race_ids)
+    if parametros['clima_ventanas']:
+        # Ventanas de carrera y clasificación (horas de la sesión, no el día completo)
+        weather_df = weather_df.merge(clima_ventanas_carreras(recent_race_ids), on='raceId', how='left')
+    etapa['filas'] = len(weather_df)
+    return {'weather_df': weather_df}
+
+
+# --- 6. Filtrado Final ---
+
+def etapa_filtrado(entradas, parametros, etapa):
+    """Filas finales desde min_year con COLUMNAS_FINALES, y lo que necesita el estado tras el bloque."""
+    min_year = parametros['min_year']
+    merged_df = entradas['companero']['merged_df']
     print(f"Filtrando datos para incluir solo carreras a partir del año {min_year}...")
-    
+
+    # Meteorología y features opcionales (calculadas en sus propias etapas, en el orden de las filas)
+    merged_df = anadir_columnas(merged_df, [(indexar(entradas['clima']['weather_df'], ['raceId']), ['RACEID'])])
+    for opcional in ('paradas', 'forma'):
+        if opcional in entradas:
+            merged_df[entradas[opcional]['features'].columns] = entradas[opcional]['features']
+
     # Aplicar el filtro: solo años >= min_year
     final_df = merged_df[merged_df['YEAR'] >= min_year].copy()
-    
-    # Transformar la columna YEAR: restar 2025 para que 2025 sea 0 y años anteriores sean negativos
-    final_df['YEAR'] = final_df['YEAR'] - 2025
-    
+
+    # Transformar la columna YEAR: restar 2025 (YEAR_REFERENCIA) para que 2025 sea 0 y años anteriores sean negativos
+    final_df['YEAR'] = final_df['YEAR'] - YEAR_REFERENCIA
+
     # Seleccionar y reordenar las columnas finales
-    final_df = final_df[COLUMNAS_FINALES]
-    
+    final_df = final_df[columnas_finales(parametros['clima_ventanas'], parametros['paradas'], parametros['forma'])]
+
     # Limpiar valores NaN en columnas numéricas
     final_df['DRIVER LAST POSITION'] = final_df['DRIVER LAST POSITION'].fillna(21).astype(int)
     final_df['POINTS BEFORE GP'] = final_df['POINTS BEFORE GP'].fillna(0)
-    
+
     # Sustituir GRID = 0 por 20 (pilotos que salen desde el fondo)
     final_df['GRID'] = final_df['GRID'].replace(0, 20)
 
+    # Última fila de cada piloto, constructor y circuito: semilla de la próxima ejecución incremental
+    ultimas_pilotos, ultimas_constructores, ultimas_circuitos = ultimas_filas(merged_df)
+    etapa['filas'] = len(final_df)
+    return {
+        'filas': final_df,
+        'ultimas_pilotos': ultimas_pilotos,
+        'ultimas_constructores': ultimas_constructores,
+        'ultimas_circuitos': ultimas_circuitos,
+        'wins_by_race': entradas['victorias_pilotos']['wins_by_race'],
+        'constructor_wins': entradas['constructores']['constructor_wins'],
+        'first_race': entradas['historico_pilotos']['first_race'],
+    }
+
+
+def columnas_finales(clima_ventanas=False, paradas=False, forma=False):
+    """Columnas del dataset: features del modelo (con las opcionales) y variable objetivo."""
+    return (COLUMNAS_FEATURES + (COLUMNAS_VENTANAS if clima_ventanas else []) + (COLUMNAS_PARADAS if paradas else [])
+            + (COLUMNAS_FORMA if forma else []) + ['MS RACE'])
+
+
+def etapas_bloque(paradas=False, forma=False):
+    """
+    Grafo de etapas de calcular_bloque (ver etapas.ejecutar_etapas), en orden.
+
+    Las features históricas siguen la cadena de merged_df; paradas y forma
+    solo dependen de las filas (clasificacion) y clima de las carreras (carga),
+    así que un cambio en el clima o en esas features no recalcula el resto.
+    """
+    opcionales = [
+        Etapa('paradas', etapa_paradas, ['clasificacion'], tablas=['pit_stops', 'results', 'races'],
+              codigo=[paradas_mod, features_mod, datos_mod]),
+    ] if paradas else []
+    if forma:
+        opcionales.append(Etapa('forma', etapa_forma, ['clasificacion'], tablas=['results', 'races'],
+                                codigo=[forma_mod, features_mod, datos_mod]))
+    return [
+        Etapa('carga', etapa_carga, tablas=['races', 'results', 'sprint_results', 'qualifying', 'circuits', 'drivers',
+                                            'driver_standings'],
+              parametros=['process_from_year', 'ultima_carrera', 'race_ids', 'sembrado'], codigo=[datos_mod]),
+        Etapa('fusiones', etapa_fusiones, ['carga'], codigo=[filas_carreras, features_mod]),
+        Etapa('clasificacion', etapa_clasificacion, ['fusiones'], codigo=[features_mod]),
+        Etapa('tiempo_carrera', etapa_tiempo_carrera, ['clasificacion', 'carga'], tablas=['status'],
+              parametros=['max_vueltas_perdidas', 'perdida_por_circuito'], codigo=[ganadores_carreras, features_mod]),
+        Etapa('historico_pilotos', etapa_historico_pilotos, ['tiempo_carrera', 'carga'], parametros=['estado_pilotos'],
+              codigo=[info_carreras, primeras_carreras, features_mod]),
+        Etapa('victorias_pilotos', etapa_victorias_pilotos, ['historico_pilotos', 'tiempo_carrera'],
+              parametros=['estado_pilotos'], codigo=[victorias_carreras, features_mod]),
+        Etapa('constructores', etapa_constructores, ['victorias_pilotos', 'historico_pilotos', 'tiempo_carrera', 'carga'],
+              tablas=['constructor_standings'], parametros=['estado_constructores'],
+              codigo=[victorias_carreras, features_mod]),
+        Etapa('companero', etapa_companero, ['constructores'], codigo=[features_mod]),
+        *opcionales,
+        Etapa('clima', etapa_clima, ['carga'], archivos=[ALMACEN_FILE, CLIMA_FILE], parametros=['clima_ventanas'],
+              codigo=[clima_mod]),
+        Etapa('filtrado', etapa_filtrado,
+              ['companero', 'clima', 'victorias_pilotos', 'constructores', 'historico_pilotos']
+              + [etapa.nombre for etapa in opcionales],
+              parametros=['min_year', 'clima_ventanas', 'paradas', 'forma'],
+              codigo=[columnas_finales, ultimas_filas, features_mod]),
+    ]
+
+
+def calcular_bloque(min_year=2014, process_from_year=2001, max_vueltas_perdidas=4, perdida_por_circuito=None,
+                    clima_ventanas=False, paradas=False, forma=False, estado_pilotos=None,
+                    estado_constructores=None, ultima_carrera=0, race_ids=None, perfil=None, cache_etapas=None):
+    """
+    Calcula las filas del dataset de las carreras posteriores a ultima_carrera
+    partiendo del estado de pilotos y constructores anterior a ellas.
+
+    Las etapas (etapas_bloque) se ejecutan con etapas.ejecutar_etapas: con
+    cache_etapas solo se calculan las que cambiaron desde una ejecución anterior.
+
+    Parámetros:
+        min_year, process_from_year, max_vueltas_perdidas, perdida_por_circuito,
+        clima_ventanas, paradas, forma: Ver generar_dataset_f1_completo.
+        estado_pilotos, estado_constructores (DataFrame): Estado anterior a las
+            carreras del bloque (ver cargar_estado), o None si el bloque empieza
+            desde el principio.
+        ultima_carrera (int): Solo se calculan las carreras con raceId posterior.
+        race_ids (iterable): Opcional, solo estas carreras (p. ej. una temporada).
+        perfil (RegistroEtapas): Opcional, registro de las etapas.
+        cache_etapas (CacheEtapas): Opcional, caché de las salidas de las etapas.
+
+    Devuelve:
+        dict: filas (las filas finales, desde min_year), las últimas filas y las
+            victorias del bloque y first_race (ver estado_tras_bloque); None si
+            no hay carreras con resultados.
+    """
+    parametros = {
+        'min_year': min_year,
+        # Año mínimo de datos que se cargan para todos los cálculos (reduce volumen)
+        'process_from_year': process_from_year,
+        'max_vueltas_perdidas': max_vueltas_perdidas,
+        'perdida_por_circuito': perdida_por_circuito,
+        'clima_ventanas': clima_ventanas,
+        'paradas': paradas,
+        'forma': forma,
+        'estado_pilotos': estado_pilotos,
+        'estado_constructores': estado_constructores,
+        'ultima_carrera': int(ultima_carrera),
+        'race_ids': None if race_ids is None else sorted(int(race_id) for race_id in race_ids),
+        # Con estado, las features históricas continúan desde él en lugar de empezar de cero
+        'sembrado': estado_pilotos is not None,
+    }
+    return ejecutar_etapas(etapas_bloque(paradas, forma), 'filtrado', parametros, cache=cache_etapas, perfil=perfil)
+
+
+def estados_por_temporada(process_from_year=2001, estado_pilotos=None, estado_constructores=None,
+                          estado_circuitos=None, ultima_carrera=0):
+    """
+    Reparte las carreras posteriores a ultima_carrera en temporadas y calcula
+    el estado de pilotos y constructores al empezar cada una, sin calcular las
+    features: solo las columnas que forman el estado (posición, puntos,
+    victorias, debut y vueltas por circuito), encadenando estado_tras_bloque
+    temporada a temporada igual que una construcción incremental por temporadas.
+
+    Las temporadas son tramos consecutivos de carreras del mismo año en orden
+    de raceId, que es el orden en el que se calculan las features.
+
+    Parámetros:
+        process_from_year (int): Año mínimo de datos cargados.
+        estado_pilotos, estado_constructores, estado_circuitos (DataFrame):
+            Estado hasta ultima_carrera (ver cargar_estado), o None.
+        ultima_carrera (int): Solo se reparten las carreras con raceId posterior.
+
+    Devuelve:
+        tuple: (temporadas, estado_final): una lista de (year, race_ids,
+            estado_pilotos, estado_constructores) con el estado al empezar cada
+            temporada (vacía si no hay carreras con resultados) y el estado
+            tras la última (ver estado_tras_bloque).
+    """
+    claves = ['raceId', 'driverId', 'constructorId']
+    races_all_df = leer_tabla('races', ['raceId', 'circuitId', 'year'], desde_year=process_from_year)
+    race_info = info_carreras(races_all_df)
+    carreras = races_all_df[races_all_df['raceId'] > ultima_carrera].rename(columns={'circuitId': 'CIRCUITID', 'year': 'YEAR'})
+    race_ids = set(carreras['raceId'])
+
+    # Mismas tablas y filas que calcular_bloque, solo con las columnas del estado
+    results_all_df = leer_tabla('results', claves + ['position', 'laps', 'milliseconds'],
+                                race_ids=race_ids if estado_pilotos is not None else None)
+    results_full = results_all_df[results_all_df['raceId'].isin(race_ids)]
+    sprint_df = leer_tabla('sprint_results', claves, race_ids=race_ids)
+    driver_standings_df = leer_tabla('driver_standings', ['raceId', 'driverId', 'points'], race_ids=race_ids)
+    constructor_standings_df = leer_tabla('constructor_standings', ['raceId', 'constructorId', 'points'], race_ids=race_ids)
+
+    filas_df = filas_carreras(results_full[claves + ['position']], sprint_df, race_ids)
+    filas_df = anadir_columnas(filas_df, [
+        (indexar(carreras, ['raceId']), ['raceId']),
+        (indexar(driver_standings_df.rename(columns={'points': 'POINTS STANDINGS'}), ['raceId', 'driverId']),
+         ['raceId', 'driverId']),
+        (indexar(constructor_standings_df.rename(columns={'points': 'CONSTRUCTOR POINTS'}), ['raceId', 'constructorId']),
+         ['raceId', 'constructorId']),
+        (indexar(ganadores_carreras(results_full)[['RACEID', 'LAPS RACE']], ['RACEID']), ['raceId']),
+    ]).rename(columns={'raceId': 'RACEID', 'driverId': 'DRIVERID', 'constructorId': 'CONSTRUCTORID'})
+
+    wins_by_race = victorias_carreras(results_full, race_info, 'driverId', 'DRIVERID')
+    constructor_wins = victorias_carreras(results_full, race_info, 'constructorId', 'CONSTRUCTORID')
+    first_race = primeras_carreras(results_full if estado_pilotos is not None else results_all_df, race_info, estado_pilotos)
+
+    # Temporada de cada carrera con resultados: cambia cada vez que cambia el año en orden de raceId
+    carreras = carreras[carreras['raceId'].isin(filas_df['RACEID'])].sort_values('raceId')
+    temporada = (carreras['YEAR'] != carreras['YEAR'].shift()).cumsum()
+
+    def resumen(race_ids_bloque):
+        ultimas_pilotos, ultimas_constructores, ultimas_circuitos = ultimas_filas(filas_df[filas_df['RACEID'].isin(race_ids_bloque)])
+        return {
+            'ultimas_pilotos': ultimas_pilotos,
+            'ultimas_constructores': ultimas_constructores,
+            'ultimas_circuitos': ultimas_circuitos,
+            'wins_by_race': wins_by_race[wins_by_race['raceId'].isin(race_ids_bloque)],
+            'constructor_wins': constructor_wins[constructor_wins['raceId'].isin(race_ids_bloque)],
+            'first_race': first_race,
+        }
+
+    temporadas = []
+    estado = (estado_pilotos, estado_constructores, estado_circuitos)
+    for _, carreras_temporada in carreras.groupby(temporada):
+        ids = carreras_temporada['raceId']
+        temporadas.append((carreras_temporada['YEAR'].iloc[0], ids.tolist(), estado[0], estado[1]))
+        estado = estado_tras_bloque(*estado, resumen(ids))
+
+    # El estado final se calcula de una vez, como sin temporadas: en la cadena, los pilotos
+    # que aún no han corrido quedan con nulos y cambiarían los tipos de las columnas
+    estado_final = estado_tras_bloque(estado_pilotos, estado_constructores, estado_circuitos, resumen(race_ids))
+    return temporadas, estado_final
+
+
+def calcular_temporada(directorio, opciones, race_ids, estado_pilotos, estado_constructores, cache_dir=None):
+    """
+    calcular_bloque de una temporada en un proceso del pool, en la carpeta de
+    trabajo directorio y sin sus mensajes por pantalla (con la caché de etapas
+    de cache_dir, si no es None); devuelve sus filas y el registro de la caché.
+    """
+    os.chdir(directorio)
+    cache = CacheEtapas(cache_dir) if cache_dir is not None else None
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        bloque = calcular_bloque(**opciones, estado_pilotos=estado_pilotos, estado_constructores=estado_constructores,
+                                 race_ids=race_ids, cache_etapas=cache)
+    return None if bloque is None else bloque['filas'], cache.registro if cache is not None else []
+
+
+def generar_dataset_f1_completo(min_year=2014, process_from_year=2001, max_vueltas_perdidas=4, perdida_por_circuito=None,
+                                incremental=False, clima_ventanas=False, paradas=False, forma=False, perfil=None,
+                                n_jobs=1, formato='csv', cache_etapas=None, motor='pandas'):
+    """
+    Carga, fusiona, reorganiza y filtra los datos de F1 a partir de un año específico.
+
+    Además del dataset guarda un estado por piloto, constructor y circuito
+    (última posición, puntos, victorias acumuladas, año de debut, vueltas),
+    que también usa entry.py para predecir la carrera siguiente. Con incremental=True
+    se parte del dataset y el estado ya guardados y solo se calculan y añaden
+    las carreras con raceId posterior a la última del dataset; el resultado es
+    idéntico al de una reconstrucción completa con los mismos parámetros.
+
+    Con n_jobs distinto de 1 se calcula primero el estado al empezar cada
+    temporada (estados_por_temporada, sin features) y después las filas de las
+    temporadas desde min_year en un pool de procesos; las anteriores solo
+    cuentan para el estado. El resultado también es idéntico.
+
+    Con cache_etapas, las etapas de calcular_bloque cuyo código, datos de
+    entrada y parámetros no cambiaron se leen de la caché en lugar de
+    calcularse (ver etapas.py); la escritura y el estado se hacen siempre.
+
+    Con motor='sql' las filas se calculan con consultas sobre una base de
+    datos SQLite con las tablas de f1_data (ver motor_sql.py), con el mismo
+    resultado; solo para reconstrucciones completas en un proceso, sin
+    paradas ni forma.
+
+    Parámetros:
+        min_year (int): El año mínimo (inclusive) para el filtrado de carreras.
+        process_from_year (int): Año mínimo de datos cargados para los cálculos históricos.
+        max_vueltas_perdidas (int): Máximo N de '+N Laps' para el que se imputa MS RACE.
+        perdida_por_circuito (dict): Opcional, {circuitId: pérdida en ms por vuelta} en lugar de 7000.
+        incremental (bool): Añadir solo las carreras nuevas al dataset existente.
+        clima_ventanas (bool): Añadir las features meteorológicas de las ventanas de
+            carrera y clasificación (COLUMNAS_VENTANAS), calculadas desde el almacén horario.
+        paradas (bool): Añadir las features de paradas en boxes (COLUMNAS_PARADAS de paradas.py).
+        forma (bool): Añadir las features de forma reciente (COLUMNAS_FORMA de forma.py).
+        perfil (RegistroEtapas): Opcional, registro donde anotar tiempo, memoria y
+            filas de cada etapa (carga, fusiones, ..., escritura, estado).
+        n_jobs (int): Procesos para las temporadas (1: sin pool, -1: todos los núcleos);
+            se limita a los núcleos y al número de temporadas, y si queda en un proceso no se crea el pool.
+        formato (str): Formato del dataset: 'csv', 'csv.gz' o 'parquet' (ver datos.guardar_dataset).
+        cache_etapas (CacheEtapas): Opcional, caché de las etapas; su registro
+            anota qué etapas se calcularon y cuáles se leyeron.
+        motor (str): 'pandas' o 'sql' (MOTORES_DATASET).
+    """
+    if motor not in MOTORES_DATASET:
+        raise ValueError(f"Motor desconocido: {motor} (opciones: {', '.join(MOTORES_DATASET)})")
+    n_jobs = min(effective_n_jobs(n_jobs), cpu_count())
+    if motor == 'sql' and (incremental or n_jobs != 1 or paradas or forma):
+        raise ValueError("El motor SQL solo hace reconstrucciones completas en un proceso, sin paradas ni forma.")
+    if perfil is None:
+        perfil = RegistroEtapas()
+
+    # --- 1. Definición de Archivos y Delimitadores ---
+    # Las tablas de f1_data se leen con leer_tabla (datos.py), desde su caché columnar
+    OUTPUT_FILE = f'f1_training_data_{min_year}_onwards.{formato}'
+
+    # Columnas finales requeridas: features del modelo y variable objetivo
+    COLUMNAS_FINALES = columnas_finales(clima_ventanas, paradas, forma)
+
+    opciones = {
+        'min_year': min_year,
+        'process_from_year': process_from_year,
+        'max_vueltas_perdidas': max_vueltas_perdidas,
+        'perdida_por_circuito': perdida_por_circuito,
+        'clima_ventanas': clima_ventanas,
+        'paradas': paradas,
+        'forma': forma,
+    }
+
+    # --- 2. Cargar y Preparar DataFrames ---
+
+    print("Iniciando la carga y preparación de datos...")
+
+    # Modo incremental: dataset y estado de la última ejecución
+    estado_pilotos = None
+    estado_constructores = None
+    estado_circuitos = None
+    ultima_carrera = 0
+    if incremental:
+        existente_df = leer_dataset(OUTPUT_FILE)
+        estado_pilotos, estado_constructores, estado_circuitos = cargar_estado(min_year)
+        if list(existente_df.columns) != COLUMNAS_FINALES:
+            raise ValueError(f"{OUTPUT_FILE} no tiene las columnas de esta configuración (clima_ventanas={clima_ventanas}, "
+                             f"paradas={paradas}, forma={forma}); hay que reconstruirlo sin incremental.")
+        ultima_carrera = existente_df['RACEID'].max()
+        print(f"Modo incremental: procesando carreras posteriores a raceId {ultima_carrera}...")
+
+    # Como mucho un proceso por núcleo y por temporada pendiente; con uno solo, sin pool
+    if n_jobs > 1:
+        races_df = leer_tabla('races', ['raceId', 'year'], desde_year=min_year)
+        n_jobs = max(1, min(n_jobs, races_df.loc[races_df['raceId'] > ultima_carrera, 'year'].nunique()))
+
+    if motor == 'sql':
+        bloque = calcular_bloque_sql(min_year, process_from_year, max_vueltas_perdidas, perdida_por_circuito,
+                                     clima_ventanas, perfil=perfil)
+        if bloque is None:
+            print("\nNo hay carreras con resultados.")
+            return
+        final_df = bloque['filas']
+    elif n_jobs == 1:
+        bloque = calcular_bloque(**opciones, estado_pilotos=estado_pilotos, estado_constructores=estado_constructores,
+                                 ultima_carrera=ultima_carrera, perfil=perfil, cache_etapas=cache_etapas)
+        if bloque is None:
+            print("\nNo hay carreras nuevas con resultados; el dataset ya está al día.")
+            return
+        final_df = bloque['filas']
+    else:
+        with perfil.etapa('estado_temporadas') as etapa:
+            # Cachés al día antes de repartir: los procesos solo las leen
+            for tabla in TABLAS_BLOQUE:
+                actualizar_cache(tabla)
+            temporadas, estado_final = estados_por_temporada(process_from_year, estado_pilotos, estado_constructores,
+                                                             estado_circuitos, ultima_carrera)
+            etapa['filas'] = len(temporadas)
+        if not temporadas:
+            print("\nNo hay carreras nuevas con resultados; el dataset ya está al día.")
+            return
+
+        with perfil.etapa('temporadas') as etapa:
+            # Solo las temporadas desde min_year tienen filas en el dataset
+            temporadas = [temporada for temporada in temporadas if temporada[0] >= min_year]
+            print(f"Calculando {len(temporadas)} temporadas en paralelo...")
+            bloques = Parallel(n_jobs=min(n_jobs, len(temporadas)))(
+                delayed(calcular_temporada)(os.getcwd(), opciones, ids, semilla_pilotos, semilla_constructores,
+                                            cache_etapas.directorio if cache_etapas is not None else None)
+                for _, ids, semilla_pilotos, semilla_constructores in temporadas
+            )
+            if cache_etapas is not None:
+                cache_etapas.registro.extend(fila for _, registro in bloques for fila in registro)
+            bloques = [filas for filas, _ in bloques]
+            # Las temporadas van en orden de raceId, así que las filas quedan en el mismo orden que sin pool
+            bloques = [filas for filas in bloques if filas is not None]
+            final_df = pd.concat(bloques, ignore_index=True) if bloques else pd.DataFrame(columns=COLUMNAS_FINALES)
+            etapa['filas'] = len(final_df)
 
     # --- 7. Guardar el Resultado Final ---
-    print(f"Guardando el dataset final completado en {OUTPUT_FILE}...")
-    final_df.to_csv(OUTPUT_FILE, index=False)
+    with perfil.etapa('escritura') as etapa:
+        if incremental:
+            print(f"Añadiendo {final_df.shape[0]} filas nuevas a {OUTPUT_FILE}...")
+            # Con los tipos de ESQUEMA_DATASET el formato no cambia: basta con añadir las filas al final
+            guardar_dataset(final_df, OUTPUT_FILE, anadir=True)
+        else:
+            print(f"Guardando el dataset final completado en {OUTPUT_FILE}...")
+            guardar_dataset(final_df, OUTPUT_FILE)
+        etapa['filas'] = len(final_df)
+
+    with perfil.etapa('estado') as etapa:
+        # Guardar el estado por piloto, constructor y circuito para la próxima ejecución incremental y para entry.py
+        if motor == 'sql' or n_jobs == 1:
+            estado_final = estado_tras_bloque(estado_pilotos, estado_constructores, estado_circuitos, bloque)
+        guardar_estado(min_year, *estado_final)
+        etapa['filas'] = sum(len(estado) for estado in estado_final)
+
+    if cache_etapas is not None:
+        cache_etapas.podar()
 
     print("\n✅ ¡Proceso de generación de dataset completado!")
     print(f"Dataset generado con {final_df.shape[0]} filas y {final_df.shape[1]} columnas.")
 
 
 # Ejecutar la función principal para generar el dataset
-generar_dataset_f1_completo(min_year=2014)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera el dataset de entrenamiento de F1.")
+    parser.add_argument('--min-year', type=int, default=2014, help="Año mínimo de las carreras del dataset.")
+    parser.add_argument('--process-from-year', type=int, default=2001,
+                        help="Año mínimo de los datos para las features históricas (1950: todo el histórico).")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Añadir solo las carreras nuevas usando el dataset y el estado guardados.")
+    parser.add_argument('--clima-ventanas', action='store_true',
+                        help="Añadir el clima de las ventanas de carrera y clasificación (requiere el almacén horario).")
+    parser.add_argument('--paradas', action='store_true',
+                        help="Añadir las features de paradas en boxes de las carreras anteriores (pit_stops.csv).")
+    parser.add_argument('--forma', action='store_true',
+                        help="Añadir las features de forma reciente (posición media, mejor resultado en el circuito...).")
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help="Procesos para calcular las temporadas en paralelo (1: sin pool, -1: todos los núcleos).")
+    parser.add_argument('--formato', choices=['csv', 'csv.gz', 'parquet'], default='csv',
+                        help="Formato del dataset (el estado se guarda siempre en CSV).")
+    parser.add_argument('--profile', nargs='?', const=PERFIL_FILE, default=None, metavar='JSON',
+                        help=f"Guardar tiempo, pico de memoria y filas por etapa (por defecto en {PERFIL_FILE}).")
+    parser.add_argument('--cprofile', action='store_true',
+                        help="Con --profile, guardar también un perfil de cProfile por etapa (.prof).")
+    parser.add_argument('--sin-cache-etapas', action='store_true',
+                        help=f"Calcular todas las etapas sin leer ni guardar sus resultados en {CACHE_ETAPAS_DIR}.")
+    parser.add_argument('--motor', choices=MOTORES_DATASET, default='pandas',
+                        help=f"Calcular las filas con pandas o con consultas SQL sobre {SQL_FILE} (SQLite); "
+                             "el resultado es el mismo.")
+    parser.add_argument('--explain', action='store_true',
+                        help="Mostrar qué etapas se calcularon o se leyeron de la caché y el tiempo ahorrado.")
+    args = parser.parse_args()
+
+    perfil = RegistroEtapas(cprofile=args.cprofile, prefijo_cprofile=os.path.splitext(args.profile or PERFIL_FILE)[0])
+    cache_etapas = None if args.sin_cache_etapas or args.motor == 'sql' else CacheEtapas()
+    generar_dataset_f1_completo(min_year=args.min_year, process_from_year=args.process_from_year,
+                                incremental=args.incremental, clima_ventanas=args.clima_ventanas,
+                                paradas=args.paradas, forma=args.forma, perfil=perfil, n_jobs=args.n_jobs,
+                                formato=args.formato, cache_etapas=cache_etapas, motor=args.motor)
+    if args.explain and cache_etapas is not None:
+        print(f"\n{cache_etapas.tabla()}")
+    if args.profile:
+        perfil.guardar(args.profile, funcion='generar_dataset_f1_completo', parametros=vars(args))
+        print(f"\n{perfil.tabla()}\n\nPerfil guardado en {args.profile}")
@@ -0,0 +1,421 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from clima import COLUMNAS_VENTANAS
+from entry import construir_filas_carreras
+from features import cargar_estado, ultima_carrera_estado
+from forma import COLUMNAS_FORMA
+from modelo import MODEL_FILE, cargar_modelo
+from paradas import COLUMNAS_PARADAS
+
+# Solo se escucha en la máquina local: el servicio no tiene autenticación
+SERVICIO_HOST = '127.0.0.1'
+SERVICIO_PUERTO = 8765
+
+# Micro-lotes: las peticiones que llegan mientras se espera al primer hueco se
+# predicen juntas, hasta MAX_FILAS_LOTE filas o ESPERA_LOTE_MS desde la primera
+MAX_FILAS_LOTE = 4096
+ESPERA_LOTE_MS = 2.0
+
+# Peticiones y lotes recientes con los que se calculan los percentiles de /metricas
+VENTANA_METRICAS = 10000
+
+COLUMNAS_ID = ['RACEID', 'DRIVERID', 'CONSTRUCTORID']
+
+
+class MetricasServicio:
+    """
+    Métricas de latencia y rendimiento del servicio, seguras entre hilos.
+
+    Guarda las VENTANA_METRICAS últimas peticiones (latencia y filas) y lotes
+    (filas, peticiones y tiempo de predict) y los totales desde el arranque.
+    """
+
+    def __init__(self, ventana=VENTANA_METRICAS):
+        self.lock = threading.Lock()
+        self.inicio = time.perf_counter()
+        self.latencias = deque(maxlen=ventana)
+        self.lotes = deque(maxlen=ventana)
+        self.peticiones = 0
+        self.errores = 0
+        self.filas = 0
+
+    def registrar_peticion(self, segundos, filas, error=False):
+        with self.lock:
+            self.peticiones += 1
+            self.errores += int(error)
+            if not error:
+                self.filas += filas
+                self.latencias.append(segundos)
+
+    def registrar_lote(self, filas, peticiones, segundos):
+        with self.lock:
+            self.lotes.append((filas, peticiones, segundos))
+
+    def resumen(self):
+        """
+        Devuelve:
+            dict: Peticiones, errores y filas totales, peticiones y filas por segundo
+                desde el arranque, latencia (media, p50, p95, p99 y máxima, en ms) y
+                lotes (número, peticiones y filas medias por lote, ms de predict).
+        """
+        with self.lock:
+            latencias = np.array(self.latencias) * 1000
+            lotes = np.array(self.lotes).reshape(-1, 3)
+            segundos = time.perf_counter() - self.inicio
+            resumen = {
+                'peticiones': self.peticiones,
+                'errores': self.errores,
+                'filas': self.filas,
+                'segundos': round(segundos, 3),
+                'peticiones_por_segundo': round(self.peticiones / segundos, 2),
+                'filas_por_segundo': round(self.filas / segundos, 2),
+            }
+        if len(latencias):
+            p50, p95, p99 = np.percentile(latencias, [50, 95, 99])
+            resumen['latencia_ms'] = {'media': round(latencias.mean(), 3), 'p50': round(p50, 3), 'p95': round(p95, 3),
+                                      'p99': round(p99, 3), 'max': round(latencias.max(), 3)}
+        if len(lotes):
+            resumen['lotes'] = {'numero': len(lotes), 'filas_media': round(lotes[:, 0].mean(), 2),
+                                'peticiones_media': round(lotes[:, 1].mean(), 2),
+                                'predict_ms_media': round(lotes[:, 2].mean() * 1000, 3)}
+        return resumen
+
+
+class LotesPrediccion:
+    """
+    Agrupa las peticiones concurrentes en micro-lotes con una sola llamada a predict.
+
+    Un hilo toma la primera petición pendiente, espera hasta espera_ms (o hasta
+    reunir max_filas filas) a las que lleguen mientras tanto, concatena sus filas,
+    llama una vez a predecir y reparte el resultado. Así predict solo se llama
+    desde un hilo y su coste fijo (validación, pipeline) se paga una vez por lote.
+
+    Cada petición lleva el modelo con el que se construyó su matriz: un lote se
+    predice en grupos por modelo, así que tras una recarga no se mezclan. Si la
+    llamada de un grupo falla, se repite petición a petición y solo reciben el
+    error las que fallan por sí mismas.
+
+    Parámetros:
+        predecir (callable): Recibe (modelo, matriz de filas x columnas) y devuelve un array con una predicción por fila.
+        max_filas (int): Filas máximas por lote (con 1, cada petición es su propio lote).
+        espera_ms (float): Espera máxima desde la primera petición del lote.
+        metricas (MetricasServicio): Opcional, donde se registra cada lote.
+    """
+
+    def __init__(self, predecir, max_filas=MAX_FILAS_LOTE, espera_ms=ESPERA_LOTE_MS, metricas=None):
+        self.predecir = predecir
+        self.max_filas = max_filas
+        self.espera = espera_ms / 1000
+        self.metricas = metricas
+        self.cola = queue.Queue()
+        self.hilo = threading.Thread(target=self.bucle, daemon=True)
+        self.hilo.start()
+
+    def enviar(self, X, modelo=None):
+        """Encola la matriz de filas X del modelo dado; devuelve un Future con su array de predicciones."""
+        futuro = Future()
+        self.cola.put((modelo, X, futuro))
+        return futuro
+
+    def cerrar(self):
+        self.cola.put(None)
+        self.hilo.join()
+
+    def bucle(self):
+        while True:
+            pendiente = self.cola.get()
+            if pendiente is None:
+                return
+            lote = [pendiente]
+            filas = len(pendiente[1])
+            limite = time.perf_counter() + self.espera
+            while filas < self.max_filas:
+                restante = limite - time.perf_counter()
+                try:
+                    pendiente = self.cola.get(timeout=restante) if restante > 0 else self.cola.get_nowait()
+                except queue.Empty:
+                    break
+                if pendiente is None:
+                    # Cerrar después de responder a este lote
+                    self.cola.put(None)
+                    break
+                lote.append(pendiente)
+                filas += len(pendiente[1])
+            self.predecir_lote(lote)
+
+    def predecir_lote(self, lote):
+        # Un grupo por modelo, en orden de llegada
+        grupos = {}
+        for pendiente in lote:
+            grupos.setdefault(id(pendiente[0]), []).append(pendiente)
+        for grupo in grupos.values():
+            self.predecir_grupo(grupo)
+
+    def predecir_grupo(self, grupo):
+        inicio = time.perf_counter()
+        try:
+            X = grupo[0][1] if len(grupo) == 1 else np.concatenate([X for _, X, _ in grupo])
+            predicciones = self.predecir(grupo[0][0], X)
+        except Exception as error:
+            if len(grupo) == 1:
+                grupo[0][2].set_exception(error)
+            else:
+                # Las filas inválidas de una petición no deben tumbar a las demás
+                for pendiente in grupo:
+                    self.predecir_grupo([pendiente])
+            return
+        if self.metricas is not None:
+            self.metricas.registrar_lote(len(X), len(grupo), time.perf_counter() - inicio)
+        cortes = np.cumsum([len(X) for _, X, _ in grupo])[:-1]
+        for (_, _, futuro), parte in zip(grupo, np.split(predicciones, cortes)):
+            futuro.set_result(parte)
+
+
+class ServicioPrediccion:
+    """
+    Modelo y estado en memoria para predecir carreras bajo demanda.
+
+    Carga una vez el artefacto de modelo.py y el estado de pilotos,
+    constructores y circuitos de script_carga.py; las filas de cada carrera
+    pedida por raceId se construyen una vez (entry.construir_filas_carreras) y
+    se guardan hasta recargar(). Las predicciones pasan por LotesPrediccion.
+
+    Cada petición solo convierte sus filas a una matriz de floats en el orden
+    de las columnas del modelo; el DataFrame que espera el Pipeline se crea una
+    vez por lote, en el hilo de LotesPrediccion.
+
+    Cada petición toma al empezar una instantánea del modelo, el estado y sus
+    cachés (instantanea), y su matriz se predice con ese mismo modelo aunque
+    entretanto llegue un /recargar.
+
+    Parámetros:
+        model_file (str): Modelo guardado por modelo.py entrenar.
+        min_year (int): Año mínimo del dataset cuyo estado se usa.
+        descargar_clima (bool): Descargar los días que falten en el almacén horario.
+        max_filas_lote, espera_lote_ms: Ver LotesPrediccion.
+    """
+
+    def __init__(self, model_file=MODEL_FILE, min_year=2014, descargar_clima=True, max_filas_lote=MAX_FILAS_LOTE,
+                 espera_lote_ms=ESPERA_LOTE_MS):
+        self.model_file = model_file
+        self.min_year = min_year
+        self.descargar_clima = descargar_clima
+        self.lock = threading.Lock()
+        self.metricas = MetricasServicio()
+        self.recargar()
+        self.lotes = LotesPrediccion(self.predecir_matriz, max_filas_lote, espera_lote_ms, self.metricas)
+
+    def recargar(self):
+        """Vuelve a leer el modelo y el estado (p. ej. tras script_carga.py --incremental)."""
+        artefacto = cargar_modelo(self.model_file)
+        estados = cargar_estado(self.min_year)
+        with self.lock:
+            self.artefacto, self.estados, self.carreras, self.matrices = artefacto, estados, {}, {}
+
+    def instantanea(self):
+        """(artefacto, estados, carreras, matrices) de la misma recarga, leídos a la vez."""
+        with self.lock:
+            return self.artefacto, self.estados, self.carreras, self.matrices
+
+    @staticmethod
+    def predecir_matriz(artefacto, X):
+        """log1p(MS RACE) predicho por artefacto para una matriz con sus columnas."""
+        return artefacto['pipeline'].predict(pd.DataFrame(X, columns=artefacto['columnas']))
+
+    def ultima_carrera(self):
+        estado_pilotos, estado_constructores, _ = self.estados
+        return ultima_carrera_estado(estado_pilotos, estado_constructores)
+
+    def filas_carrera(self, race_id, instantanea=None):
+        """Filas de entrada de una carrera sin resultados, construidas una vez por estado."""
+        artefacto, estados, carreras, _ = instantanea or self.instantanea()
+        with self.lock:
+            if race_id not in carreras:
+                # construir_filas_carreras rechaza las carreras ya incluidas en el estado
+                columnas = artefacto['columnas']
+                carreras[race_id] = construir_filas_carreras(
+                    [race_id], *estados, descargar_clima=self.descargar_clima,
+                    clima_ventanas=COLUMNAS_VENTANAS[0] in columnas, paradas=COLUMNAS_PARADAS[0] in columnas,
+                    forma=COLUMNAS_FORMA[0] in columnas)
+            return carreras[race_id]
+
+    def matriz_carrera(self, race_id, instantanea=None):
+        """Matriz de features e ids (listas) de una carrera, como matriz_filas."""
+        instantanea = instantanea or self.instantanea()
+        artefacto, _, _, matrices = instantanea
+        with self.lock:
+            if race_id in matrices:
+                return matrices[race_id]
+        filas = self.filas_carrera(race_id, instantanea)
+        matriz = (filas[artefacto['columnas']].to_numpy(dtype=float), {col: filas[col].tolist() for col in COLUMNAS_ID})
+        # En las cachés de la instantánea: si entretanto se ha recargado, se descarta con ellas
+        with self.lock:
+            return matrices.setdefault(race_id, matriz)
+
+    def matriz_filas(self, filas, artefacto=None):
+        """
+        Matriz de features (filas x columnas del modelo) e ids de filas recibidas como dicts.
+
+        Los valores nulos solo se admiten con el motor 'hist', que los trata de
+        forma nativa; con 'gbr' (y los infinitos con cualquier motor) son un error
+        de la petición.
+
+        Devuelve:
+            tuple: (matriz, ids), con ids {columna: lista} de las de COLUMNAS_ID presentes en todas las filas.
+        """
+        artefacto = artefacto or self.instantanea()[0]
+        columnas = artefacto['columnas']
+        faltan = [col for col in columnas if not all(col in fila for fila in filas)]
+        if faltan:
+            raise ValueError(f"Faltan columnas del modelo: {faltan}")
+        try:
+            matriz = np.array([[fila[col] for col in columnas] for fila in filas], dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError("Las columnas del modelo deben ser numéricas (o null con el motor 'hist').") from None
+        invalidos = ~np.isfinite(matriz)
+        if artefacto['motor'] == 'hist':
+            invalidos &= ~np.isnan(matriz)
+        if invalidos.any():
+            raise ValueError(f"Valores nulos o no finitos en {sorted({columnas[j] for j in np.nonzero(invalidos)[1]})}; "
+                             f"el motor '{artefacto['motor']}' no los admite.")
+        ids = {col: [fila[col] for fila in filas] for col in COLUMNAS_ID if all(col in fila for fila in filas)}
+        return matriz, ids
+
+    def predecir(self, race_id=None, filas=None):
+        """
+        Predice una carrera por su raceId o un conjunto de filas de features.
+
+        Parámetros:
+            race_id (int): Carrera sin resultados (con qualifying).
+            filas (list): Alternativa a race_id, filas como dicts con las columnas del
+                modelo (las de entry.py); RACEID, DRIVERID y CONSTRUCTORID son opcionales.
+
+        Devuelve:
+            list: Un dict por fila con los ids presentes, PREDICTED MS RACE y PREDICTED POSITION
+                (dentro de cada RACEID, o entre todas las filas si no hay RACEID), ordenado por carrera y posición.
+        """
+        instantanea = self.instantanea()
+        if race_id is not None:
+            matriz, ids = self.matriz_carrera(int(race_id), instantanea)
+        elif filas:
+            matriz, ids = self.matriz_filas(filas, instantanea[0])
+        else:
+            raise ValueError("La petición necesita 'race_id' o 'filas'.")
+        tiempos = np.expm1(self.lotes.enviar(matriz, instantanea[0]).result())
+
+        # Orden por (carrera, tiempo); lexsort es estable, como rank(method='first')
+        carreras = np.asarray(ids.get('RACEID', np.zeros(len(tiempos))))
+        orden = np.lexsort((tiempos, carreras))
+        nueva = np.r_[True, carreras[orden][1:] != carreras[orden][:-1]]
+        posiciones = np.arange(len(orden)) - np.maximum.accumulate(np.where(nueva, np.arange(len(orden)), 0)) + 1
+        return [{**{col: valores[i] for col, valores in ids.items()},
+                 'PREDICTED MS RACE': float(tiempos[i]), 'PREDICTED POSITION': int(posicion)}
+                for i, posicion in zip(orden.tolist(), posiciones.tolist())]
+
+    def cerrar(self):
+        self.lotes.cerrar()
+
+
+class ManejadorPrediccion(BaseHTTPRequestHandler):
+    """
+    Rutas del servicio (JSON):
+
+    - GET /salud: modelo y última carrera del estado.
+    - GET /metricas: MetricasServicio.resumen().
+    - POST /predecir: {"race_id": 1168} o {"filas": [{...}, ...]} -> {"prediccion": [...]}.
+    - POST /recargar: vuelve a leer el modelo y el estado.
+    """
+
+    def responder(self, codigo, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        servicio = self.server.servicio
+        if self.path == '/salud':
+            self.responder(200, {'estado': 'ok', 'modelo': servicio.model_file, 'motor': servicio.artefacto['motor'],
+                                 'ultima_carrera': servicio.ultima_carrera()})
+        elif self.path == '/metricas':
+            self.responder(200, servicio.metricas.resumen())
+        else:
+            self.responder(404, {'error': f"Ruta desconocida: {self.path}"})
+
+    def do_POST(self):
+        servicio = self.server.servicio
+        inicio = time.perf_counter()
+        try:
+            cuerpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path == '/predecir':
+                prediccion = servicio.predecir(cuerpo.get('race_id'), cuerpo.get('filas'))
+                self.responder(200, {'prediccion': prediccion})
+                servicio.metricas.registrar_peticion(time.perf_counter() - inicio, len(prediccion))
+            elif self.path == '/recargar':
+                servicio.recargar()
+                self.responder(200, {'estado': 'ok', 'ultima_carrera': servicio.ultima_carrera()})
+            else:
+                self.responder(404, {'error': f"Ruta desconocida: {self.path}"})
+        except (ValueError, KeyError) as error:
+            servicio.metricas.registrar_peticion(time.perf_counter() - inicio, 0, error=True)
+            self.responder(400, {'error': str(error)})
+        except Exception as error:
+            servicio.metricas.registrar_peticion(time.perf_counter() - inicio, 0, error=True)
+            self.responder(500, {'error': f"{type(error).__name__}: {error}"})
+
+    def log_message(self, formato, *args):
+        # Sin una línea por petición: el seguimiento está en /metricas
+        pass
+
+
+class ServidorPrediccion(ThreadingHTTPServer):
+    """Servidor HTTP con un hilo por conexión."""
+    daemon_threads = True
+    # Cola de conexiones pendientes: con la de socketserver (5), las ráfagas de
+    # clientes concurrentes esperan al reintento de conexión de TCP (1 s)
+    request_queue_size = 128
+
+
+def crear_servidor(servicio, host=SERVICIO_HOST, puerto=SERVICIO_PUERTO):
+    """ServidorPrediccion para servicio (puerto=0: uno libre, en servidor.server_address)."""
+    servidor = ServidorPrediccion((host, puerto), ManejadorPrediccion)
+    servidor.servicio = servicio
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servicio local de predicción de carreras con micro-lotes.")
+    parser.add_argument('--modelo', default=MODEL_FILE, help="Ruta del modelo guardado.")
+    parser.add_argument('--host', default=SERVICIO_HOST, help="Dirección de escucha.")
+    parser.add_argument('--puerto', type=int, default=SERVICIO_PUERTO, help="Puerto de escucha.")
+    parser.add_argument('--max-filas-lote', type=int, default=MAX_FILAS_LOTE,
+                        help="Filas máximas por llamada a predict (1: sin micro-lotes).")
+    parser.add_argument('--espera-lote-ms', type=float, default=ESPERA_LOTE_MS,
+                        help="Espera máxima para reunir un micro-lote.")
+    parser.add_argument('--sin-descarga', action='store_true', help="Usar solo el clima que ya está en el almacén horario.")
+    args = parser.parse_args()
+
+    servicio = ServicioPrediccion(args.modelo, descargar_clima=not args.sin_descarga,
+                                  max_filas_lote=args.max_filas_lote, espera_lote_ms=args.espera_lote_ms)
+    servidor = crear_servidor(servicio, args.host, args.puerto)
+    print(f"Servicio de predicción en http://{args.host}:{servidor.server_address[1]} "
+          f"(modelo {args.modelo}, última carrera {servicio.ultima_carrera()})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servicio.cerrar()
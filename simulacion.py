@@ -0,0 +1,261 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from busqueda import divisiones_temporada
+from clima import COLUMNAS_VENTANAS
+from datos import leer_dataset, leer_tabla
+from entry import construir_filas_carreras
+from features import calcular_posicion_companero, cargar_estado
+from forma import COLUMNAS_FORMA
+from modelo import DATASET_FILE, MODEL_FILE, OBJETIVO, cargar_modelo
+from paradas import COLUMNAS_PARADAS
+
+# Puntos por posición (sistema actual, sin vuelta rápida ni sprint)
+PUNTOS = np.array([25, 18, 15, 12, 10, 8, 6, 4, 2, 1])
+
+
+def construir_filas(race_ids, artefacto, min_year=2014, descargar_clima=True):
+    """
+    Filas de entrada de varias carreras desde el estado guardado, con las
+    columnas que espera el modelo (con o sin ventanas de clima, paradas en boxes y forma reciente).
+
+    Devuelve:
+        tuple: (filas, estados), con filas el DataFrame de construir_filas_carreras
+            ordenado por RACEID y estados la tupla de cargar_estado.
+    """
+    estados = cargar_estado(min_year)
+    clima_ventanas = COLUMNAS_VENTANAS[0] in artefacto['columnas']
+    paradas = COLUMNAS_PARADAS[0] in artefacto['columnas']
+    forma = COLUMNAS_FORMA[0] in artefacto['columnas']
+    filas = construir_filas_carreras(race_ids, *estados, clima_ventanas=clima_ventanas,
+                                     descargar_clima=descargar_clima, paradas=paradas, forma=forma)
+    filas = filas.sort_values('RACEID', kind='stable').reset_index(drop=True)
+    return filas, estados
+
+
+def predecir_carreras(race_ids, artefacto, min_year=2014, descargar_clima=True):
+    """
+    Predice varias carreras sin resultados con una sola llamada a predict.
+
+    Todas las carreras se predicen desde el mismo estado (el de la última
+    carrera procesada por script_carga.py); para encadenarlas usar simular_temporada.
+
+    Parámetros:
+        race_ids (list): Carreras a predecir (deben tener qualifying).
+        artefacto (dict): Modelo devuelto por modelo.cargar_modelo.
+        min_year (int): Año mínimo del dataset cuyo estado se usa.
+        descargar_clima (bool): Descargar los días que falten en el almacén horario.
+
+    Devuelve:
+        DataFrame: RACEID, DRIVERID, CONSTRUCTORID, PREDICTED MS RACE y PREDICTED POSITION
+            (dentro de cada carrera), ordenado por carrera y posición predicha.
+    """
+    filas, _ = construir_filas(race_ids, artefacto, min_year, descargar_clima)
+    prediccion = filas[['RACEID', 'DRIVERID', 'CONSTRUCTORID']].copy()
+    prediccion['PREDICTED MS RACE'] = np.expm1(artefacto['pipeline'].predict(filas[artefacto['columnas']]))
+    prediccion['PREDICTED POSITION'] = prediccion.groupby('RACEID')['PREDICTED MS RACE'].rank(method='first').astype(int)
+    return prediccion.sort_values(['RACEID', 'PREDICTED POSITION']).reset_index(drop=True)
+
+
+def residuos_modelo(artefacto, dataset_file=DATASET_FILE, n_temporadas=3):
+    """
+    Residuos de log1p(MS RACE) fuera de muestra, para el muestreo de simular_temporada.
+
+    Los residuos del modelo sobre sus propios datos de entrenamiento subestiman
+    la dispersión (y P WIN / P CHAMPION saldrían demasiado seguras), así que se
+    reajusta una copia del pipeline con las divisiones de busqueda.divisiones_temporada
+    (años anteriores a Y) y se toman los residuos sobre cada temporada Y, como
+    al predecir una temporada que el modelo no ha visto.
+
+    Parámetros:
+        artefacto (dict): Modelo devuelto por modelo.cargar_modelo (se copian su pipeline y parámetros).
+        dataset_file (str): Dataset de entrenamiento del modelo.
+        n_temporadas (int): Últimas temporadas de las que se toman residuos.
+
+    Devuelve:
+        ndarray: Residuos de las n_temporadas últimas temporadas.
+    """
+    from sklearn.base import clone
+
+    columnas = artefacto['columnas']
+    df = leer_dataset(dataset_file, columnas=list(dict.fromkeys(columnas + [OBJETIVO, 'YEAR'])))
+    y = np.log1p(df[OBJETIVO].to_numpy())
+    residuos = []
+    for _, entrenamiento, validacion in divisiones_temporada(df, n_temporadas=n_temporadas, holdout=0):
+        pipeline = clone(artefacto['pipeline']).fit(df.loc[entrenamiento, columnas], y[entrenamiento])
+        residuos.append(y[validacion] - pipeline.predict(df.loc[validacion, columnas]))
+    return np.concatenate(residuos)
+
+
+def indices_estado(claves, estado, columnas, defecto):
+    """Valores iniciales del estado para las claves dadas, como arrays (NaN -> defecto[columna])."""
+    valores = estado.reindex(claves)
+    return {col: valores[col].fillna(defecto[col]).to_numpy(dtype=float) for col in columnas}
+
+
+def simular_temporada(race_ids, artefacto, n_simulaciones=1000, semilla=42, residuos=None, min_year=2014,
+                      descargar_clima=True):
+    """
+    Simulación Monte Carlo de varias carreras seguidas desde el estado guardado.
+
+    Las features que no dependen de resultados (qualifying, clima, edad...) se
+    construyen una sola vez. El estado de pilotos y constructores (última
+    posición, puntos, victorias y su temporada) se guarda en arrays
+    (simulaciones x pilotos) y se actualiza carrera a carrera con las mismas
+    reglas que features.actualizar_estado, así que cada carrera es una única
+    llamada a predict sobre simulaciones x pilotos filas, sin un DataFrame por
+    simulación.
+
+    El tiempo de cada piloto es la predicción más un residuo de log1p(MS RACE)
+    muestreado con reemplazo de residuos; las posiciones salen de ordenar los
+    tiempos y los puntos de PUNTOS (las sprints no se simulan).
+
+    Parámetros:
+        race_ids (list): Carreras a simular, en orden (deben tener qualifying).
+        artefacto (dict): Modelo devuelto por modelo.cargar_modelo.
+        n_simulaciones (int): Temporadas simuladas.
+        semilla (int): Semilla del generador aleatorio.
+        residuos (array): Residuos a muestrear; por defecto residuos_modelo(artefacto)
+            (fuera de muestra, por temporada).
+            Con np.zeros(1) la simulación es determinista.
+        min_year (int): Año mínimo del dataset cuyo estado se usa.
+        descargar_clima (bool): Descargar los días que falten en el almacén horario.
+
+    Devuelve:
+        DataFrame: Por piloto, POINTS (puntos sumados en las carreras simuladas, media),
+            POINTS STANDINGS (clasificación final, media), WINS (media), P WIN
+            (probabilidad de ganar al menos una carrera) y P CHAMPION, ordenado por POINTS STANDINGS.
+            Incluye a los pilotos del estado con puntos en la temporada de la última
+            carrera aunque no la disputen; P CHAMPION se reparte entre los de esa temporada.
+    """
+    race_ids = [int(race_id) for race_id in race_ids]
+    filas, (estado_pilotos, estado_constructores, _) = construir_filas(race_ids, artefacto, min_year, descargar_clima)
+    if residuos is None:
+        residuos = residuos_modelo(artefacto)
+    residuos = np.asarray(residuos, dtype=float)
+    anios = leer_tabla('races', ['raceId', 'year'], race_ids=race_ids).set_index('raceId')['year']
+    rng = np.random.default_rng(semilla)
+
+    # --- 1. Estado inicial como arrays (simulaciones x pilotos/constructores) ---
+    # Pilotos de las carreras más los que ya puntúan en la temporada de la última
+    # (p. ej. sustituidos a mitad de año): también cuentan para el campeonato
+    anio_final = anios[race_ids[-1]]
+    pilotos = np.union1d(filas['DRIVERID'].unique(), estado_pilotos.index[estado_pilotos['YEAR'] == anio_final])
+    constructores = np.sort(filas['CONSTRUCTORID'].unique())
+    S = n_simulaciones
+    pil = indices_estado(pilotos, estado_pilotos, ['LAST POSITION', 'POINTS STANDINGS', 'WINS CAREER', 'WINS SEASON', 'YEAR'],
+                         {'LAST POSITION': 21, 'POINTS STANDINGS': 0, 'WINS CAREER': 0, 'WINS SEASON': 0, 'YEAR': -1})
+    con = indices_estado(constructores, estado_constructores, ['CONSTRUCTOR POINTS', 'WINS SEASON', 'YEAR'],
+                         {'CONSTRUCTOR POINTS': 0, 'WINS SEASON': 0, 'YEAR': -1})
+    pil = {col: np.tile(valores, (S, 1)) for col, valores in pil.items()}
+    con = {col: np.tile(valores, (S, 1)) for col, valores in con.items()}
+    puntos_simulados = np.zeros((S, len(pilotos)))
+    victorias_simuladas = np.zeros((S, len(pilotos)))
+
+    # --- 2. Carrera a carrera ---
+    for race_id in race_ids:
+        carrera = filas[filas['RACEID'] == race_id].reset_index(drop=True)
+        m = len(carrera)
+        anio = anios[race_id]
+        p = np.searchsorted(pilotos, carrera['DRIVERID'].to_numpy())
+        c = np.searchsorted(constructores, carrera['CONSTRUCTORID'].to_numpy())
+
+        # Compañero de cada fila (no depende de los resultados): índice de su fila o -1
+        companero = calcular_posicion_companero(
+            carrera, carrera.assign(FILA=np.arange(m)).sort_values(['RACEID', 'DRIVERID']),
+            ['RACEID', 'CONSTRUCTORID'], 'FILA', defecto=-1
+        ).to_numpy()
+
+        # Features dinámicas de las S simulaciones, igual que calcular_features_desde_estado
+        ultima = pil['LAST POSITION'][:, p]
+        dinamicas = {
+            'DRIVER LAST POSITION': ultima,
+            'MATE LAST POSITION': np.where(companero >= 0, ultima[:, companero], 21),
+            'POINTS BEFORE GP': pil['POINTS STANDINGS'][:, p],
+            'WINS CAREER': pil['WINS CAREER'][:, p],
+            'WINS SEASON': np.where(pil['YEAR'][:, p] == anio, pil['WINS SEASON'][:, p], 0),
+            'CONSTRUCTOR POINTS BEFORE GP': con['CONSTRUCTOR POINTS'][:, c],
+            'CONSTRUCTOR WINS SEASON': np.where(con['YEAR'][:, c] == anio, con['WINS SEASON'][:, c], 0),
+        }
+        X = pd.DataFrame(np.tile(carrera[artefacto['columnas']].to_numpy(dtype=float), (S, 1)),
+                         columns=artefacto['columnas'])
+        for col, valores in dinamicas.items():
+            if col in X.columns:
+                X[col] = valores.reshape(-1)
+
+        # Una sola llamada a predict para todas las simulaciones
+        tiempos = artefacto['pipeline'].predict(X).reshape(S, m) + rng.choice(residuos, size=(S, m))
+        posicion = np.empty((S, m), dtype=int)
+        np.put_along_axis(posicion, np.argsort(tiempos, axis=1, kind='stable'), np.arange(1, m + 1), axis=1)
+        puntos = np.where(posicion <= len(PUNTOS), PUNTOS[np.minimum(posicion, len(PUNTOS)) - 1], 0)
+        victoria = (posicion == 1).astype(float)
+
+        # Actualizar el estado de pilotos (como features.actualizar_estado)
+        misma = pil['YEAR'][:, p] == anio
+        pil['POINTS STANDINGS'][:, p] = np.where(misma, pil['POINTS STANDINGS'][:, p], 0) + puntos
+        pil['WINS SEASON'][:, p] = np.where(misma, pil['WINS SEASON'][:, p], 0) + victoria
+        pil['WINS CAREER'][:, p] += victoria
+        pil['LAST POSITION'][:, p] = posicion
+        pil['YEAR'][:, p] = anio
+        puntos_simulados[:, p] += puntos
+        victorias_simuladas[:, p] += victoria
+
+        # ... y de constructores, sumando sus pilotos con una matriz fila -> constructor
+        presentes = np.unique(c)
+        equipo = (c[:, None] == presentes[None, :]).astype(float)
+        misma = con['YEAR'][:, presentes] == anio
+        con['CONSTRUCTOR POINTS'][:, presentes] = np.where(misma, con['CONSTRUCTOR POINTS'][:, presentes], 0) + puntos @ equipo
+        con['WINS SEASON'][:, presentes] = np.where(misma, con['WINS SEASON'][:, presentes], 0) + victoria @ equipo
+        con['YEAR'][:, presentes] = anio
+
+    # --- 3. Resumen por piloto ---
+    clasificacion = pil['POINTS STANDINGS']
+    # Campeón entre los pilotos con puntos de la temporada final (no los de temporadas anteriores)
+    candidatos = np.where(pil['YEAR'] == anio_final, clasificacion, -np.inf)
+    campeon = candidatos == candidatos.max(axis=1, keepdims=True)
+    resumen = pd.DataFrame({
+        'DRIVERID': pilotos,
+        'POINTS': puntos_simulados.mean(axis=0),
+        'POINTS STANDINGS': clasificacion.mean(axis=0),
+        'WINS': victorias_simuladas.mean(axis=0),
+        'P WIN': (victorias_simuladas > 0).mean(axis=0),
+        'P CHAMPION': (campeon / campeon.sum(axis=1, keepdims=True)).mean(axis=0),
+    })
+    return resumen.sort_values('POINTS STANDINGS', ascending=False).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predice varias carreras o simula el resto de una temporada.")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    predecir = subparsers.add_parser('predecir', help="Predice varias carreras con una sola llamada al modelo.")
+    predecir.add_argument('race_ids', type=int, nargs='+', help="Carreras a predecir.")
+    predecir.add_argument('--salida', default=None, help="Opcional, CSV donde guardar la predicción.")
+
+    simular = subparsers.add_parser('simular', help="Simulación Monte Carlo de varias carreras seguidas.")
+    simular.add_argument('race_ids', type=int, nargs='+', help="Carreras a simular, en orden.")
+    simular.add_argument('--simulaciones', type=int, default=1000, help="Temporadas simuladas.")
+    simular.add_argument('--semilla', type=int, default=42, help="Semilla del generador aleatorio.")
+    simular.add_argument('--salida', default=None, help="Opcional, CSV donde guardar el resumen.")
+
+    for subparser in (predecir, simular):
+        subparser.add_argument('--modelo', default=MODEL_FILE, help="Ruta del modelo guardado.")
+        subparser.add_argument('--sin-descarga', action='store_true',
+                               help="Usar solo el clima que ya está en el almacén horario.")
+    args = parser.parse_args()
+
+    artefacto = cargar_modelo(args.modelo)
+    inicio = time.perf_counter()
+    if args.comando == 'predecir':
+        resultado = predecir_carreras(args.race_ids, artefacto, descargar_clima=not args.sin_descarga)
+    else:
+        resultado = simular_temporada(args.race_ids, artefacto, n_simulaciones=args.simulaciones,
+                                      semilla=args.semilla, descargar_clima=not args.sin_descarga)
+    duracion = time.perf_counter() - inicio
+    print(resultado.to_string(index=False))
+    print(f"\n{len(args.race_ids)} carreras en {duracion:.2f} s")
+    if args.salida:
+        resultado.to_csv(args.salida, index=False)
@@ -1,11 +1,47 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 import openmeteo_requests
 import requests_cache
 from retry_requests import retry
 import os
 
+from clima import (
+    ALMACEN_FILE,
+    CLIMA_FILE,
+    VARIABLES_HORARIAS,
+    VENTANAS_FILE,
+    buscar_dias,
+    cargar_almacen,
+    clima_diario_carreras,
+    clima_ventanas_carreras,
+    dias_ventanas,
+    guardar_almacen,
+    incorporar_dias,
+    ubicar_carreras,
+)
+
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+
+# Máximo de días por petición: Open-Meteo cuenta las peticiones largas como varias
+# llamadas, así que no se pide el rango entero entre la primera y la última carrera
+MAX_DIAS_PETICION = 31
+
+class LimiteUsoError(Exception):
+    """Open-Meteo ha respondido HTTP 429 (límite de uso); la lanza el `pedir` de la descarga"""
+
+def detectar_limite_uso(response, *args, **kwargs):
+    """Hook de requests: convierte las respuestas HTTP 429 en LimiteUsoError"""
+    if response.status_code == 429:
+        raise LimiteUsoError(f"HTTP 429 en {response.url}")
+
 # Setup the Open-Meteo API client with cache and retry on error
 cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
+cache_session.hooks['response'].append(detectar_limite_uso)
 retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
 openmeteo = openmeteo_requests.Client(session=retry_session)
 
@@ -30,67 +66,209 @@ def download_kaggle_data():
     else:
         print("Los datos ya existen localmente")
 
-def load_race_data():
-    """Carga las carreras filtradas por raceId"""
+def load_race_data(desde_year=2014):
+    """Carga las carreras ya disputadas desde desde_year, con las coordenadas de su circuito"""
     print("\nCargando datos de carreras...")
-    races_df = pd.read_csv('f1_data/races.csv')
-    
-    # Filtrar carreras con raceId entre 948 y 1167
-    filtered_races = races_df[(races_df['raceId'] >= 900) & (races_df['raceId'] <= 1167)]
+    carreras = ubicar_carreras()
+    carreras = carreras[(carreras['year'] >= desde_year) & (carreras['DIA'] < np.datetime64('today', 'D'))]
     
-    print(f"Carreras encontradas: {len(filtered_races)}")
-    return filtered_races[['raceId', 'circuitId', 'date', 'name']]
+    print(f"Carreras encontradas: {len(carreras)}")
+    return carreras.reset_index(drop=True)
+
+def resumir_clima(hourly):
+    """Calcula los agregados diarios a partir de los arrays horarios de VARIABLES_HORARIAS"""
+    wind_speed_100m, temperature_2m, relative_humidity_2m, precipitation, pressure_msl, surface_pressure = (
+        hourly[variable] for variable in VARIABLES_HORARIAS
+    )
+    return {
+        'avg_wind_speed_100m': float(wind_speed_100m.mean()) if len(wind_speed_100m) > 0 else None,
+        'max_wind_speed_100m': float(wind_speed_100m.max()) if len(wind_speed_100m) > 0 else None,
+        'avg_temperature_2m': float(temperature_2m.mean()) if len(temperature_2m) > 0 else None,
+        'max_temperature_2m': float(temperature_2m.max()) if len(temperature_2m) > 0 else None,
+        'min_temperature_2m': float(temperature_2m.min()) if len(temperature_2m) > 0 else None,
+        'avg_humidity': float(relative_humidity_2m.mean()) if len(relative_humidity_2m) > 0 else None,
+        'total_precipitation': float(precipitation.sum()) if len(precipitation) > 0 else None,
+        'avg_pressure_msl': float(pressure_msl.mean()) if len(pressure_msl) > 0 else None,
+        'avg_surface_pressure': float(surface_pressure.mean()) if len(surface_pressure) > 0 else None,
+    }
+
+def pedir_clima_open_meteo(latitude, longitude, start_date, end_date):
+    """
+    Descarga de Open-Meteo los datos horarios (UTC) de un rango de fechas en una ubicación.
+
+    Devuelve:
+        tuple: (horas, hourly), con horas como array datetime64[s] y hourly como
+            {variable: array} para cada una de VARIABLES_HORARIAS.
 
-def load_circuit_data():
-    """Carga datos de circuitos"""
-    print("\nCargando datos de circuitos...")
-    circuits_df = pd.read_csv('f1_data/circuits.csv')
-    return circuits_df[['circuitId', 'lat', 'lng', 'name', 'location', 'country']]
+    Lanza LimiteUsoError si Open-Meteo responde con el límite de uso (HTTP 429).
+    """
+    params = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "start_date": start_date,
+        "end_date": end_date,
+        "hourly": VARIABLES_HORARIAS,
+    }
+    response = openmeteo.weather_api(ARCHIVE_URL, params=params)[0]
+    hourly = response.Hourly()
+    n_horas = (hourly.TimeEnd() - hourly.Time()) // hourly.Interval()
+    horas = (hourly.Time() + np.arange(n_horas) * hourly.Interval()).astype('datetime64[s]')
+    return horas, {variable: hourly.Variables(i).ValuesAsNumpy() for i, variable in enumerate(VARIABLES_HORARIAS)}
 
-def get_weather_data(latitude, longitude, date):
+def get_weather_data(latitude, longitude, date, pedir=pedir_clima_open_meteo):
     """Obtiene datos meteorológicos de Open-Meteo para una fecha y ubicación específica"""
     try:
-        url = "https://archive-api.open-meteo.com/v1/archive"
-        params = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "start_date": date,
-            "end_date": date,
-            "hourly": ["wind_speed_100m", "temperature_2m", "relative_humidity_2m", 
-                      "precipitation", "pressure_msl", "surface_pressure"],
-        }
-        
-        responses = openmeteo.weather_api(url, params=params)
-        response = responses[0]
-        
-        # Process hourly data
-        hourly = response.Hourly()
-        hourly_wind_speed_100m = hourly.Variables(0).ValuesAsNumpy()
-        hourly_temperature_2m = hourly.Variables(1).ValuesAsNumpy()
-        hourly_relative_humidity_2m = hourly.Variables(2).ValuesAsNumpy()
-        hourly_precipitation = hourly.Variables(3).ValuesAsNumpy()
-        hourly_pressure_msl = hourly.Variables(4).ValuesAsNumpy()
-        hourly_surface_pressure = hourly.Variables(5).ValuesAsNumpy()
+        _, hourly = pedir(latitude, longitude, date, date)
         
         # Calcular promedios diarios
-        weather_summary = {
-            'avg_wind_speed_100m': float(hourly_wind_speed_100m.mean()) if len(hourly_wind_speed_100m) > 0 else None,
-            'max_wind_speed_100m': float(hourly_wind_speed_100m.max()) if len(hourly_wind_speed_100m) > 0 else None,
-            'avg_temperature_2m': float(hourly_temperature_2m.mean()) if len(hourly_temperature_2m) > 0 else None,
-            'max_temperature_2m': float(hourly_temperature_2m.max()) if len(hourly_temperature_2m) > 0 else None,
-            'min_temperature_2m': float(hourly_temperature_2m.min()) if len(hourly_temperature_2m) > 0 else None,
-            'avg_humidity': float(hourly_relative_humidity_2m.mean()) if len(hourly_relative_humidity_2m) > 0 else None,
-            'total_precipitation': float(hourly_precipitation.sum()) if len(hourly_precipitation) > 0 else None,
-            'avg_pressure_msl': float(hourly_pressure_msl.mean()) if len(hourly_pressure_msl) > 0 else None,
-            'avg_surface_pressure': float(hourly_surface_pressure.mean()) if len(hourly_surface_pressure) > 0 else None,
-        }
-        
-        return weather_summary
+        return resumir_clima(hourly)
     
     except Exception as e:
         print(f"Error obteniendo datos meteorológicos: {e}")
         return None
 
+def agrupar_peticiones(carreras_df, max_dias=MAX_DIAS_PETICION):
+    """
+    Agrupa las carreras por circuito para pedir en una sola llamada las fechas cercanas.
+
+    Parámetros:
+        carreras_df (DataFrame): Con columnas ['lat', 'lng', 'date'] (y las que se quieran conservar).
+        max_dias (int): Máximo de días que cubre una petición (Open-Meteo pondera las
+            peticiones largas en su límite de uso); con None, una por circuito con
+            todo el rango entre su primera y su última fecha.
+
+    Devuelve:
+        list: Tuplas (lat, lng, fecha_inicio, fecha_fin, carreras_df del grupo).
+    """
+    carreras = carreras_df.assign(DIA=pd.to_datetime(carreras_df['date'])).sort_values(['lat', 'lng', 'DIA'])
+    peticiones = []
+    for (lat, lng), grupo in carreras.groupby(['lat', 'lng'], sort=False):
+        # Nuevo bloque cada vez que el rango superaría max_dias
+        bloque = np.zeros(len(grupo), dtype=int)
+        if max_dias is not None:
+            inicio = grupo['DIA'].iloc[0]
+            for k, dia in enumerate(grupo['DIA']):
+                if (dia - inicio).days >= max_dias:
+                    inicio = dia
+                    bloque[k:] += 1
+        for _, parte in grupo.groupby(bloque, sort=False):
+            peticiones.append((lat, lng, parte['DIA'].min().strftime('%Y-%m-%d'), parte['DIA'].max().strftime('%Y-%m-%d'), parte))
+    return peticiones
+
+def dividir_por_dia(horas, hourly, dias):
+    """Separa los arrays horarios de un rango en los de cada día de dias (datetime64[D])"""
+    inicio = np.searchsorted(horas, dias.astype('datetime64[s]'))
+    fin = np.searchsorted(horas, (dias + np.timedelta64(1, 'D')).astype('datetime64[s]'))
+    return [{variable: valores[a:b] for variable, valores in hourly.items()} for a, b in zip(inicio, fin)]
+
+class LimitadorPeticiones:
+    """Reintentos con espera exponencial; ante un límite de uso (LimiteUsoError) pausa todos los hilos"""
+
+    def __init__(self, reintentos=5, espera_base=1.0):
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.pausa_hasta = 0.0
+        self.lock = threading.Lock()
+
+    def ejecutar(self, funcion, *args):
+        for intento in range(self.reintentos + 1):
+            # Respetar la pausa global si otro hilo ha topado con el límite
+            with self.lock:
+                espera = self.pausa_hasta - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            try:
+                return funcion(*args)
+            except Exception as e:
+                if intento == self.reintentos:
+                    raise
+                espera = self.espera_base * 2 ** intento * (1 + random.random())
+                if isinstance(e, LimiteUsoError):
+                    with self.lock:
+                        self.pausa_hasta = max(self.pausa_hasta, time.monotonic() + espera)
+                else:
+                    time.sleep(espera)
+
+def descargar_horas_carreras(carreras_df, pedir=pedir_clima_open_meteo, concurrencia=8, max_dias=MAX_DIAS_PETICION,
+                             reintentos=5, espera_base=1.0):
+    """
+    Descarga los datos horarios de muchos días (de carrera o de otras sesiones)
+    con peticiones agrupadas por circuito y ejecutadas en paralelo (como máximo
+    `concurrencia` a la vez).
+
+    Parámetros:
+        carreras_df (DataFrame): Con columnas ['lat', 'lng', 'date'], una fila por día.
+        pedir (callable): Descarga (lat, lng, inicio, fin) -> (horas, hourly); por
+            defecto Open-Meteo, sustituible por datos grabados o un servidor local.
+            Debe lanzar LimiteUsoError cuando el servidor responde HTTP 429.
+        concurrencia (int): Número máximo de peticiones simultáneas.
+        max_dias (int): Ver agrupar_peticiones.
+        reintentos (int): Reintentos por petición ante errores.
+        espera_base (float): Segundos de la primera espera entre reintentos.
+
+    Devuelve:
+        dict: {índice de fila en carreras_df: {variable: array horario del día}}; faltan
+            los días cuya petición falló.
+    """
+    limitador = LimitadorPeticiones(reintentos=reintentos, espera_base=espera_base)
+
+    def procesar(peticion):
+        lat, lng, inicio, fin, grupo = peticion
+        try:
+            horas, hourly = limitador.ejecutar(pedir, lat, lng, inicio, fin)
+        except Exception as e:
+            print(f"Error obteniendo datos meteorológicos ({lat}, {lng}, {inicio} - {fin}): {e}")
+            return {}
+        dias = grupo['DIA'].to_numpy().astype('datetime64[D]')
+        return dict(zip(grupo.index, dividir_por_dia(horas, hourly, dias)))
+
+    horarios = {}
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        for resultado in executor.map(procesar, agrupar_peticiones(carreras_df, max_dias=max_dias)):
+            horarios.update(resultado)
+    return horarios
+
+def obtener_clima_carreras(carreras_df, **kwargs):
+    """
+    Obtiene los agregados meteorológicos de muchas carreras (ver descargar_horas_carreras).
+
+    Devuelve:
+        dict: {raceId: resumen de resumir_clima}; faltan las carreras cuya petición falló.
+    """
+    horarios = descargar_horas_carreras(carreras_df, **kwargs)
+    return {int(carreras_df.at[fila, 'raceId']): resumir_clima(hourly) for fila, hourly in horarios.items()}
+
+def actualizar_almacen(carreras_df, ruta=ALMACEN_FILE, max_dias=MAX_DIAS_PETICION, **kwargs):
+    """
+    Descarga solo los días que aún no están en el almacén horario y los añade.
+
+    Parámetros:
+        carreras_df (DataFrame): Con columnas ['lat', 'lng', 'date'], una fila por día.
+        ruta (str): Archivo del almacén.
+        max_dias (int): Ver agrupar_peticiones.
+        **kwargs: Opciones de descargar_horas_carreras (pedir, concurrencia...).
+
+    Devuelve:
+        tuple: (almacen, número de días descargados).
+    """
+    almacen = cargar_almacen(ruta)
+    dias = pd.to_datetime(carreras_df['date']).to_numpy().astype('datetime64[D]')
+    pendientes = carreras_df[buscar_dias(almacen, carreras_df['lat'], carreras_df['lng'], dias) < 0]
+    pendientes = pendientes.drop_duplicates(['lat', 'lng', 'date'], ignore_index=True)
+    if pendientes.empty:
+        return almacen, 0
+
+    horarios = descargar_horas_carreras(pendientes, max_dias=max_dias, **kwargs)
+    descargadas = pendientes.loc[sorted(horarios)]
+    if not descargadas.empty:
+        almacen = incorporar_dias(
+            almacen, descargadas['lat'], descargadas['lng'],
+            pd.to_datetime(descargadas['date']).to_numpy().astype('datetime64[D]'),
+            [horarios[fila] for fila in descargadas.index],
+        )
+        guardar_almacen(almacen, ruta)
+    return almacen, len(descargadas)
+
 def main():
     """Función principal que ejecuta todo el proceso"""
     print("=== Iniciando proceso de recolección de datos F1 ===\n")
@@ -98,47 +276,29 @@ def main():
     # Paso 1: Descargar datos de Kaggle
     download_kaggle_data()
     
-    # Paso 2: Cargar carreras filtradas
+    # Paso 2: Cargar carreras disputadas con las coordenadas de su circuito
     races = load_race_data()
     
-    # Paso 3: Cargar datos de circuitos
-    circuits = load_circuit_data()
-    
-    # Paso 4: Combinar datos de carreras y circuitos
-    print("\nCombinando datos de carreras y circuitos...")
-    merged_data = races.merge(circuits, on='circuitId', suffixes=('_race', '_circuit'))
-    
-    # Paso 5: Obtener datos meteorológicos para cada carrera
+    # Paso 3: Descargar solo los días que faltan en el almacén horario (agrupados por circuito en
+    # bloques de hasta MAX_DIAS_PETICION días, en paralelo):
+    # los de carrera y los que cubren las ventanas de carrera y clasificación
     print("\nObteniendo datos meteorológicos...")
-    all_race_data = []
+    inicio = time.perf_counter()
+    almacen, descargados = actualizar_almacen(pd.concat([races[['lat', 'lng', 'date']], dias_ventanas(races)]),
+                                             max_dias=MAX_DIAS_PETICION)
+    duracion = time.perf_counter() - inicio
+    print(f"✓ {descargados} días nuevos en {duracion:.1f} s; {len(almacen['dia'])} días en '{ALMACEN_FILE}'")
     
-    for idx, row in merged_data.iterrows():
-        print(f"Procesando carrera {idx+1}/{len(merged_data)}: {row['name_race']} - {row['date']}")
-        
-        weather = get_weather_data(row['lat'], row['lng'], row['date'])
-        
-        race_info = {
-            'raceId': int(row['raceId']),
-            'circuitId': int(row['circuitId']),
-            'latitude': float(row['lat']),
-            'longitude': float(row['lng']),
-        }
-        
-        if weather:
-            race_info.update(weather)
-        
-        all_race_data.append(race_info)
-    
-    # Paso 6: Crear DataFrame y exportar
+    # Paso 4: Agregados diarios y por ventana de sesión desde el almacén (sin red) y exportar
     print("\nGenerando archivos de salida...")
-    results_df = pd.DataFrame(all_race_data)
-    
-    # Exportar a CSV
-    results_df.to_csv('f1_weather_data.csv', index=False, encoding='utf-8')
-    print("✓ Datos guardados en 'f1_weather_data.csv'")
+    results_df = clima_diario_carreras()
+    results_df.to_csv(CLIMA_FILE, index=False, encoding='utf-8')
+    print(f"✓ Datos guardados en '{CLIMA_FILE}'")
+    clima_ventanas_carreras(races['raceId']).to_csv(VENTANAS_FILE, index=False, encoding='utf-8')
+    print(f"✓ Ventanas de sesión guardadas en '{VENTANAS_FILE}'")
        
     print(f"\n=== Proceso completado ===")
-    print(f"Total de carreras procesadas: {len(all_race_data)}")
+    print(f"Total de carreras con datos: {len(results_df)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()